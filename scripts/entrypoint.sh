@@ -76,14 +76,20 @@ setup_persistence_dirs() {
     chown root:enc /app/backups
     chmod 775 /app/backups
     
-    # Status file initialization
-    if [ ! -f /app/backups/status.json ]; then
-        echo "{}" > /app/backups/status.json
-        if id "admin" >/dev/null 2>&1; then
-            chown admin:enc /app/backups/status.json
-        fi
-        chmod 664 /app/backups/status.json
-    fi
+    # Backup status, one private directory per user (an old status.json is still read as a fallback)
+    mkdir -p /app/backups/status
+    chown root:enc /app/backups/status
+    chmod 3775 /app/backups/status
+
+    # Sync queue: each user keeps jobs in a directory of their own; sticky so they cannot touch others'
+    mkdir -p /app/backups/queue
+    chown root:enc /app/backups/queue
+    chmod 3775 /app/backups/queue
+}
+
+start_sync_daemon() {
+    log "Starting backup sync daemon..."
+    python3 -u -m enc_server.sync_daemon &
 }
 
 # ==============================================================================
@@ -97,6 +103,7 @@ init_app_users
 setup_ssh_environment
 provision_host_keys
 setup_persistence_dirs
+start_sync_daemon
 
 log "Starting SSH Server..."
 exec /usr/sbin/sshd -D -e \
@@ -14,6 +14,11 @@ setup(
         "PyYAML>=6.0",
         "argon2-cffi>=21.0",
     ],
+    extras_require={
+        # Optional backup codecs, picked up automatically when installed
+        "zstd": ["zstandard>=0.15"],
+        "lz4": ["lz4>=3.0"],
+    },
     entry_points={
         "console_scripts": [
             "enc=enc_server.cli:main",
@@ -15,14 +15,14 @@ class Authentication:
     PERMISSIONS = {
         # ROLE_SUPER_ADMIN: ["*"],
         ROLE_ADMIN: [
-            "status", "server-login", "server-logout", "server-status",
+            "status", "server-login", "server-logout", "server-status", "server-backup-verify",
             "user add", "user list", "user remove", 
             "init", "server-project-init", "server-project-mount", "server-project-unmount", "server-project-sync", "server-project-run",
             "show users", "server-user-create", "server-user-delete", "server-user-list",
-            "server-project-list", "project list", "server-setup-ssh-key"
+            "server-project-list", "project list", "server-setup-ssh-key", "server-kdf-calibrate"
         ],
         ROLE_DEV: [
-            "status", "server-login", "server-logout", "server-status",
+            "status", "server-login", "server-logout", "server-status", "server-backup-verify",
             "init", "server-project-init", "server-project-mount", "server-project-unmount", "server-project-sync", "server-project-run",
             "server-project-list", "project list", "server-project-remove", "server-setup-ssh-key"
         ]
@@ -0,0 +1,160 @@
+import gzip
+import math
+from collections import Counter
+
+# Optional codecs: used when the library is installed (pip install enc-server[zstd,lz4])
+try:
+    from compression import zstd as _zstd_std  # Python 3.14+
+except ImportError:
+    _zstd_std = None
+try:
+    import zstandard as _zstandard
+except ImportError:
+    _zstandard = None
+try:
+    import lz4.frame as _lz4frame
+except ImportError:
+    _lz4frame = None
+
+
+class Codec:
+    """Compression codec applied to a single backup chunk. `id` is stored per chunk."""
+    name = None
+    id = None
+
+    def available(self) -> bool:
+        return True
+
+    def compress(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+    def decompress(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+
+class StoreCodec(Codec):
+    name = "store"
+    id = 0
+
+    def compress(self, data: bytes) -> bytes:
+        return data
+
+    def decompress(self, data: bytes) -> bytes:
+        return data
+
+
+class GzipCodec(Codec):
+    name = "gzip"
+    id = 1
+    level = 6
+
+    def compress(self, data: bytes) -> bytes:
+        return gzip.compress(data, compresslevel=self.level, mtime=0)
+
+    def decompress(self, data: bytes) -> bytes:
+        return gzip.decompress(data)
+
+
+class ZstdCodec(Codec):
+    name = "zstd"
+    id = 2
+    level = 3
+
+    def available(self) -> bool:
+        return _zstd_std is not None or _zstandard is not None
+
+    def compress(self, data: bytes) -> bytes:
+        if _zstd_std is not None:
+            return _zstd_std.compress(data, level=self.level)
+        return _zstandard.ZstdCompressor(level=self.level).compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        if _zstd_std is not None:
+            return _zstd_std.decompress(data)
+        return _zstandard.ZstdDecompressor().decompress(data)
+
+
+class Lz4Codec(Codec):
+    name = "lz4"
+    id = 3
+
+    def available(self) -> bool:
+        return _lz4frame is not None
+
+    def compress(self, data: bytes) -> bytes:
+        return _lz4frame.compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        return _lz4frame.decompress(data)
+
+
+CODECS = {c.name: c for c in (StoreCodec(), GzipCodec(), ZstdCodec(), Lz4Codec())}
+CODECS_BY_ID = {c.id: c for c in CODECS.values()}
+
+# Preference order when codec is "auto"
+AUTO_PREFERENCE = ["zstd", "lz4", "gzip"]
+
+# Bits per byte above which a chunk is treated as incompressible (8.0 = random)
+ENTROPY_THRESHOLD = 7.5
+SAMPLE_SIZE = 4096
+SAMPLE_COUNT = 4
+
+
+def get_codec(name: str) -> Codec:
+    """Return a registered, installed codec by name."""
+    codec = CODECS.get(name)
+    if codec is None:
+        raise ValueError(f"Unknown backup codec '{name}'. Known: {', '.join(CODECS)}")
+    if not codec.available():
+        raise ValueError(f"Backup codec '{name}' is not installed on this host.")
+    return codec
+
+
+def get_codec_by_id(codec_id: int) -> Codec:
+    codec = CODECS_BY_ID.get(codec_id)
+    if codec is None:
+        raise ValueError(f"Unknown codec id {codec_id} in backup chunk.")
+    if not codec.available():
+        raise ValueError(f"Backup codec '{codec.name}' is required to restore but not installed.")
+    return codec
+
+
+def resolve_codec(name: str = "auto") -> Codec:
+    """Map a configured codec name ('auto' or explicit) to the compressor to use."""
+    if name != "auto":
+        return get_codec(name)
+    for candidate in AUTO_PREFERENCE:
+        if CODECS[candidate].available():
+            return CODECS[candidate]
+    return CODECS["store"]
+
+
+def estimate_entropy(data: bytes) -> float:
+    """Shannon entropy (bits per byte) of a few windows spread across data."""
+    if not data:
+        return 0.0
+    if len(data) <= SAMPLE_SIZE * SAMPLE_COUNT:
+        sample = data
+    else:
+        step = (len(data) - SAMPLE_SIZE) // (SAMPLE_COUNT - 1)
+        sample = b"".join(data[i * step:i * step + SAMPLE_SIZE] for i in range(SAMPLE_COUNT))
+    total = len(sample)
+    return -sum((n / total) * math.log2(n / total) for n in Counter(sample).values())
+
+
+def encode_chunk(codec: Codec, data: bytes, sample_entropy: bool) -> bytes:
+    """
+    Return [CODEC_ID u8][BODY]. High-entropy chunks (when sampling) and chunks
+    that do not shrink are stored raw, so ciphertext never pays for compression.
+    """
+    if codec.id != StoreCodec.id and not (sample_entropy and estimate_entropy(data) > ENTROPY_THRESHOLD):
+        body = codec.compress(data)
+        if len(body) < len(data):
+            return bytes([codec.id]) + body
+    return bytes([StoreCodec.id]) + data
+
+
+def decode_chunk(payload: bytes) -> bytes:
+    if not payload:
+        raise ValueError("Empty backup chunk payload.")
+    return get_codec_by_id(payload[0]).decompress(payload[1:])
@@ -7,81 +7,114 @@ import json
 import subprocess
 import threading
 import time
+import fcntl
+import contextlib
 from pathlib import Path
 from .backup_packer import BackupPacker
-from .handlers.local_handler import LocalHandler
-from .handlers.gdrive_handler import GDriveHandler
+from .chunk_store import ChunkStore
+from .backup_manifest import TreeManifest
+from .handlers.base_handler import BaseHandler
+from .handlers.local_handler import copy_file
+from .handlers import HANDLER_TYPES
+from .push_scheduler import PushScheduler
+from .sync_daemon import SyncQueue, SyncDaemon
+from .status_store import StatusStore
+from .handler_health import HealthCache
+from .restore_planner import RestorePlanner
+from .push_ledger import PushLedger
+from .logout_jobs import LogoutJob
 from .debug import debug_log
-from argon2 import PasswordHasher, low_level
+from . import kdf
+from argon2 import PasswordHasher
 import hashlib
 
 class BackupManager:
+    HOME_ROOT = "/home"
     CIPHER_DIR_NAME = ".enc_cipher"
     MOUNT_POINT_NAME = ".enc"
+    CHUNK_STAGING_NAME = ".enc_chunk_staging"
+    # .enc_cipher, renamed at an asynchronous logout until its worker has backed it up
+    LOGOUT_SNAPSHOT_NAME = ".enc_cipher.logout"
+    # Changed cipher files copied aside for an in-session checkpoint
+    CHECKPOINT_STAGING_NAME = ".enc_checkpoint_staging"
+    BACKUP_LOCK_NAME = "backup.lock"
+    # Artifacts no foreground handler stores in place, by SHA-256, until their queued pushes are done
+    OUTGOING_NAME = "outgoing"
+    # Backup modes: "full" re-packs one user_backup.enc, "dedup" uses the chunk store
+    DEFAULT_MODE = "full"
+    # Full mode writes deltas on top of user_backup.enc until a rebase is due
+    TREE_MANIFEST_NAME = "backup_manifest.json"
+    DELTA_PREFIX = "deltas"
+    DEFAULT_REBASE_EVERY = 16 # deltas per chain
+    REBASE_RATIO = 0.5 # ...or once the deltas add up to this fraction of the base
+    HEADER_PROBE_BYTES = 16384 # enough for any backup header
+    PUSH_LEDGER_NAME = "push_ledger.json"
+    HASH_BLOCK = 1024 * 1024
     
     def log(self, msg):
         """Log message and use shared debug_log."""
         debug_log(f"BackupManager: {msg}")
 
-    def _update_status(self, handler_name, available=None, status=None):
-        """Update persistent status in /app/backups/status.json."""
-        status_file = Path("/app/backups/status.json")
+    def _update_status(self, handler_name, available=None, status=None, verified=None, progress=None):
+        """Update this user's persistent backup status (see StatusStore)."""
         try:
-            data = {}
-            if status_file.exists():
-                with open(status_file, 'r') as f:
-                    content = f.read().strip()
-                    if content:
-                        data = json.loads(content)
-            
-            user_data = data.get(self.username, {})
-            handler_data = user_data.get(handler_name, {"available": False, "status": "None"})
-            
-            if available is not None:
-                handler_data["available"] = available
-            if status is not None:
-                handler_data["status"] = status
-            
-            user_data[handler_name] = handler_data
-            data[self.username] = user_data
-            
-            # Atomic save
-            temp_file = status_file.with_suffix(".tmp")
-            with open(temp_file, 'w') as f:
-                json.dump(data, f, indent=2)
-            temp_file.replace(status_file)
+            self.status_store.update(self.username, handler_name, available=available, status=status,
+                                     last_verify=verified, progress=progress)
         except Exception as e:
-            self.log(f"Error updating status.json: {e}")
+            self.log(f"Error updating backup status: {e}")
     
-    def __init__(self, username):
+    def __init__(self, username, verify_handlers=True):
         self.username = username
-        self.home = Path(f"/home/{username}")
+        self.home = Path(self.HOME_ROOT) / username
         self.enc_mount = self.home / self.MOUNT_POINT_NAME
         self.enc_cipher = self.home / self.CIPHER_DIR_NAME
+        self.logout_snapshot = self.home / self.LOGOUT_SNAPSHOT_NAME
         self.config_dir = self.home / ".enc_config"
         self.user_config_file = self.config_dir / "user.yml"
+        self.kdf_params_file = self.config_dir / kdf.USER_PARAMS_NAME
+        self.tree_manifest_file = self.config_dir / self.TREE_MANIFEST_NAME
+        self.ledger = PushLedger(self.config_dir / self.PUSH_LEDGER_NAME)
+        self._tokens = {} # (password, params) -> derived token, so Argon2 runs once per login
+        self.job = None # LogoutJob this instance works for, if it is a background logout worker
+        self.status_store = StatusStore()
+        self.health = HealthCache(username, self.status_store)
         
-        self.packer = BackupPacker()
         self.backup_configs = self._get_backup_config() or {}
+        self.backup_mode = self.backup_configs.get("mode", self.DEFAULT_MODE)
+        self.packer = BackupPacker(codec=self.backup_configs.get("codec", "auto"),
+                                   workers=self.backup_configs.get("workers"))
         self.handlers = {}
         self.handler_statuses = {}
         
-        # Initialize configured handlers
+        # Initialize configured handlers (scalar entries such as 'mode'/'codec'/'workers' are options)
         for key, config in self.backup_configs.items():
-            if key == "local":
-                self.handlers[key] = LocalHandler(config)
-            elif key == "gdrive":
-                self.handlers[key] = GDriveHandler(config)
-            
-            if key in self.handlers:
-                is_ok = self.handlers[key].verify()
+            if not isinstance(config, dict):
+                continue
+            handler_type = HANDLER_TYPES.get(config.get("type", key))
+            if handler_type is None:
+                self.log(f"Warning: Unknown backup handler type for '{key}'.")
+                continue
+            self.handlers[key] = handler_type(config, config_dir=str(self.config_dir))
+
+            if not verify_handlers:
+                # Caller already verified them (e.g. the background sync after logout)
+                self.handler_statuses[key] = "connected"
+            else:
+                # Remote handlers answer from cache and refresh in the background
+                is_ok = self.health.check(key, self.handlers[key])
                 self.handler_statuses[key] = "connected" if is_ok else "disconnected"
-                self._update_status(key, available=is_ok) # Persist availability
                 if not is_ok:
                     self.log(f"Warning: Backup handler '{key}' is disconnected or inaccessible.")
                 else:
                     self.log(f"Backup handler '{key}' connected.")
 
+    def _handler_order(self, background=None):
+        """Connected handlers, foreground ones (e.g. local disks) first, in config order."""
+        keys = [k for k in self.handlers if self._connected(k)]
+        if background is not None:
+            return [k for k in keys if self.handlers[k].background == background]
+        return sorted(keys, key=lambda k: self.handlers[k].background)
+
     def _get_backup_config(self):
         if self.user_config_file.exists():
             with open(self.user_config_file) as f:
@@ -89,15 +122,27 @@ class BackupManager:
                 return cfg.get("backup")
         return None
 
-    def _get_handler(self, backup_config):
-        for key in ["local", "gdrive"]:
-             if key in backup_config:
-                 return self.handlers.get(key), backup_config[key]
-        return None, None
-
     def perform_restore_and_mount(self, system_password):
         """Restore backup and mount vault. Prioritize local, then remote."""
         self.log(f"Attempting restore for user {self.username}...")
+
+        if self._settle_logout():
+            try:
+                system_password = self._derive_system_password(system_password)
+                self._mount_enc(system_password)
+            except Exception:
+                # Wrong password or a failed mount: the snapshot holds unsaved work; keep it for the next login
+                self.log(f"Mount failed; putting the cipher tree back to {self.logout_snapshot}.")
+                os.rename(self.enc_cipher, self.logout_snapshot)
+                raise
+            self._cache_vault_token(system_password)
+            for key in self.handlers:
+                self._update_status(key, status="mounted")
+            return {
+                "status": "success",
+                "source": "logout-snapshot",
+                "handler_statuses": self.handler_statuses
+            }
         
         if not self.backup_configs:
             self.log("No backup configuration found. Initializing fresh.")
@@ -109,114 +154,190 @@ class BackupManager:
                 "message": "Initialized fresh environment"
             }
 
-        user_backup_file = self.home / "user_backup.enc"
-        restored = False
-        source = "none"
-
-        # 1. Try Local First
-        if "local" in self.handlers and self.handler_statuses["local"] == "connected":
-            handler = self.handlers["local"]
-            if handler.pull(str(user_backup_file)):
-                self.log("Backup pulled from local storage.")
-                restored = True
-                source = "local"
-
-        # 2. Try GDrive if local failed
-        if not restored and "gdrive" in self.handlers and self.handler_statuses["gdrive"] == "connected":
-            handler = self.handlers["gdrive"]
-            if handler.pull(str(user_backup_file)):
-                self.log("Backup pulled from Google Drive.")
-                restored = True
-                source = "gdrive"
-
-        if restored:
-             if not system_password:
-                 self.log("ERROR: Backup found but no password provided for restoration.")
-                 raise ValueError("Backup restoration requires a password.")
+        if self.backup_mode == "dedup":
+            return self._restore_from_chunk_store(system_password)
+
+        candidates = self._plan_restore()
+        if system_password and candidates:
+            token = self._derive_system_password(system_password)
+            if self._warm_tree(token, candidates[0]):
+                # Quick re-login or dropped connection: nothing to pull, decrypt or extract
+                self.log(f"Cipher tree on disk matches the newest backup on '{candidates[0]['handler']}'; mounting it as is.")
+                self._mount_enc(token)
+                self._cache_vault_token(token)
+                for key in self.handlers:
+                    self._update_status(key, status="mounted")
+                return {
+                    "status": "success",
+                    "source": candidates[0]["handler"],
+                    "warm": True,
+                    "handler_statuses": self.handler_statuses
+                }
+
+        # Newest copy first, fastest source among equally new ones. Local copies are read in
+        # place; remote ones are decrypted and extracted while they download.
+        with self._open_backup(stream=True, candidates=candidates) as (source, handler, backup_stream):
+            if source:
+                 if not system_password:
+                     self.log("ERROR: Backup found but no password provided for restoration.")
+                     raise ValueError("Backup restoration requires a password.")
              
-             try:
-                 # Ensure no stale state exists
-                 if os.path.ismount(str(self.enc_mount)):
-                     self.log("Stale mount detected. Unmounting...")
-                     subprocess.run(["fusermount", "-u", str(self.enc_mount)], check=False)
-
-                 if self.enc_cipher.exists():
-                     self.log(f"Cleaning up existing cipher directory {self.enc_cipher}...")
-                     shutil.rmtree(self.enc_cipher, ignore_errors=True)
-
-                 # Decrypt/Unpack
-                 self.packer.unpack(str(user_backup_file), str(self.home), self._derive_system_password(system_password))
-                 self.log("Decrypted and unpacked successfully.")
+                 try:
+                     # Ensure no stale state exists
+                     if os.path.ismount(str(self.enc_mount)):
+                         self.log("Stale mount detected. Unmounting...")
+                         subprocess.run(["fusermount", "-u", str(self.enc_mount)], check=False)
+
+                     if self.enc_cipher.exists():
+                         self.log(f"Cleaning up existing cipher directory {self.enc_cipher}...")
+                         shutil.rmtree(self.enc_cipher, ignore_errors=True)
+
+                     # A fresh host has no pinned vault KDF parameters; take them from the backup header
+                     if not self.kdf_params_file.exists():
+                         head = handler.read_head(BaseHandler.BACKUP_NAME, self.HEADER_PROBE_BYTES)
+                         vault_kdf = self.packer.parse_header(head).get("vault_kdf") if head else None
+                         if vault_kdf:
+                             self._pin_kdf_params(vault_kdf)
+
+                     # Argon2 runs once here; unpack, mount and the token cache all reuse the derived token
+                     system_password = self._derive_system_password(system_password)
+
+                     # Deltas are fetched and authenticated before the base is touched
+                     try:
+                         base = self._survey(source)[0]
+                     except Exception:
+                         base = None
+                     with self._staged_deltas(handler, base, system_password) as deltas:
+                         # Decrypt/Unpack
+                         index = self.packer.unpack_stream(backup_stream, str(self.home), system_password)
+                         self.log("Decrypted and unpacked successfully.")
+                         self._replay_deltas(index, system_password, deltas)
                  
-                 # Now Mount
-                 self._mount_enc(system_password) # _mount_enc will handle derivation
+                     # Now Mount
+                     self._mount_enc(system_password)
                  
-                 # Save derived password to secure token file inside the mounted vault
-                 self._cache_vault_token(system_password)
+                     # Save derived password to secure token file inside the mounted vault
+                     self._cache_vault_token(system_password)
 
-                 # Update status to mounted for all configured handlers
-                 for key in self.handlers:
-                     self._update_status(key, status="mounted")
+                     # Update status to mounted for all configured handlers
+                     for key in self.handlers:
+                         self._update_status(key, status="mounted")
 
-                 # Cleanup temporary backup file after successful mount
-                 if os.path.exists(user_backup_file):
-                    os.remove(user_backup_file)
-                 
-                 return {
-                     "status": "success", 
-                     "source": source,
-                     "handler_statuses": self.handler_statuses
-                 }
+                     return {
+                         "status": "success", 
+                         "source": source,
+                         "handler_statuses": self.handler_statuses
+                     }
 
-             except Exception as e:
-                 self.log(f"Restore Error: {e}")
-                 raise
-        else:
-            self.log("No backup found or handlers disconnected. Trying fresh init.")
-            self._init_fresh_enc(system_password)
-            return {
-                "status": "success", 
-                "source": "none", 
-                "handler_statuses": self.handler_statuses,
-                "message": "No backup found or disconnected, initialized fresh"
-            }
+                 except Exception as e:
+                     self.log(f"Restore Error: {e}")
+                     raise
 
-    def perform_backup_and_unmount(self, system_password=None):
-        """Unmount and backup vault. Prioritize local, then background remote."""
-        
+        self.log("No backup found or handlers disconnected. Trying fresh init.")
+        self._init_fresh_enc(system_password)
+        return {
+            "status": "success", 
+            "source": "none", 
+            "handler_statuses": self.handler_statuses,
+            "message": "No backup found or disconnected, initialized fresh"
+        }
+
+    def _logout_token(self, system_password):
         # Try to retrieve cached password if not provided
         if not system_password:
-             try:
-                 token_file = self.enc_mount / "system" / ".vault_token"
-                 if token_file.exists():
-                     with open(token_file, "r") as f:
-                         system_password = f.read().strip()
-                     self.log("Retrieved vault password token from secure cache.")
-                 else:
-                     self.log("Vault token not found in cache.")
-             except Exception as e:
-                 self.log(f"Warning: Failed to read cached password: {e}")
-        else:
-            # If provided raw, derive it
-            system_password = self._derive_system_password(system_password)
+            return self._read_cached_token()
+        # If provided raw, derive it
+        return self._derive_system_password(system_password)
 
-        self.log(f"Attempting backup for user {self.username}...")
-        results = {"local": "skipped", "gdrive": "skipped"}
-        
-        # 1. Unmount
+    def _unmount_vault(self):
+        """Unmount .enc; returns the error message if that failed."""
         if os.path.ismount(str(self.enc_mount)):
             self.log("Unmounting .enc...")
             try:
                 subprocess.run(["fusermount", "-u", str(self.enc_mount)], check=True)
             except subprocess.CalledProcessError as e:
                 self.log(f"Unmount failed: {e}. Cannot backup safely.")
-                return {
-                    "status": "error", 
-                    "message": f"Unmount failed: {e}", 
-                    "backups": results,
-                    "handler_statuses": self.handler_statuses
-                }
+                return f"Unmount failed: {e}"
+        return None
+
+    def perform_backup_and_unmount(self, system_password=None):
+        """Unmount and backup vault. Prioritize local, then background remote."""
+        system_password = self._logout_token(system_password)
+
+        self.log(f"Attempting backup for user {self.username}...")
+        results = {key: "skipped" for key in self.handlers}
+        
+        # 1. Unmount (record plaintext -> cipher names first, for partial restores)
+        aliases = self._plaintext_aliases()
+        error = self._unmount_vault()
+        if error:
+            return {
+                "status": "error", 
+                "message": error, 
+                "backups": results,
+                "handler_statuses": self.handler_statuses
+            }
+        return self._backup_cipher(system_password, aliases, results)
+
+    def start_backup_and_unmount(self, system_password=None):
+        """
+        Asynchronous logout: unmount, set the cipher tree aside by rename and return a
+        job ID at once. Packing and pushing continue in a background worker (see
+        LogoutJob); server-status reports its progress and the next login waits for it.
+        """
+        system_password = self._logout_token(system_password)
+        job = LogoutJob(self.config_dir)
+        if not system_password or not self.backup_configs or job.running():
+            # Nothing to hand off (or a worker still busy): the synchronous path reports it
+            return self.perform_backup_and_unmount(system_password)
+
+        self.log(f"Attempting background backup for user {self.username}...")
+        aliases = self._plaintext_aliases()
+        error = self._unmount_vault()
+        if error:
+            return {"status": "error", "message": error, "handler_statuses": self.handler_statuses}
+        if not self.enc_cipher.exists() or self.logout_snapshot.exists():
+            return self._backup_cipher(system_password, aliases, {key: "skipped" for key in self.handlers})
+
+        # Renamed, not copied: the tree is immutable from here on and the rename is instant
+        with self._backup_lock():
+            os.rename(self.enc_cipher, self.logout_snapshot)
+        try:
+            job_id = job.spawn(self.username, {"token": system_password, "aliases": aliases})
+        except Exception as e:
+            self.log(f"Could not start the background backup ({e}); backing up now.")
+            os.rename(self.logout_snapshot, self.enc_cipher)
+            return self._backup_cipher(system_password, aliases, {key: "skipped" for key in self.handlers})
+        self.log(f"Background backup {job_id} started.")
+        return {
+            "status": "success",
+            "job": job_id,
+            "backups": {key: "pending" for key in self.handlers},
+            "handler_statuses": self.handler_statuses
+        }
+
+    def _settle_logout(self):
+        """
+        Before a login touches .enc_cipher: wait for a background logout still packing,
+        then take back a snapshot it left behind (its backup failed, no foreground
+        handler took it, or keep_cipher is set). Returns True if .enc_cipher now holds that snapshot, which is
+        at least as new as any backup.
+        """
+        job = LogoutJob(self.config_dir)
+        if job.running():
+            self.log("Waiting for the previous logout's backup to finish...")
+            job.wait()
+        if not self.logout_snapshot.exists():
+            return False
+        if self.enc_cipher.exists():
+            self.log(f"Warning: both {self.enc_cipher} and {self.logout_snapshot} exist; leaving the snapshot alone.")
+            return False
+        self.log(f"Recovering the unfinished logout's cipher tree from {self.logout_snapshot}.")
+        os.rename(self.logout_snapshot, self.enc_cipher)
+        return True
 
+    def _backup_cipher(self, system_password, aliases, results):
+        """Steps 2-5 of a logout: pack the unmounted .enc_cipher and push it."""
         if not self.backup_configs:
             self.log("No backup config. Persistence only local.")
             return {
@@ -235,11 +356,10 @@ class BackupManager:
                 "handler_statuses": self.handler_statuses
             }
 
-        user_backup_file = self.home / "user_backup.enc"
-        
         try:
              # 2. Pack
              self.log("Packing .enc_cipher...")
+             self._job_phase("packing")
              if not system_password:
                  self.log("Error: No password provided for backup encryption via CLI or cache.")
                  return {
@@ -248,63 +368,19 @@ class BackupManager:
                      "backups": results,
                      "handler_statuses": self.handler_statuses
                  }
-             self.packer.pack(str(self.enc_cipher), str(user_backup_file), system_password)
-             
-             # 3. Local Backup (High Priority)
-             local_success = False
-             local_backup_path = None
-             if "local" in self.handlers and self.handler_statuses["local"] == "connected":
-                 handler = self.handlers["local"]
-                 self.log("Pushing to local backup...")
-                 if handler.push(str(user_backup_file)):
-                     self.log("Local backup successful.")
-                     local_success = True
-                     results["local"] = "success"
-                     self._update_status("local", status="backuped")
-                     # Determine the path for background threads to use
-                     dest_path = os.path.expanduser(handler.config.get("path", ""))
-                     local_backup_path = os.path.join(dest_path, "user_backup.enc")
-                 else:
-                     self.log("Local backup failed!")
-                     results["local"] = "failed"
-                     self._update_status("local", status="Failed")
-             elif "local" in self.backup_configs:
-                 results["local"] = "disconnected"
-
-             # 4. Security Cleanup (Clean enc_cipher and temp backup file ONLY if local succeeded)
-             if local_success:
-                 self.log("Cleaning up .enc_cipher and temporary backup file.")
-                 shutil.rmtree(self.enc_cipher)
-                 if os.path.exists(user_backup_file):
-                     os.remove(user_backup_file)
-             
-             # 5. Background Remote Backup (e.g. GDrive)
-             if "gdrive" in self.handlers and self.handler_statuses["gdrive"] == "connected":
-                 source_for_remote = local_backup_path if local_success else str(user_backup_file)
-                 self.log(f"Starting background GDrive sync from {source_for_remote}...")
-                 results["gdrive"] = "pending"
-                 self._update_status("gdrive", status="syncing")
-                 
-                 # Use subprocess.Popen to detach from the dying parent process
-                 import sys
-                 cmd = [
-                     sys.executable, "-m", "enc_server.background_sync",
-                     self.username, "gdrive", source_for_remote
-                 ]
-                 subprocess.Popen(
-                     cmd, 
-                     start_new_session=True, # Detach
-                     stdout=subprocess.DEVNULL,
-                     stderr=subprocess.DEVNULL,
-                     close_fds=True,
-                     env=os.environ.copy() # Pass env for rclone config
-                 )
-             elif "gdrive" in self.backup_configs:
-                 results["gdrive"] = "disconnected"
+             if self.backup_mode == "dedup":
+                 return self._backup_to_chunk_store(system_password, results)
+
+             with self._backup_lock():
+                 plan = self._plan_backup(system_password)
+                 # keep_cipher leaves .enc_cipher for the next login to mount as is (see _warm_tree)
+                 self._store_backup(plan, system_password, aliases, results,
+                                    cleanup=not self.backup_configs.get("keep_cipher", False))
 
              return {
                  "status": "success", 
                  "backups": results,
+                 "kind": plan["kind"],
                  "handler_statuses": self.handler_statuses
              }
 
@@ -317,44 +393,909 @@ class BackupManager:
                 "handler_statuses": self.handler_statuses
             }
 
-    def _background_sync_worker(self, handler_name, source_file):
-        """Worker thread for background remote sync with retry logic."""
-        handler = self.handlers.get(handler_name)
+    @contextlib.contextmanager
+    def _backup_lock(self, blocking=True):
+        """
+        Serializes this user's logouts and checkpoints. Yields False instead of waiting
+        when `blocking` is off and someone else holds it.
+        """
+        self.config_dir.mkdir(parents=True, exist_ok=True)
+        fd = os.open(str(self.config_dir / self.BACKUP_LOCK_NAME), os.O_RDONLY | os.O_CREAT, 0o600)
         try:
-            if not handler:
-                debug_log(f"SyncWorker: Handler {handler_name} not found.")
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
                 return
+            yield True
+        finally:
+            os.close(fd)
 
-            max_retries = 10
-            delay = 5 # Start with 5 seconds
-            
-            for i in range(max_retries):
-                debug_log(f"SyncWorker: Attempt {i+1} for {handler_name}...")
+    def checkpoint(self):
+        """
+        In-session backup: write what changed in the mounted vault since the last backup
+        as the next delta (or rebase) without unmounting, so the logout only has the tail
+        left. Changed cipher files are copied aside first (reflinked where the filesystem
+        allows) and the tree is re-scanned afterwards; if anything moved in between, the
+        checkpoint is dropped with status "retry".
+        """
+        results = {key: "skipped" for key in self.handlers}
+        if self.backup_mode != "full":
+            return {"status": "skipped", "message": f"No checkpoints in {self.backup_mode} mode"}
+        # The artifact must land somewhere durable; a loose file in home would be overwritten by the next one
+        if not any(hasattr(self.handlers[k], "local_path") for k in self._handler_order(background=False)):
+            return {"status": "skipped", "message": "No connected local handler to checkpoint into"}
+
+        with self._backup_lock(blocking=False) as locked:
+            if not locked:
+                return {"status": "skipped", "message": "Another backup is running"}
+            if not os.path.ismount(str(self.enc_mount)):
+                return {"status": "skipped", "message": "Vault is not mounted"}
+            token = self._read_cached_token()
+            if not token:
+                return {"status": "error", "message": "No cached vault token"}
+
+            plan = self._plan_backup(token)
+            if plan["kind"] == "unchanged":
+                return {"status": "success", "kind": "unchanged", "backups": results}
+            staging = self.home / self.CHECKPOINT_STAGING_NAME
+            shutil.rmtree(staging, ignore_errors=True)
+            try:
+                self._stage_files(plan, staging)
+                if TreeManifest.scan(str(self.enc_cipher), plan["manifest"]).diff(plan["manifest"]) != ([], []):
+                    self.log("Checkpoint: vault changed while copying, retrying later.")
+                    return {"status": "retry", "message": "Vault changed during the checkpoint"}
+                self.log("Checkpoint of the mounted vault.")
+                self._store_backup(plan, token, self._plaintext_aliases(), results,
+                                   source_dir=staging, cleanup=False)
+            finally:
+                shutil.rmtree(staging, ignore_errors=True)
+        return {"status": "success", "kind": plan["kind"], "backups": results}
+
+    def _stage_files(self, plan, staging):
+        """Copy the entries plan packs (the whole tree for a full backup) from .enc_cipher to staging."""
+        tree = plan["manifest"]
+        entries = plan["files"] if plan["files"] is not None else sorted(tree.dirs | set(tree.files))
+        staging.mkdir(mode=0o700)
+        for rel in entries:
+            src, dst = self.enc_cipher / rel, staging / rel
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            if rel in tree.dirs:
+                dst.mkdir(exist_ok=True)
+            elif src.is_symlink():
+                os.symlink(os.readlink(src), dst)
+            else:
+                copy_file(str(src), str(dst))
+                shutil.copystat(src, dst)
+        # Directory times last, after their contents were written
+        for rel in [e for e in reversed(entries) if e in tree.dirs] + ["."]:
+            shutil.copystat(self.enc_cipher / rel, staging / rel)
+
+    def _store_backup(self, plan, token, aliases, results, source_dir=None, cleanup=True):
+        """
+        Steps 2-5 for a planned backup: pack it (from source_dir, default .enc_cipher),
+        hand it to the foreground handlers, queue the background ones and remember the
+        tree. With `cleanup`, .enc_cipher is removed once a foreground handler holds it.
+        Fills in results per handler.
+        """
+        tree = plan["manifest"]
+        sources = {}
+        for key in self.handlers:
+            if not self._connected(key):
+                results[key] = "disconnected"
+        foreground = self._handler_order(background=False)
+        behind = [k for k in foreground if not self.ledger.current(k, tree.digest())]
+
+        if plan["kind"] == "unchanged":
+            self.log("Vault unchanged since the last backup, nothing to pack.")
+            chain = self.ledger.chain()
+        else:
+            self.log(f"Writing {plan['kind']} backup {plan['name']} "
+                     f"({len(plan['files'] or [])} changed, {len(plan['deleted'])} deleted).")
+            sha256, primary = self._pack_into(plan, token, aliases, source_dir)
+            chain = self._next_chain(plan, sha256)
+            if primary:
+                # Written in place: the primary holds it already and the others copy from there
+                self.ledger.record(primary, plan["name"], sha256, chain)
+                self._record_progress(primary, {"state": "success"})
+                self._prune_deltas(self.handlers[primary], tree.base)
+                sources[plan["name"]] = self.handlers[primary].local_path(plan["name"])
+            else:
+                sources[plan["name"]] = self._outgoing_path(sha256)
+
+        # 3. Foreground handlers (local disks), all at once; each only gets what its ledger lacks
+        self._job_phase("pushing")
+        to_push = [k for k in foreground if not self.ledger.current(k, chain["tree"])]
+        if to_push:
+            self.log(f"Pushing to {', '.join(to_push)}...")
+        synced = self._sync_chain(foreground, chain, sources, tree.base)
+        for key in foreground:
+            results[key] = ("success" if key in behind else "unchanged") if key in synced else "failed"
+
+        # 4. Security Cleanup (Clean enc_cipher ONLY if a foreground handler holds the backup)
+        if synced:
+            # Background pushes read from a local copy that outlives this logout
+            local_copy = plan["name"] and self._local_copy(plan["name"], chain["objects"][plan["name"]])
+            if cleanup:
+                self.log("Cleaning up .enc_cipher.")
+                shutil.rmtree(self.enc_cipher)
+            if local_copy:
+                sources[plan["name"]] = local_copy
+
+        # 5. Background handlers (e.g. GDrive), pushed by the sync daemon
+        background = self._handler_order(background=True)
+        queued = [k for k in background if not self.ledger.current(k, chain["tree"])]
+        for key in background:
+            results[key] = "unchanged"
+        if queued:
+            self.log(f"Queueing background sync to {', '.join(queued)}...")
+            for key in queued:
+                results[key] = "pending"
+                self._update_status(key, status="syncing")
+            stranded = set(queued) - set(self._sync_chain(queued, chain, sources, tree.base, background=True))
+            for key in stranded:
+                results[key] = "failed"
+                self._update_status(key, status="Failed")
+
+        # The next logout diffs against this tree once some handler has (or will have) it
+        if synced or background:
+            tree.save(self.tree_manifest_file, plan["key"])
+            self.ledger.set_chain(chain)
+        self._prune_outgoing()
+
+    def _read_cached_token(self):
+        """Return the derived vault password cached in the mounted vault, if any."""
+        try:
+            token_file = self.enc_mount / "system" / ".vault_token"
+            if token_file.exists():
+                with open(token_file, "r") as f:
+                    token = f.read().strip()
+                self.log("Retrieved vault password token from secure cache.")
+                return token
+            self.log("Vault token not found in cache.")
+        except Exception as e:
+            self.log(f"Warning: Failed to read cached password: {e}")
+        return None
+
+    def verify_backups(self, system_password=None, handler_names=None):
+        """
+        Scrub stored backups: authenticate every chunk on each connected handler
+        without restoring. In full mode that is the full backup and every delta a
+        restore would apply, reported per object under "objects". Local backups are
+        read in place; remote ones are fetched to a temp file first. Results are
+        persisted in the status file.
+        """
+        derived = self._derive_system_password(system_password) if system_password else self._read_cached_token()
+        if not derived:
+            raise ValueError("Backup verification requires a password (or a mounted vault).")
+
+        reports = {}
+        for key in handler_names or list(self.handlers):
+            if not self._connected(key):
+                reports[key] = {"status": "disconnected"}
+                continue
+            handler = self.handlers[key]
+            staging = self.home / self.CHUNK_STAGING_NAME
+            try:
+                if self.backup_mode == "dedup":
+                    shutil.rmtree(staging, ignore_errors=True)
+                    report = ChunkStore(handler, derived).verify(str(staging))
+                else:
+                    report = self._verify_chain(key, handler, derived)
+            except Exception as e:
+                report = {"status": "error", "message": str(e)}
+            finally:
+                shutil.rmtree(staging, ignore_errors=True)
+
+            reports[key] = report
+            if report.get("status") != "ok":
+                # Whatever the ledger says this handler holds can no longer be trusted
+                self.ledger.forget(key)
+            self.log(f"Verify '{key}': {report.get('status')}")
+            self._update_status(key, verified={
+                "status": report.get("status"),
+                "at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "mb_per_s": report.get("mb_per_s"),
+            })
+        return reports
+
+    def _verify_chain(self, key, handler, token):
+        """Scrub handler's full backup and the deltas on top of it; one report per object."""
+        signing_key = TreeManifest.signing_key(token)
+        objects = {}
+        tree = None
+        with handler.source(BaseHandler.BACKUP_NAME, staging_dir=str(self.home)) as backup_file:
+            objects[BaseHandler.BACKUP_NAME] = self.packer.verify(backup_file, token)
+            if objects[BaseHandler.BACKUP_NAME]["status"] == "ok":
+                try:
+                    tree = TreeManifest.from_signed(self.packer.read_index(backup_file, token)["tree"], signing_key)
+                except (ValueError, KeyError, TypeError):
+                    pass # No tree manifest, so no deltas apply on top of it
+        names = self._delta_chain(handler, tree) if tree else []
+        for name in names:
+            try:
+                with handler.source(name, staging_dir=str(self.home)) as delta_file:
+                    report = self.packer.verify(delta_file, token)
+                    if report["status"] == "ok" and tree is not None:
+                        delta_tree = TreeManifest.from_signed(self.packer.read_index(delta_file, token)["tree"],
+                                                              signing_key)
+                        if delta_tree.parent != tree.digest():
+                            report.update(status="corrupt")
+                            report["errors"].append("Does not extend the delta before it")
+                        tree = delta_tree
+            except Exception as e:
+                report = {"status": "error", "message": str(e)}
+            if report["status"] != "ok":
+                # Links past a bad delta cannot be checked; its successors are still authenticated
+                tree = None
+            objects[name] = report
+        # Objects this handler is recorded to hold but that are no longer part of its chain
+        for name in self.ledger.entry(key)["objects"]:
+            if name not in objects:
+                objects[name] = {"status": "missing"}
+
+        statuses = {r["status"] for r in objects.values()}
+        seconds = sum(r.get("seconds", 0) for r in objects.values())
+        total = sum(r.get("bytes", 0) for r in objects.values())
+        return {
+            "status": "corrupt" if statuses & {"corrupt", "missing"} else "error" if "error" in statuses else "ok",
+            "objects": objects,
+            "bytes": total,
+            "seconds": round(seconds, 3),
+            "mb_per_s": round(total / (1024 * 1024) / seconds, 2) if seconds > 0 else None,
+        }
+
+    def _plaintext_aliases(self, depth=2):
+        """
+        Map plaintext vault paths (e.g. 'system', 'vaults/<project>') to their encrypted
+        names under .enc_cipher. gocryptfs passes backing inode numbers through, so a
+        directory and its cipher counterpart share st_ino. Only works while mounted.
+        """
+        if not os.path.ismount(str(self.enc_mount)):
+            return {}
+
+        def walk_dirs(root):
+            found = {}
+            for dirpath, dirs, _ in os.walk(root):
+                rel = os.path.relpath(dirpath, root)
+                level = 0 if rel == "." else rel.count(os.sep) + 1
+                for d in dirs:
+                    path = os.path.join(dirpath, d)
+                    found[os.path.relpath(path, root)] = os.stat(path).st_ino
+                if level + 1 >= depth:
+                    dirs[:] = []
+            return found
+
+        try:
+            cipher_by_inode = {ino: rel for rel, ino in walk_dirs(self.enc_cipher).items()}
+            return {rel: cipher_by_inode[ino] for rel, ino in walk_dirs(self.enc_mount).items()
+                    if ino in cipher_by_inode}
+        except Exception as e:
+            self.log(f"Warning: Could not map vault paths for partial restore: {e}")
+            return {}
+
+    def restore_paths(self, system_password, paths, generation=None):
+        """
+        Restore only some vault paths (e.g. ['vaults/<project>', 'system']) from the
+        newest backup (base plus deltas), or from an older `generation` kept by a
+        local handler, leaving the rest of .enc_cipher untouched.
+        Indexed backups decrypt just the chunks holding those paths.
+        """
+        if not system_password:
+            raise ValueError("Backup restoration requires a password.")
+
+        with self._open_backup(generation) as (source, handler, user_backup_file):
+            if not source:
+                raise FileNotFoundError("No backup found on any connected handler.")
+
+            derived = self._derive_system_password(system_password)
+            index = None
+            try:
+                index = self.packer.read_index(user_backup_file, derived)
+            except ValueError:
+                self.log("Backup has no index; paths are taken as cipher paths and the archive is scanned.")
+            aliases = index.get("aliases", {}) if index else {}
+
+            cipher_paths = [aliases.get(p.strip("/"), p.strip("/")) for p in paths]
+            archive_paths = {f"{self.CIPHER_DIR_NAME}/{c}" for c in cipher_paths}
+            # gocryptfs needs its config and the directory IV of every parent to decrypt names
+            support = {f"{self.CIPHER_DIR_NAME}/gocryptfs.conf", f"{self.CIPHER_DIR_NAME}/gocryptfs.diriv"}
+            for cipher_path in cipher_paths:
+                parts = cipher_path.split("/")
+                for i in range(1, len(parts)):
+                    support.add(f"{self.CIPHER_DIR_NAME}/{'/'.join(parts[:i])}/gocryptfs.diriv")
+            if index:
+                names = {name for name, _ in index["members"]}
+                support &= names
+            archive_paths |= support
+
+            for cipher_path in cipher_paths:
+                # Replace, don't merge, the restored subtree
+                shutil.rmtree(self.enc_cipher / cipher_path, ignore_errors=True)
+
+            try:
+                base = TreeManifest.from_signed(index["tree"], TreeManifest.signing_key(derived)).base
+            except (ValueError, KeyError, TypeError):
+                base = None
+            with self._staged_deltas(handler, base, derived) as deltas:
+                self.packer.unpack(user_backup_file, str(self.home), derived, paths=sorted(archive_paths))
+                self._replay_deltas(index, derived, deltas, paths=archive_paths)
+            self.log(f"Restored {paths} from {source} backup{f' generation {generation}' if generation else ''}.")
+            return {"status": "success", "source": source, "generation": generation, "paths": list(paths)}
+
+    @contextlib.contextmanager
+    def _open_backup(self, generation=None, stream=False, candidates=None):
+        """
+        (handler key, handler, readable path) of the best full backup for the block,
+        or Nones if no connected handler has one. Handlers that can are read in place;
+        others are fetched into the home directory. With `stream`, an open file object
+        is handed out instead, which remote handlers fill while it is being read.
+        With `generation`, the backup is read from a local handler's stored generation.
+        `candidates` reuses a _plan_restore() the caller already made.
+        """
+        with contextlib.ExitStack() as stack:
+            if generation is None:
+                candidates = [(c["handler"], self.handlers[c["handler"]], c["generation"])
+                              for c in (self._plan_restore() if candidates is None else candidates)]
+            else:
+                candidates = [(k, self.handlers[k].at_generation(generation), generation)
+                              for k in self._handler_order() if hasattr(self.handlers[k], "generations")
+                              and generation in self.handlers[k].generations()]
+            for key, handler, label in candidates:
+                opener = handler.open_stream if stream else handler.source
+                try:
+                    path = stack.enter_context(opener(BaseHandler.BACKUP_NAME, staging_dir=str(self.home)))
+                except Exception as e:
+                    self.log(f"Could not read backup from '{key}': {e}")
+                    continue
+                self.log(f"Reading backup from '{key}' (generation {label}).")
+                yield key, handler, path
+                return
+            yield None, None, None
+
+    def _warm_tree(self, token, best):
+        """
+        Whether .enc_cipher can be mounted as it is instead of restored over. The signed
+        manifest of this account's last backup must name the generation of the best
+        candidate, whose handler the push ledger says holds exactly that backup, and the
+        tree on disk must still match it (stat-equal files are not re-read). A vault
+        still mounted from a session that never logged out is kept as it is: its
+        changes are newer than any backup.
+        """
+        if not self.enc_cipher.exists():
+            return False
+        saved = TreeManifest.load(self.tree_manifest_file, TreeManifest.signing_key(token))
+        if saved is None or saved.base is None:
+            return False
+        if tuple(best["generation"]) != (saved.base, saved.seq) or not self.ledger.current(best["handler"], saved.digest()):
+            return False
+        if os.path.ismount(str(self.enc_mount)):
+            return True
+        changed, deleted = TreeManifest.scan(str(self.enc_cipher), saved).diff(saved)
+        if changed or deleted:
+            self.log(f"Cipher tree on disk differs from the last backup ({len(changed)} changed, {len(deleted)} deleted).")
+            return False
+        return True
+
+    def _connected(self, key):
+        return key in self.handlers and self.handler_statuses.get(key) == "connected"
+
+    def _restore_from_chunk_store(self, system_password):
+        """Restore the newest generation from the deduplicating chunk store and mount."""
+        staging = self.home / self.CHUNK_STAGING_NAME
+        for candidate in self._plan_restore():
+            key = candidate["handler"]
+            try:
+                # A fresh host has no pinned vault KDF parameters; take them from the store
+                if not self.kdf_params_file.exists():
+                    vault_kdf = ChunkStore.read_params(self.handlers[key], str(staging))
+                    if vault_kdf:
+                        self._pin_kdf_params(vault_kdf)
+                store_key = self._derive_system_password(system_password) or ""
+                store = ChunkStore(self.handlers[key], store_key)
+            except Exception as e:
+                self.log(f"Chunk store on '{key}' unavailable: {e}")
+                continue
+
+            if not system_password:
+                self.log("ERROR: Backup found but no password provided for restoration.")
+                raise ValueError("Backup restoration requires a password.")
+
+            try:
+                if os.path.ismount(str(self.enc_mount)):
+                    self.log("Stale mount detected. Unmounting...")
+                    subprocess.run(["fusermount", "-u", str(self.enc_mount)], check=False)
+                if self.enc_cipher.exists():
+                    self.log(f"Cleaning up existing cipher directory {self.enc_cipher}...")
+                    shutil.rmtree(self.enc_cipher, ignore_errors=True)
+
+                shutil.rmtree(staging, ignore_errors=True)
+                generation = store.restore(str(self.home), str(staging), candidate["generation"][0])
+                self.log(f"Restored generation {generation} from '{key}' chunk store.")
+
+                self._mount_enc(store_key)
+                self._cache_vault_token(store_key)
+                for handler_key in self.handlers:
+                    self._update_status(handler_key, status="mounted")
+                return {
+                    "status": "success",
+                    "source": key,
+                    "generation": generation,
+                    "handler_statuses": self.handler_statuses
+                }
+            except Exception as e:
+                self.log(f"Restore Error: {e}")
+                raise
+            finally:
+                shutil.rmtree(staging, ignore_errors=True)
+
+        self.log("No backup found or handlers disconnected. Trying fresh init.")
+        self._init_fresh_enc(system_password)
+        return {
+            "status": "success",
+            "source": "none",
+            "handler_statuses": self.handler_statuses,
+            "message": "No backup found or disconnected, initialized fresh"
+        }
+
+    def _backup_to_chunk_store(self, system_password, results):
+        """
+        Incremental backup: push only new chunks plus a generation manifest to the
+        primary handler (first foreground one if connected), then mirror the store to
+        the other foreground handlers and, in the background, to the remote ones.
+        """
+        for key in self.handlers:
+            if not self._connected(key):
+                results[key] = "disconnected"
+
+        primary = next(iter(self._handler_order()), None)
+        if not primary:
+            self.log("No connected backup handler for chunk store. Keeping .enc_cipher.")
+            return {
+                "status": "error",
+                "message": "No connected backup handler",
+                "backups": results,
+                "handler_statuses": self.handler_statuses
+            }
+
+        staging = self.home / self.CHUNK_STAGING_NAME
+        shutil.rmtree(staging, ignore_errors=True)
+        try:
+            store = ChunkStore(self.handlers[primary], system_password)
+            self.log(f"Pushing incremental backup to '{primary}' chunk store...")
+            stats = store.backup(str(self.enc_cipher), str(staging), vault_kdf=self._kdf_params(),
+                                 arcname=self.CIPHER_DIR_NAME)
+            store.prune()
+        except Exception as e:
+            self.log(f"Chunk store backup to '{primary}' failed: {e}")
+            results[primary] = "failed"
+            self._update_status(primary, status="Failed")
+            raise
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+        results[primary] = "success"
+        self._update_status(primary, status="backuped")
+
+        # Security Cleanup: the primary store now holds a complete generation
+        self.log("Cleaning up .enc_cipher.")
+        shutil.rmtree(self.enc_cipher)
+
+        # Mirrors copy sealed objects from the primary's local store
+        if hasattr(self.handlers[primary], "local_path"):
+            source_for_mirror = self.handlers[primary].local_path("")
+            others = [k for k in self._handler_order(background=False) if k != primary]
+            progress = self._push_artifact(others, source_for_mirror)
+            for key in others:
+                results[key] = "success" if progress[key]["state"] == "success" else "failed"
+
+            background = [k for k in self._handler_order(background=True) if k != primary]
+            if background:
+                self.log(f"Queueing background chunk store mirror to {', '.join(background)} from {source_for_mirror}...")
+                for key in background:
+                    results[key] = "pending"
+                    self._update_status(key, status="syncing")
+                self._queue_background_sync(background, source_for_mirror)
+
+        return {
+            "status": "success",
+            "backups": results,
+            "generation": stats["generation"],
+            "chunks": {"total": stats["chunks"], "new": stats["new_chunks"], "uploaded_bytes": stats["new_bytes"]},
+            "handler_statuses": self.handler_statuses
+        }
+
+    def _survey(self, key):
+        """
+        Newest backup state on one handler as (generation, seq), from metadata only:
+        the chunk store's manifest listing, or a full backup's header plus its delta listing.
+        """
+        handler = self.handlers[key]
+        if self.backup_mode == "dedup":
+            generation = ChunkStore.latest_on(handler)
+            if generation is None:
+                raise FileNotFoundError("No backup generations found in chunk store")
+            return (generation, 0)
+
+        head = handler.read_head(BaseHandler.BACKUP_NAME, self.HEADER_PROBE_BYTES)
+        base = None
+        if head is not None:
+            base = (self.packer.parse_header(head).get("generation") or {}).get("base")
+        try:
+            names = handler.list(self.DELTA_PREFIX)
+        except Exception:
+            names = set()
+        if base is None:
+            # Headers from before generations were recorded: old chains are pruned, so any delta names the base
+            bases = [int(n.split(".")[-3]) for n in names if n.split(".")[-3].isdigit()]
+            base = max(bases, default=0)
+        return (base, len(self._delta_chain(handler, TreeManifest(base=base), names)))
+
+    def _plan_restore(self):
+        """Connected handlers holding a backup, best copy first (see RestorePlanner)."""
+        candidates = RestorePlanner(self._survey).plan(self._handler_order())
+        if candidates:
+            self.log("Restore candidates: " + ", ".join(
+                f"{c['handler']} {c['generation']} ({c['seconds']}s)" for c in candidates))
+        return candidates
+
+    @classmethod
+    def delta_name(cls, base, seq):
+        return f"{cls.DELTA_PREFIX}/user_backup.delta.{base}.{seq:06d}.enc"
+
+    def _plan_backup(self, token):
+        """
+        Decide between nothing, a delta and a full rebase by diffing the cipher tree
+        against the signed manifest of the last backup. Unchanged files are not re-hashed.
+        """
+        key = TreeManifest.signing_key(token)
+        previous = TreeManifest.load(self.tree_manifest_file, key)
+        current = TreeManifest.scan(str(self.enc_cipher), previous)
+        rebase_every = int(self.backup_configs.get("rebase_every", self.DEFAULT_REBASE_EVERY))
+
+        intact = bool(previous and previous.base is not None and self._chain_intact(previous, token)
+                      and self._chain_reachable())
+        if intact:
+            changed, deleted = current.diff(previous)
+            if not changed and not deleted and self.ledger.chain()["tree"] == previous.digest():
+                # A read-only session: the last backup already restores to this tree
+                current.base, current.seq, current.parent = previous.base, previous.seq, previous.parent
+                current.base_bytes, current.delta_bytes = previous.base_bytes, previous.delta_bytes
+                return {"kind": "unchanged", "name": None,
+                        "files": [], "deleted": [], "manifest": current, "key": key}
+
+        if intact and previous.seq < rebase_every:
+            delta_bytes = previous.delta_bytes + current.total_bytes(changed)
+            if delta_bytes <= previous.base_bytes * self.REBASE_RATIO:
+                current.base, current.seq = previous.base, previous.seq + 1
+                current.base_bytes, current.delta_bytes = previous.base_bytes, delta_bytes
+                current.parent = previous.digest()
+                return {"kind": "delta", "name": self.delta_name(current.base, current.seq),
+                        "files": changed, "deleted": deleted, "manifest": current, "key": key}
+
+        # Bases are timestamps so a new chain never reuses an old chain's delta names
+        current.base = max(int(time.time()), (previous.base or 0) + 1 if previous else 0)
+        current.base_bytes = current.total_bytes()
+        return {"kind": "full", "name": BaseHandler.BACKUP_NAME,
+                "files": None, "deleted": [], "manifest": current, "key": key}
+
+    def _pack_into(self, plan, token, aliases, source_dir=None):
+        """
+        Pack plan's artifact straight into the first connected foreground handler that
+        stores objects in place (published there by rename), else into the outgoing
+        dir under its SHA-256 (see _outgoing_path). Every artifact gets a path of its
+        own there, so a queued push never reads one that a later backup overwrote.
+        Returns (sha256, key of the handler now holding it or None).
+        """
+        tree = plan["manifest"]
+
+        def pack(output_file):
+            self.packer.pack(str(source_dir or self.enc_cipher), output_file, token, aliases=aliases,
+                             vault_kdf=self._kdf_params(), files=plan["files"], arcname=self.CIPHER_DIR_NAME,
+                             meta={"tree": tree.sign(plan["key"]), "deleted": plan["deleted"]},
+                             generation={"base": tree.base, "seq": tree.seq, "created": int(time.time())})
+            return self._file_sha256(output_file)
+
+        primary = next((k for k in self._handler_order(background=False)
+                        if hasattr(self.handlers[k], "local_path")), None)
+        if primary:
+            try:
+                with self.handlers[primary].sink(plan["name"]) as output_file:
+                    sha256 = pack(output_file)
+                return sha256, primary
+            except Exception as e:
+                self.log(f"Packing into '{primary}' failed ({e}); staging it in {self.OUTGOING_NAME}/ instead.")
+        outgoing = self.config_dir / self.OUTGOING_NAME
+        outgoing.mkdir(mode=0o700, exist_ok=True)
+        tmp_path = outgoing / f".{os.getpid()}.tmp"
+        try:
+            sha256 = pack(str(tmp_path))
+            os.replace(tmp_path, self._outgoing_path(sha256))
+        finally:
+            if tmp_path.exists():
+                os.remove(tmp_path)
+        return sha256, None
+
+    def _outgoing_path(self, sha256):
+        return str(self.config_dir / self.OUTGOING_NAME / f"{sha256}.enc")
+
+    def _queued_sources(self, queue=None):
+        return {item["source"] for job in (queue or SyncQueue()).jobs(self.username) for item in job["items"]}
+
+    def _prune_outgoing(self):
+        """Drop staged artifacts that no queued push reads any more."""
+        outgoing = self.config_dir / self.OUTGOING_NAME
+        try:
+            names = [n for n in os.listdir(outgoing) if n.endswith(".enc")]
+        except FileNotFoundError:
+            return
+        queued = self._queued_sources()
+        for name in names:
+            if str(outgoing / name) not in queued:
+                os.remove(outgoing / name)
+
+    def _release_outgoing(self, source, queue=None):
+        """After a push: delete source if it is a staged artifact nothing else still reads."""
+        if os.path.dirname(source) != str(self.config_dir / self.OUTGOING_NAME) or source in self._queued_sources(queue):
+            return
+        try:
+            os.remove(source)
+        except FileNotFoundError:
+            pass
+
+    def _file_sha256(self, path):
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(self.HASH_BLOCK), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _next_chain(self, plan, sha256):
+        """The backup state plan's artifact completes: a rebase starts over, a delta extends the ledger's chain."""
+        objects = {}
+        if plan["kind"] == "delta":
+            previous = self.ledger.chain()
+            # Chains from before the ledger are not known object by object; the new delta starts the record
+            if previous["tree"] == plan["manifest"].parent:
+                objects = dict(previous["objects"])
+        objects[plan["name"]] = sha256
+        return {"tree": plan["manifest"].digest(), "objects": objects}
+
+    @staticmethod
+    def _chain_order(chain):
+        # The full backup first, then deltas by sequence number
+        return sorted(chain["objects"], key=lambda n: (n != BaseHandler.BACKUP_NAME, n))
+
+    def _local_copy(self, name, sha256):
+        """
+        Path of name on a foreground handler that can be read in place and holds this
+        exact object, else its staged copy while a queued push still needs it.
+        """
+        for key in self._handler_order(background=False):
+            handler = self.handlers[key]
+            if hasattr(handler, "local_path") and self.ledger.holds(key, name, sha256):
+                path = handler.local_path(name)
+                if path and os.path.exists(path):
+                    return path
+        staged = self._outgoing_path(sha256)
+        return staged if os.path.exists(staged) else None
+
+    def _chain_reachable(self):
+        """
+        Whether every connected handler holds, or can still be sent, each object of the
+        ledger's chain. If not (e.g. no local handler and the base was never pushed
+        somewhere), extending the chain would strand that handler: rebase instead.
+        """
+        chain = self.ledger.chain()
+        for name, sha256 in chain["objects"].items():
+            if self._local_copy(name, sha256):
+                continue
+            lacking = [k for k in self._handler_order() if not self.ledger.holds(k, name, sha256)]
+            if lacking:
+                self.log(f"{', '.join(lacking)} lack {name} and no copy is left to send; writing a full backup.")
+                return False
+        return True
+
+    def _sync_chain(self, keys, chain, sources, base, background=False):
+        """
+        Bring handlers up to chain, object by object in chain order, sending each
+        only to the handlers whose ledger lacks it. Objects not in sources are read
+        from a local copy. In the background the pushes are queued for the sync
+        daemon instead. Returns the handlers that hold (or will hold) the whole chain.
+        """
+        pending = list(keys)
+        for name in self._chain_order(chain):
+            sha256 = chain["objects"][name]
+            needed = [k for k in pending if not self.ledger.holds(k, name, sha256)]
+            if not needed:
+                continue
+            source = sources.get(name) or self._local_copy(name, sha256)
+            if source is None:
+                self.log(f"Warning: No local copy of {name} to send to {', '.join(needed)}.")
+                pending = [k for k in pending if k not in needed]
+                continue
+            if background:
+                self._queue_background_sync(needed, source, name, base, chain=chain)
+                continue
+            progress = self._push_artifact(needed, source, name, base, chain=chain)
+            pending = [k for k in pending if k not in needed or progress[k]["state"] == "success"]
+        return pending
+
+    def _chain_intact(self, previous, token):
+        """A delta only makes sense if the local backup still holds previous's chain."""
+        locals_ = [k for k in self._handler_order(background=False) if hasattr(self.handlers[k], "local_path")]
+        # Prefer a disk the ledger says holds that chain (a newly added one is caught up instead)
+        local = next((k for k in locals_ if self.ledger.current(k, previous.digest())), next(iter(locals_), None))
+        if local is None:
+            return True
+        handler = self.handlers[local]
+        try:
+            names = handler.list(self.DELTA_PREFIX)
+            if previous.seq and self.delta_name(previous.base, previous.seq) not in names:
+                return False
+            index = self.packer.read_index(handler.local_path(), token)
+            return TreeManifest.from_signed(index["tree"], TreeManifest.signing_key(token)).base == previous.base
+        except Exception:
+            return False
+
+    def _delta_chain(self, handler, tree, names=None):
+        """Names of the deltas on handler (or among names) that continue tree's chain, in order."""
+        try:
+            names = handler.list(self.DELTA_PREFIX) if names is None else names
+        except Exception:
+            return []
+        prefix = f"{self.DELTA_PREFIX}/user_backup.delta.{tree.base}."
+        seqs = set()
+        for name in names:
+            seq = name[len(prefix):-len(".enc")]
+            if name.startswith(prefix) and name.endswith(".enc") and seq.isdigit():
+                seqs.add(int(seq))
+        chain = []
+        seq = tree.seq + 1
+        while seq in seqs:
+            chain.append(self.delta_name(tree.base, seq))
+            seq += 1
+        return chain
+
+    @contextlib.contextmanager
+    def _staged_deltas(self, handler, base, token):
+        """
+        Fetch the delta chain on top of full backup `base` and authenticate every chunk
+        of it before the caller extracts anything. Yields [(name, path, index, tree)] up
+        to the first delta that cannot be read, is corrupt or does not extend the one
+        before it, so a restore never stops half-way through applying a bad delta.
+        """
+        key = TreeManifest.signing_key(token)
+        with contextlib.ExitStack() as stack:
+            deltas = []
+            names = self._delta_chain(handler, TreeManifest(base=base)) if base is not None else []
+            for name in names:
                 try:
-                    if handler.push(source_file):
-                        debug_log(f"SyncWorker: {handler_name} sync successful.")
-                        self._update_status(handler_name, status="backuped")
-                        return
+                    path = stack.enter_context(handler.source(name, staging_dir=str(self.home)))
+                    report = self.packer.verify(path, token)
+                    if report["status"] != "ok":
+                        raise ValueError("; ".join(report["errors"]) or "corrupt chunks")
+                    index = self.packer.read_index(path, token)
+                    tree = TreeManifest.from_signed(index["tree"], key)
                 except Exception as e:
-                    # Assuming handler.push might raise a specific exception for quota issues
-                    # Or, if handler.push returns False, it might set an internal flag or log a specific message
-                    # For now, we'll check the exception message if it's propagated.
-                    debug_log(f"SyncWorker: {handler_name} push failed with exception: {e}")
-                    if "storageQuotaExceeded" in str(e): # Placeholder for actual error detection
-                        debug_log(f"SyncWorker: {handler_name} storage quota exceeded. Aborting retries.")
-                        self._update_status(handler_name, status="Failed: Quota Exceeded")
-                        return # Abort immediately
-                
-                debug_log(f"SyncWorker: {handler_name} sync failed. Retrying in {delay}s...")
-                time.sleep(delay)
-                delay = min(delay * 2, 300) # Exponential backoff up to 5 mins
-
-            debug_log(f"SyncWorker: {handler_name} sync failed after {max_retries} attempts.")
-            self._update_status(handler_name, status="Failed")
+                    self.log(f"Warning: {name} is unusable ({e}); restoring up to the delta before it.")
+                    break
+                if deltas and tree.parent != deltas[-1][3].digest():
+                    self.log(f"Warning: {name} does not extend {deltas[-1][0]}; restoring up to it.")
+                    break
+                deltas.append((name, path, index, tree))
+            yield deltas
+
+    def _replay_deltas(self, base_index, token, deltas, paths=None):
+        """
+        Apply staged deltas (see _staged_deltas) on top of a freshly unpacked base, then
+        remember the resulting tree for the next logout. Each delta must extend the
+        manifest it was taken against; replay stops at the first one that does not.
+        With `paths` (archive paths), only entries under them are touched and the
+        remembered tree is left alone.
+        """
+        key = TreeManifest.signing_key(token)
+        try:
+            tree = TreeManifest.from_signed(base_index["tree"], key)
+        except (ValueError, KeyError, TypeError):
+            # Backups from before tree manifests: the next logout writes a full rebase
+            if paths is None and self.tree_manifest_file.exists():
+                os.remove(self.tree_manifest_file)
+            return
+
+        def wanted(archive_path):
+            return paths is None or any(archive_path == p or archive_path.startswith(p + "/") for p in paths)
+
+        for name, delta_file, index, delta_tree in deltas:
+            if delta_tree.parent != tree.digest():
+                self.log(f"Warning: {name} does not extend the restored tree; stopping at delta {tree.seq}.")
+                break
+            self._remove_cipher_paths([rel for rel in index.get("deleted", [])
+                                       if wanted(f"{self.CIPHER_DIR_NAME}/{rel}")])
+            if paths is None:
+                self.packer.unpack(delta_file, str(self.home), token)
+            else:
+                members = sorted({m for m, _ in index["members"] if m != self.CIPHER_DIR_NAME and wanted(m)})
+                if members:
+                    self.packer.unpack(delta_file, str(self.home), token, paths=members)
+            tree = delta_tree
+            self.log(f"Applied {name}.")
+        if paths is None:
+            tree.refresh_stat(str(self.enc_cipher))
+            tree.save(self.tree_manifest_file, key)
+
+    def _remove_cipher_paths(self, paths):
+        for rel in paths:
+            path = self.enc_cipher / rel
+            if path.is_dir() and not path.is_symlink():
+                shutil.rmtree(path, ignore_errors=True)
+            elif path.exists() or path.is_symlink():
+                os.remove(path)
+
+    def _prune_deltas(self, handler, base):
+        """Drop deltas that belong to chains other than base's."""
+        try:
+            stale = [n for n in handler.list(self.DELTA_PREFIX)
+                     if not os.path.basename(n).startswith(f"user_backup.delta.{base}.")]
+            if stale:
+                handler.delete_many(stale)
         except Exception as e:
-            debug_log(f"SyncWorker CRITICAL ERROR: {e}")
-            import traceback
-            debug_log(traceback.format_exc())
+            self.log(f"Warning: Failed to prune old deltas: {e}")
+
+    # Backup status for each push state
+    STATUS_BY_STATE = {"running": "syncing", "retrying": "syncing", "success": "backuped", "failed": "Failed"}
+
+    def _job_phase(self, phase):
+        if self.job:
+            self.job.update(phase=phase)
+
+    def _record_progress(self, key, entry):
+        if entry["state"] == "success":
+            # A push that landed is the best health check there is
+            self.health.record(key, True)
+        status = self.STATUS_BY_STATE.get(entry["state"])
+        if entry["state"] == "failed" and entry.get("error") == "Quota Exceeded":
+            status = "Failed: Quota Exceeded"
+        self._update_status(key, status=status, progress=entry)
+
+    def _push_artifact(self, keys, source, name=BaseHandler.BACKUP_NAME, base=None, retries=0, chain=None):
+        """
+        Push one artifact to several handlers concurrently and return their progress.
+        A directory source is a local chunk store to mirror (dedup mode). With a
+        chain, handlers that already hold the artifact (by ledger or by the remote's
+        own checksum) are not sent it again, and each push is recorded in the ledger.
+        After a successful push, deltas of other chains than `base` are pruned there.
+        """
+        sha256 = chain["objects"].get(name) if chain else None
+
+        def job(key):
+            handler = self.handlers[key]
+            def push():
+                if os.path.isdir(source):
+                    return ChunkStore.mirror(source, handler)
+                if sha256 and (self.ledger.holds(key, name, sha256) or handler.checksum(name, size) == sha256):
+                    self.log(f"'{key}' already holds {name}, not sending it again.")
+                elif not handler.push(source, name):
+                    return False
+                if sha256:
+                    self.ledger.record(key, name, sha256, chain)
+                if base is not None:
+                    self._prune_deltas(handler, base)
+                return True
+            return push
+
+        size = os.path.getsize(source) if os.path.isfile(source) else None
+        scheduler = PushScheduler(on_update=self._record_progress)
+        return scheduler.run({key: job(key) for key in keys}, size=size, retries=retries)
+
+    def _queue_background_sync(self, handler_names, source, name=BaseHandler.BACKUP_NAME, base=None, chain=None):
+        """Queue pushes to the given handlers for the sync daemon, starting it if needed."""
+        # Deltas extend what is already queued; anything else supersedes it
+        replace = not name.startswith(f"{self.DELTA_PREFIX}/")
+        queue = SyncQueue()
+        for key in handler_names:
+            queue.enqueue(self.username, key, source, name, base, replace=replace, chain=chain)
+        SyncDaemon.ensure_running(self.username)
 
     def _init_fresh_enc(self, password=None):
         """Initialize a fresh encrypted environment if missing, then mount."""
@@ -362,13 +1303,17 @@ class BackupManager:
             self.log("Initializing fresh encrypted vault...")
             self.enc_cipher.mkdir(mode=0o700, parents=True)
             p = password if password else getpass.getpass("Set vault password: ")
+
+            # New vaults use this host's calibrated KDF parameters, pinned for the user
+            if not self.kdf_params_file.exists() and not self._pin_kdf_params(kdf.host_params()):
+                self.log("Falling back to legacy KDF parameters for the new vault.")
             
             derived_p = self._derive_system_password(p)
             self.log("Running gocryptfs -init...")
             subprocess.run(["gocryptfs", "-init", "-quiet", "-scryptn", "10", str(self.enc_cipher)], 
                            input=derived_p.encode(), check=True)
-            self._mount_enc(p)
-            self._cache_vault_token(p)
+            self._mount_enc(derived_p)
+            self._cache_vault_token(derived_p)
         else:
             self.log("Cipher directory exists. Ensuring it's mounted.")
             self._mount_enc(password)
@@ -402,6 +1347,24 @@ class BackupManager:
             self.log(f"STDERR: {e.stderr}")
             raise
 
+    def _kdf_params(self):
+        """Argon2id parameters of this user's vault (legacy ones if never pinned)."""
+        try:
+            return kdf.load_params(self.kdf_params_file) or dict(kdf.LEGACY_PARAMS)
+        except (OSError, ValueError) as e:
+            self.log(f"Warning: Invalid KDF parameters in {self.kdf_params_file}: {e}")
+            return dict(kdf.LEGACY_PARAMS)
+
+    def _pin_kdf_params(self, params):
+        """Persist the vault KDF parameters. The vault password depends on them forever."""
+        try:
+            kdf.save_params(self.kdf_params_file, params)
+            self.log(f"Vault KDF parameters pinned: {kdf.normalize(params)}")
+            return True
+        except (OSError, ValueError) as e:
+            self.log(f"Warning: Failed to pin KDF parameters: {e}")
+            return False
+
     def _derive_system_password(self, password):
         """Derive a deterministic high-entropy system password using Argon2id."""
         if not password:
@@ -411,20 +1374,13 @@ class BackupManager:
         if len(password) == 64 and all(c in "0123456789abcdefABCDEF" for c in password):
             return password
 
-        # Use argon2 low_level for deterministic hashing
-        # Salt must be at least 8 bytes. We'll use a deterministic salt based on username.
-        salt = hashlib.sha256(self.username.encode()).digest()[:16]
-        
-        hash_bytes = low_level.hash_secret_raw(
-            secret=password.encode(),
-            salt=salt,
-            time_cost=4,
-            memory_cost=65536,
-            parallelism=2,
-            hash_len=32,
-            type=low_level.Type.ID
-        )
-        return hash_bytes.hex()
+        params = self._kdf_params()
+        cache_key = (password, json.dumps(params, sort_keys=True))
+        if cache_key not in self._tokens:
+            # Salt must be at least 8 bytes. We'll use a deterministic salt based on username.
+            salt = hashlib.sha256(self.username.encode()).digest()[:16]
+            self._tokens[cache_key] = kdf.derive(password.encode(), salt, params).hex()
+        return self._tokens[cache_key]
 
     def _cache_vault_token(self, password):
         """Store the derived vault token in the mounted vault for seamless logout."""
@@ -0,0 +1,163 @@
+import os
+import hmac
+import stat
+import json
+import hashlib
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+
+class TreeManifest:
+    """
+    Snapshot of a cipher tree: every file's size, mtime and SHA-256, plus its directories.
+    gocryptfs maps each plaintext file to one ciphertext file, so comparing two
+    manifests yields exactly the files a delta backup has to carry.
+    `base` names the full backup a delta chain starts from; `seq` is the last delta applied
+    and `parent` the digest of the manifest that delta was taken against.
+    """
+    VERSION = 1
+    HASH_BLOCK = 1024 * 1024
+
+    def __init__(self, files: dict = None, dirs=None, base: int = None, seq: int = 0,
+                 base_bytes: int = 0, delta_bytes: int = 0, parent: str = None):
+        self.files = files or {} # relpath -> [size, mtime_ns, sha256]
+        self.dirs = set(dirs or ())
+        self.base = base
+        self.seq = seq
+        self.base_bytes = base_bytes
+        self.delta_bytes = delta_bytes
+        self.parent = parent
+
+    @classmethod
+    def _hash_file(cls, path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(cls.HASH_BLOCK), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @classmethod
+    def scan(cls, root: str, previous: "TreeManifest" = None) -> "TreeManifest":
+        """
+        Walk root. Files whose size and mtime match `previous` keep their recorded
+        hash, so only changed files are read.
+        """
+        known = previous.files if previous else {}
+        files = {}
+        dirs = set()
+        for dirpath, dirnames, filenames in os.walk(root):
+            rel_dir = os.path.relpath(dirpath, root)
+            for name in dirnames + filenames:
+                path = os.path.join(dirpath, name)
+                rel = os.path.normpath(os.path.join(rel_dir, name))
+                st = os.lstat(path)
+                if stat.S_ISDIR(st.st_mode):
+                    dirs.add(rel)
+                    continue
+                entry = known.get(rel)
+                if entry and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+                    files[rel] = entry
+                elif stat.S_ISLNK(st.st_mode):
+                    files[rel] = [st.st_size, st.st_mtime_ns, hashlib.sha256(os.readlink(path).encode()).hexdigest()]
+                else:
+                    files[rel] = [st.st_size, st.st_mtime_ns, cls._hash_file(path)]
+        return cls(files, dirs)
+
+    def diff(self, previous: "TreeManifest") -> tuple:
+        """Return (changed, deleted): sorted relpaths added/modified since previous, and removed ones."""
+        changed = [d for d in self.dirs if d not in previous.dirs]
+        # mtime only decides whether to re-hash; content identity is size + hash
+        changed += [p for p, entry in self.files.items()
+                    if p not in previous.files or previous.files[p][::2] != entry[::2]]
+        deleted = [p for p in previous.files if p not in self.files]
+        deleted += [d for d in previous.dirs if d not in self.dirs]
+        # Parents sort before their children, so a tar of `changed` creates directories first
+        return sorted(changed), sorted(deleted)
+
+    def refresh_stat(self, root: str):
+        """
+        Take mtimes from disk after extracting this tree (tar does not keep nanoseconds),
+        so the next scan does not re-hash every restored file.
+        """
+        for rel, entry in self.files.items():
+            try:
+                st = os.lstat(os.path.join(root, rel))
+            except OSError:
+                continue
+            if st.st_size == entry[0]:
+                entry[1] = st.st_mtime_ns
+
+    def total_bytes(self, paths=None) -> int:
+        if paths is None:
+            return sum(entry[0] for entry in self.files.values())
+        return sum(self.files[p][0] for p in paths if p in self.files)
+
+    # --- Serialization ---
+
+    def to_dict(self) -> dict:
+        return {
+            "version": self.VERSION,
+            "base": self.base,
+            "seq": self.seq,
+            "base_bytes": self.base_bytes,
+            "delta_bytes": self.delta_bytes,
+            "parent": self.parent,
+            "dirs": sorted(self.dirs),
+            "files": self.files,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "TreeManifest":
+        if data.get("version") != cls.VERSION:
+            raise ValueError(f"Unsupported tree manifest version {data.get('version')}")
+        return cls(data["files"], data["dirs"], data["base"], data["seq"],
+                   data.get("base_bytes", 0), data.get("delta_bytes", 0), data.get("parent"))
+
+    def digest(self) -> str:
+        """Identity of the tree's content and chain position (mtimes excluded)."""
+        body = {
+            "base": self.base,
+            "seq": self.seq,
+            "dirs": sorted(self.dirs),
+            "files": {p: entry[::2] for p, entry in self.files.items()},
+        }
+        return hashlib.sha256(json.dumps(body, sort_keys=True).encode()).hexdigest()
+
+    @staticmethod
+    def signing_key(password: str) -> bytes:
+        """HMAC key for manifests, derived from the vault token."""
+        return HKDF(algorithm=hashes.SHA256(), length=32, salt=None,
+                    info=b"enc-tree-manifest").derive(password.encode())
+
+    def sign(self, key: bytes) -> dict:
+        body = self.to_dict()
+        mac = hmac.new(key, json.dumps(body, sort_keys=True).encode(), hashlib.sha256).hexdigest()
+        return {"manifest": body, "hmac": mac}
+
+    @classmethod
+    def from_signed(cls, doc: dict, key: bytes) -> "TreeManifest":
+        try:
+            body = doc["manifest"]
+            expected = hmac.new(key, json.dumps(body, sort_keys=True).encode(), hashlib.sha256).hexdigest()
+            valid = hmac.compare_digest(expected, doc["hmac"])
+        except (KeyError, TypeError):
+            raise ValueError("Invalid tree manifest")
+        if not valid:
+            raise ValueError("Tree manifest signature mismatch")
+        return cls.from_dict(body)
+
+    def save(self, path, key: bytes):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.sign(key), f)
+        os.chmod(tmp_path, 0o600)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, key: bytes):
+        """Return the signed manifest at path, or None if missing, unreadable or not authentic."""
+        try:
+            with open(path, "r") as f:
+                return cls.from_signed(json.load(f), key)
+        except (OSError, ValueError):
+            return None
@@ -0,0 +1,238 @@
+"""
+Backup performance benchmark.
+
+Generates synthetic gocryptfs-like cipher trees and times BackupPacker.pack,
+BackupPacker.unpack, BackupPacker._derive_key and
+BackupManager._derive_system_password. Each case runs in a fresh interpreter
+so peak RSS is per case. Results are printed (or written) as JSON.
+
+    python -m enc_server.benchmark --profile mixed --output bench.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import base64
+import platform
+import resource
+import tempfile
+import subprocess
+import click
+
+PROFILES = ("small", "large", "mixed")
+CASES = ("derive_key", "derive_system_password", "pack", "unpack")
+
+# Sizes at --scale 1.0
+SMALL_FILES = 5000
+SMALL_FILE_SIZE = 4 * 1024
+LARGE_FILES = 2
+LARGE_FILE_SIZE = 256 * 1024 * 1024
+FILES_PER_DIR = 200
+
+
+def _cipher_name(rng_bytes: bytes) -> str:
+    """File names look like gocryptfs' base64url-encoded encrypted names."""
+    return base64.urlsafe_b64encode(rng_bytes).decode().rstrip("=")
+
+
+def _write_random(path: str, size: int, block: int = 1024 * 1024):
+    with open(path, "wb") as f:
+        remaining = size
+        while remaining > 0:
+            n = min(block, remaining)
+            f.write(os.urandom(n))
+            remaining -= n
+
+
+def make_tree(root: str, profile: str, scale: float = 1.0) -> dict:
+    """
+    Build a synthetic cipher tree under root/.enc_cipher. File contents are
+    random bytes, like gocryptfs ciphertext. Returns {"files", "bytes"}.
+    """
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown profile '{profile}'. Known: {', '.join(PROFILES)}")
+    cipher = os.path.join(root, ".enc_cipher")
+    os.makedirs(cipher, exist_ok=True)
+    with open(os.path.join(cipher, "gocryptfs.conf"), "w") as f:
+        json.dump({"Version": 2, "FeatureFlags": ["GCMIV128", "HKDF", "DirIV", "EMENames", "LongNames", "Raw64"]}, f)
+    _write_random(os.path.join(cipher, "gocryptfs.diriv"), 16)
+
+    files = 2
+    total = 16
+    if profile in ("small", "mixed"):
+        count = max(1, int(SMALL_FILES * scale))
+        directory = None
+        for i in range(count):
+            if i % FILES_PER_DIR == 0:
+                directory = os.path.join(cipher, _cipher_name(os.urandom(16)))
+                os.makedirs(directory)
+                _write_random(os.path.join(directory, "gocryptfs.diriv"), 16)
+                files += 1
+                total += 16
+            _write_random(os.path.join(directory, _cipher_name(os.urandom(16))), SMALL_FILE_SIZE)
+            files += 1
+            total += SMALL_FILE_SIZE
+    if profile in ("large", "mixed"):
+        size = max(1024 * 1024, int(LARGE_FILE_SIZE * scale))
+        for _ in range(LARGE_FILES):
+            _write_random(os.path.join(cipher, _cipher_name(os.urandom(16))), size)
+            files += 1
+            total += size
+    return {"files": files, "bytes": total}
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for dirpath, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def _peak_rss_kb() -> int:
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _run_case(case: str, workdir: str, params: dict) -> dict:
+    """Run one case in this process. Called inside a fresh interpreter."""
+    from .backup_packer import BackupPacker
+    from .backup_manager import BackupManager
+    from . import kdf
+
+    packer = BackupPacker(codec=params["codec"], workers=params["workers"])
+    password = params["password"]
+    archive = os.path.join(workdir, "bench_backup.enc")
+    result = {"case": case}
+
+    if case in ("pack", "unpack"):
+        # pack/unpack each run Argon2 once; time it separately so mb_per_s is data throughput only
+        start = time.perf_counter()
+        packer._derive_key(password, os.urandom(16))
+        result["argon2_seconds"] = time.perf_counter() - start
+
+    if case == "derive_key":
+        start = time.perf_counter()
+        packer._derive_key(password, os.urandom(16))
+        result["seconds"] = time.perf_counter() - start
+        result["argon2"] = packer.kdf_params
+    elif case == "derive_system_password":
+        # Skip __init__: no user config should be read. Vault parameters are pinned to the host's.
+        manager = BackupManager.__new__(BackupManager)
+        manager.username = "bench"
+        manager.kdf_params_file = os.path.join(workdir, kdf.USER_PARAMS_NAME)
+        manager._tokens = {}
+        kdf.save_params(manager.kdf_params_file, kdf.host_params())
+        start = time.perf_counter()
+        manager._derive_system_password(password)
+        result["seconds"] = time.perf_counter() - start
+        result["argon2"] = manager._kdf_params()
+    elif case == "pack":
+        source = os.path.join(workdir, "tree")
+        start = time.perf_counter()
+        packer.pack(source, archive, password)
+        result["seconds"] = time.perf_counter() - start
+        result["bytes"] = _dir_size(os.path.join(source, ".enc_cipher"))
+        result["temp_disk_bytes"] = os.path.getsize(archive)
+    elif case == "unpack":
+        dest = os.path.join(workdir, "restore")
+        shutil.rmtree(dest, ignore_errors=True)
+        os.makedirs(dest)
+        start = time.perf_counter()
+        packer.unpack(archive, dest, password)
+        result["seconds"] = time.perf_counter() - start
+        result["bytes"] = _dir_size(dest)
+        # Archive plus the extracted tree, both on disk at the end of a restore
+        result["temp_disk_bytes"] = os.path.getsize(archive) + result["bytes"]
+    else:
+        raise ValueError(f"Unknown benchmark case '{case}'")
+
+    if result.get("bytes"):
+        data_seconds = result["seconds"] - result["argon2_seconds"]
+        if data_seconds > 0:
+            result["mb_per_s"] = round(result["bytes"] / (1024 * 1024) / data_seconds, 2)
+    result["seconds"] = round(result["seconds"], 4)
+    if "argon2_seconds" in result:
+        result["argon2_seconds"] = round(result["argon2_seconds"], 4)
+    result["peak_rss_kb"] = _peak_rss_kb()
+    return result
+
+
+def _spawn_case(case: str, workdir: str, params: dict) -> dict:
+    """Run a case in a child interpreter so peak RSS is not shared between cases."""
+    cmd = [sys.executable, "-m", "enc_server.benchmark", "--case", case,
+           "--workdir", workdir, "--params", json.dumps(params)]
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    if proc.returncode != 0:
+        return {"case": case, "status": "error", "message": proc.stderr.strip().splitlines()[-1:]}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def run_benchmarks(profiles=PROFILES, scale: float = 1.0, repeat: int = 1, codec: str = "auto",
+                   workers: int = None, password: str = "benchmark-password", base_dir: str = None) -> dict:
+    """Run every case for every profile and return a JSON-serialisable report."""
+    from .backup_codecs import resolve_codec
+
+    params = {"codec": codec, "workers": workers, "password": password}
+    report = {
+        "host": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "params": {"scale": scale, "repeat": repeat, "codec": codec,
+                   "resolved_codec": resolve_codec(codec).name, "workers": workers},
+        "results": [],
+    }
+
+    for case in ("derive_key", "derive_system_password"):
+        for run in range(repeat):
+            with tempfile.TemporaryDirectory(dir=base_dir) as workdir:
+                entry = _spawn_case(case, workdir, params)
+                entry["run"] = run
+                report["results"].append(entry)
+
+    for profile in profiles:
+        for run in range(repeat):
+            with tempfile.TemporaryDirectory(dir=base_dir) as workdir:
+                tree = make_tree(os.path.join(workdir, "tree"), profile, scale)
+                for case in ("pack", "unpack"):
+                    entry = _spawn_case(case, workdir, params)
+                    entry.update({"profile": profile, "files": tree["files"], "run": run})
+                    report["results"].append(entry)
+    return report
+
+
+@click.command()
+@click.option("--profile", "profiles", multiple=True, type=click.Choice(PROFILES),
+              help="Tree profiles to benchmark (default: all)")
+@click.option("--scale", default=1.0, show_default=True, help="Multiplier for file counts and sizes")
+@click.option("--repeat", default=1, show_default=True, help="Runs per case")
+@click.option("--codec", default="auto", show_default=True, help="Backup codec to benchmark")
+@click.option("--workers", default=None, type=int, help="Packer worker threads (default: CPU count)")
+@click.option("--base-dir", default=None, help="Directory for temporary trees (default: system temp)")
+@click.option("--output", default=None, help="Write the JSON report here instead of stdout")
+@click.option("--case", default=None, type=click.Choice(CASES), hidden=True)
+@click.option("--workdir", default=None, hidden=True)
+@click.option("--params", default=None, hidden=True)
+def main(profiles, scale, repeat, codec, workers, base_dir, output, case, workdir, params):
+    """Benchmark backup pack/unpack and key derivation."""
+    if case:
+        click.echo(json.dumps(_run_case(case, workdir, json.loads(params))))
+        return
+
+    report = run_benchmarks(profiles or PROFILES, scale, repeat, codec, workers, base_dir=base_dir)
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w") as f:
+            f.write(text + "\n")
+    else:
+        click.echo(text)
+
+
+if __name__ == "__main__":
+    main()
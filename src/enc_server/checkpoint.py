@@ -0,0 +1,150 @@
+"""
+In-session checkpoint backups.
+
+A login starts one checkpointer per user. While the vault stays mounted it
+watches the session's activity (updated_at, refreshed by every command and by
+file activity in mounted projects) and, once the user has been idle for a
+while and enough time has passed since the last checkpoint, writes what
+changed as the next delta (BackupManager.checkpoint). A logout then only
+flushes the tail, and a container that dies mid-session loses at most one
+interval of work. Off unless switched on per user in user.yml:
+
+    checkpoint:
+      enabled: true   # default false; `checkpoint: true` also works
+      interval: 900   # seconds between checkpoints
+      idle: 60        # seconds without activity before one is taken
+
+    python -m enc_server.checkpoint --user alice     # started by the login
+"""
+import os
+import sys
+import json
+import time
+import fcntl
+import datetime
+import subprocess
+import yaml
+import click
+from .debug import debug_log
+
+DEFAULTS = {"enabled": False, "interval": 900, "idle": 60}
+LOCK_NAME = "checkpoint.lock"
+
+
+def load_config(username: str) -> dict:
+    """The user's checkpoint settings, defaults filled in."""
+    try:
+        with open(f"/home/{username}/.enc_config/user.yml") as f:
+            section = (yaml.safe_load(f) or {}).get("checkpoint")
+    except (OSError, yaml.YAMLError):
+        section = None
+    if section is None:
+        section = {}
+    elif not isinstance(section, dict):
+        # `checkpoint: true` / `checkpoint: false`
+        section = {"enabled": bool(section)}
+    return dict(DEFAULTS, **section)
+
+
+class Checkpointer:
+    """
+    Polls the session and checkpoints the vault while it is idle. A flock on
+    ~/.enc_config/checkpoint.lock keeps one per user; it follows whichever session is
+    current and exits once the vault is unmounted.
+    """
+    POLL_INTERVAL = 10 # seconds
+    RETRY_DELAY = 60 # after the vault changed under a checkpoint or it failed
+
+    def __init__(self, username: str, config: dict = None):
+        self.username = username
+        self.config = config or load_config(username)
+        self.home = f"/home/{username}"
+        self.lock_path = os.path.join(self.home, ".enc_config", LOCK_NAME)
+        self.mount = os.path.join(self.home, ".enc")
+
+    @staticmethod
+    def ensure_running(username: str):
+        """Start a checkpointer for username unless one runs or checkpoints are off."""
+        if not load_config(username)["enabled"]:
+            return
+        lock_path = os.path.join(f"/home/{username}", ".enc_config", LOCK_NAME)
+        try:
+            fd = os.open(lock_path, os.O_RDONLY)
+        except OSError:
+            fd = None
+        if fd is not None:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            finally:
+                os.close(fd)
+        subprocess.Popen(
+            [sys.executable, "-m", "enc_server.checkpoint", "--user", username],
+            start_new_session=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            stdin=subprocess.DEVNULL
+        )
+
+    def _last_activity(self):
+        """updated_at of the current session as a timestamp, or None if there is no session."""
+        try:
+            with open(os.path.join(self.mount, "system", "config.json")) as f:
+                session_id = json.load(f).get("session_id")
+            if not session_id:
+                return None
+            with open(os.path.join(self.mount, "sessions", f"{session_id}.json")) as f:
+                updated_at = json.load(f).get("updated_at")
+            return datetime.datetime.fromisoformat(updated_at).timestamp() if updated_at else time.time()
+        except (OSError, ValueError):
+            return None
+
+    def checkpoint(self) -> dict:
+        from .backup_manager import BackupManager
+        return BackupManager(self.username).checkpoint()
+
+    def run(self):
+        os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            debug_log(f"Checkpointer: already running for {self.username}.")
+            return
+        interval, idle = float(self.config["interval"]), float(self.config["idle"])
+        debug_log(f"Checkpointer: watching {self.username} (every {interval}s after {idle}s idle).")
+        next_due = time.time() + interval
+        try:
+            while os.path.ismount(self.mount):
+                time.sleep(self.POLL_INTERVAL)
+                now = time.time()
+                last_activity = self._last_activity()
+                if now < next_due or last_activity is None or now - last_activity < idle:
+                    continue
+                try:
+                    res = self.checkpoint()
+                except Exception as e:
+                    res = {"status": "error", "message": str(e)}
+                debug_log(f"Checkpointer: {self.username}: {res.get('status')} "
+                          f"{res.get('kind') or res.get('message') or ''}".rstrip())
+                ok = res.get("status") in ("success", "skipped")
+                next_due = time.time() + (interval if ok else self.RETRY_DELAY)
+        finally:
+            os.close(fd)
+        debug_log(f"Checkpointer: vault of {self.username} unmounted, exiting.")
+
+
+@click.command()
+@click.option("--user", "username", required=True, help="User whose vault is checkpointed")
+def main(username):
+    """Take checkpoint backups of a mounted vault while its session is idle."""
+    config = load_config(username)
+    if not config["enabled"]:
+        return
+    Checkpointer(username, config).run()
+
+
+if __name__ == "__main__":
+    main()
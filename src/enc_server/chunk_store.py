@@ -0,0 +1,368 @@
+import os
+import io
+import hmac
+import json
+import zlib
+import time
+import hashlib
+import tarfile
+import datetime
+import tempfile
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
+from cryptography.exceptions import InvalidTag
+from .backup_packer import ChunkedReader
+from .debug import debug_log
+
+
+class ContentDefinedChunker:
+    """
+    Split a byte stream at content-defined boundaries so that an edit only
+    changes the chunks around it instead of shifting every chunk after it.
+
+    A position is a cut point when it follows the 2-byte ANCHOR and the CRC32 of
+    the preceding WINDOW bytes matches MASK. The anchor scan runs in C via
+    bytearray.find, so only ~1 in 65536 positions pays for a hash. For random
+    (gocryptfs) data this gives an average chunk of 64KiB * (MASK + 1) on top of
+    MIN_SIZE; MAX_SIZE bounds the chunk for data where no anchor ever appears.
+    """
+    ANCHOR = b'\xe7\x5a'
+    WINDOW = 48
+    MASK = 0x7 # ~512KB average
+    MIN_SIZE = 128 * 1024
+    MAX_SIZE = 4 * 1024 * 1024
+
+    def find_cut(self, buf, final: bool) -> int:
+        """Return the length of the next chunk in buf, or 0 if more data is needed."""
+        if len(buf) < self.MAX_SIZE and not final:
+            return 0
+        if len(buf) <= self.MIN_SIZE:
+            return len(buf)
+
+        limit = min(len(buf), self.MAX_SIZE)
+        pos = self.MIN_SIZE - len(self.ANCHOR)
+        while True:
+            i = buf.find(self.ANCHOR, pos, limit)
+            if i < 0:
+                return limit
+            cut = i + len(self.ANCHOR)
+            if zlib.crc32(buf[cut - self.WINDOW:cut]) & self.MASK == 0:
+                return cut
+            pos = i + 1
+
+
+class _ChunkingWriter(io.RawIOBase):
+    """Write-only file object that hands content-defined chunks to a callback."""
+
+    def __init__(self, chunker, on_chunk):
+        self._chunker = chunker
+        self._on_chunk = on_chunk
+        self._buf = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buf += data
+        self._drain(final=False)
+        return len(data)
+
+    def _drain(self, final: bool):
+        while self._buf:
+            cut = self._chunker.find_cut(self._buf, final)
+            if not cut:
+                return
+            self._on_chunk(bytes(self._buf[:cut]))
+            del self._buf[:cut]
+
+    def close(self):
+        if not self.closed:
+            self._drain(final=True)
+        super().close()
+
+
+class ChunkStore:
+    """
+    Content-addressed, deduplicating backup store kept on a backup handler.
+
+    Layout on the handler (relative to its root):
+        chunks/<id[:2]>/<id>         sealed chunk of the tar stream
+        manifests/<generation>.enc   sealed list of chunk ids for one backup
+
+    Chunk ids are HMAC-SHA256 of the plaintext under a key derived from the
+    (already Argon2-stretched) system password, so ids reveal nothing about the
+    content. Chunks are sealed deterministically (nonce taken from the id), which
+    keeps identical content byte-identical across generations and handlers.
+    """
+    CHUNK_PREFIX = "chunks"
+    MANIFEST_PREFIX = "manifests"
+    MANIFEST_AAD = b'ENCMAN01'
+    # Plaintext vault KDF parameters, so a new host can derive the store key (mirrored with manifests)
+    PARAMS_NAME = "manifests/kdf.json"
+    NONCE_SIZE = 12
+    KEEP_GENERATIONS = 7
+
+    def __init__(self, handler, password: str):
+        self.handler = handler
+        self.chunker = ContentDefinedChunker()
+        self._id_key = self._subkey(password, b"enc-chunk-id")
+        self._chacha = ChaCha20Poly1305(self._subkey(password, b"enc-chunk-data"))
+
+    @staticmethod
+    def _subkey(password: str, info: bytes) -> bytes:
+        return HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=info).derive(password.encode())
+
+    # --- Object naming ---
+
+    @classmethod
+    def chunk_name(cls, chunk_id: str) -> str:
+        return f"{cls.CHUNK_PREFIX}/{chunk_id[:2]}/{chunk_id}"
+
+    @classmethod
+    def manifest_name(cls, generation: int) -> str:
+        return f"{cls.MANIFEST_PREFIX}/{generation:012d}.enc"
+
+    @classmethod
+    def _generations(cls, names) -> list:
+        gens = []
+        for name in names:
+            base = os.path.basename(name)
+            if name.startswith(cls.MANIFEST_PREFIX + "/") and base.endswith(".enc"):
+                try:
+                    gens.append(int(base[:-4]))
+                except ValueError:
+                    continue
+        return sorted(gens)
+
+    # --- Sealing ---
+
+    def chunk_id(self, plaintext: bytes) -> str:
+        return hmac.new(self._id_key, plaintext, hashlib.sha256).hexdigest()
+
+    def _seal_chunk(self, chunk_id: str, plaintext: bytes) -> bytes:
+        raw_id = bytes.fromhex(chunk_id)
+        return self._chacha.encrypt(raw_id[:self.NONCE_SIZE], plaintext, raw_id)
+
+    def _open_chunk(self, chunk_id: str, sealed: bytes) -> bytes:
+        raw_id = bytes.fromhex(chunk_id)
+        try:
+            plaintext = self._chacha.decrypt(raw_id[:self.NONCE_SIZE], sealed, raw_id)
+        except InvalidTag:
+            raise ValueError(f"Chunk {chunk_id} failed authentication. Incorrect password or corrupted store.")
+        if not hmac.compare_digest(self.chunk_id(plaintext), chunk_id):
+            raise ValueError(f"Chunk {chunk_id} content does not match its id.")
+        return plaintext
+
+    def _seal_manifest(self, manifest: dict) -> bytes:
+        nonce = os.urandom(self.NONCE_SIZE)
+        return nonce + self._chacha.encrypt(nonce, json.dumps(manifest).encode(), self.MANIFEST_AAD)
+
+    def _open_manifest(self, sealed: bytes) -> dict:
+        try:
+            plaintext = self._chacha.decrypt(sealed[:self.NONCE_SIZE], sealed[self.NONCE_SIZE:], self.MANIFEST_AAD)
+        except InvalidTag:
+            raise ValueError("Manifest decryption failed. Incorrect password or corrupted store.")
+        return json.loads(plaintext)
+
+    # --- Backup / Restore ---
+
+    def backup(self, source_dir: str, staging_dir: str, vault_kdf: dict = None, arcname: str = None) -> dict:
+        """
+        Chunk source_dir's tar stream and push only chunks the handler does not hold yet,
+        followed by a new generation manifest. New objects are staged in staging_dir,
+        which the caller removes afterwards. `vault_kdf` is stored next to the manifests;
+        `arcname` names the archive root (default: the basename of source_dir).
+        """
+        existing = self.handler.list(self.CHUNK_PREFIX)
+        # Generations are timestamps so they stay comparable across handlers
+        latest = (self._generations(self.handler.list(self.MANIFEST_PREFIX)) or [0])[-1]
+        generation = max(latest + 1, int(time.time()))
+
+        staged = []
+        chunk_ids = []
+        stats = {"chunks": 0, "new_chunks": 0, "bytes": 0, "new_bytes": 0}
+
+        def on_chunk(plaintext):
+            chunk_id = self.chunk_id(plaintext)
+            chunk_ids.append(chunk_id)
+            stats["chunks"] += 1
+            stats["bytes"] += len(plaintext)
+            name = self.chunk_name(chunk_id)
+            if name in existing:
+                return
+            existing.add(name)
+            path = os.path.join(staging_dir, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(self._seal_chunk(chunk_id, plaintext))
+            staged.append(name)
+            stats["new_chunks"] += 1
+            stats["new_bytes"] += len(plaintext)
+
+        # Ciphertext from gocryptfs does not compress, so the tar stream is stored as is
+        with _ChunkingWriter(self.chunker, on_chunk) as writer:
+            with tarfile.open(fileobj=writer, mode="w|") as tar:
+                tar.add(source_dir, arcname=arcname or os.path.basename(source_dir))
+
+        manifest = {
+            "version": 1,
+            "generation": generation,
+            "created_at": datetime.datetime.now().isoformat(),
+            "chunks": chunk_ids,
+        }
+        manifest_name = self.manifest_name(generation)
+        manifest_path = os.path.join(staging_dir, manifest_name)
+        os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+        with open(manifest_path, "wb") as f:
+            f.write(self._seal_manifest(manifest))
+        if vault_kdf:
+            with open(os.path.join(staging_dir, self.PARAMS_NAME), "w") as f:
+                json.dump(vault_kdf, f)
+            staged.append(self.PARAMS_NAME)
+
+        # Chunks first, manifest last: a generation is only visible once complete
+        if not self.handler.push_tree(staging_dir, staged):
+            raise Exception("Failed to push chunks to backup store")
+        if not self.handler.push(manifest_path, manifest_name):
+            raise Exception("Failed to push backup manifest")
+
+        debug_log(f"ChunkStore: Generation {generation} stored "
+                  f"({stats['new_chunks']}/{stats['chunks']} chunks new, {stats['new_bytes']} bytes uploaded).")
+        stats["generation"] = generation
+        return stats
+
+    def latest_generation(self):
+        return self.latest_on(self.handler)
+
+    @classmethod
+    def latest_on(cls, handler):
+        """Newest complete generation on handler (a listing only, no key needed)."""
+        gens = cls._generations(handler.list(cls.MANIFEST_PREFIX))
+        return gens[-1] if gens else None
+
+    @classmethod
+    def read_params(cls, handler, staging_dir: str):
+        """Return the vault KDF parameters stored with a handler's chunk store, if any."""
+        if cls.PARAMS_NAME not in handler.list(cls.MANIFEST_PREFIX):
+            return None
+        path = os.path.join(staging_dir, cls.PARAMS_NAME)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if not handler.pull(path, cls.PARAMS_NAME):
+            return None
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        finally:
+            os.remove(path)
+
+    def load_manifest(self, generation: int, staging_dir: str) -> dict:
+        path = os.path.join(staging_dir, self.manifest_name(generation))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if not self.handler.pull(path, self.manifest_name(generation)):
+            raise FileNotFoundError(f"Manifest for generation {generation} not found")
+        with open(path, "rb") as f:
+            return self._open_manifest(f.read())
+
+    def restore(self, dest_dir: str, staging_dir: str, generation: int = None) -> int:
+        """Fetch the chunks of a generation (latest by default) and extract them into dest_dir."""
+        if generation is None:
+            generation = self.latest_generation()
+            if generation is None:
+                raise FileNotFoundError("No backup generations found in chunk store")
+
+        manifest = self.load_manifest(generation, staging_dir)
+        names = sorted({self.chunk_name(c) for c in manifest["chunks"]})
+        if not self.handler.pull_many(names, staging_dir):
+            raise Exception("Failed to fetch backup chunks")
+
+        def chunks():
+            for chunk_id in manifest["chunks"]:
+                with open(os.path.join(staging_dir, self.chunk_name(chunk_id)), "rb") as f:
+                    yield self._open_chunk(chunk_id, f.read())
+
+        with tarfile.open(fileobj=ChunkedReader(chunks()), mode="r|") as tar:
+            tar.extractall(path=dest_dir)
+        return generation
+
+    def verify(self, staging_dir: str, generation: int = None) -> dict:
+        """Authenticate the manifest and every chunk of a generation (latest by default)."""
+        started = time.monotonic()
+        if generation is None:
+            generation = self.latest_generation()
+            if generation is None:
+                raise FileNotFoundError("No backup generations found in chunk store")
+        manifest = self.load_manifest(generation, staging_dir)
+
+        report = {"format": "chunk-store", "generation": generation, "chunks": 0, "bytes": 0,
+                  "corrupt_chunks": [], "missing_chunks": [], "errors": []}
+        names = sorted({self.chunk_name(c) for c in manifest["chunks"]})
+        present = self.handler.list(self.CHUNK_PREFIX)
+        report["missing_chunks"] = [n for n in names if n not in present]
+        # Fetch and check one chunk at a time so memory and staging space stay constant
+        for name in names:
+            if name in report["missing_chunks"]:
+                continue
+            path = os.path.join(staging_dir, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if not self.handler.pull(path, name):
+                report["missing_chunks"].append(name)
+                continue
+            try:
+                with open(path, "rb") as f:
+                    report["bytes"] += len(self._open_chunk(os.path.basename(name), f.read()))
+            except ValueError as e:
+                report["corrupt_chunks"].append(name)
+                report["errors"].append(str(e))
+            finally:
+                os.remove(path)
+            report["chunks"] += 1
+
+        elapsed = time.monotonic() - started
+        report["seconds"] = round(elapsed, 3)
+        report["mb_per_s"] = round(report["bytes"] / (1024 * 1024) / elapsed, 2) if elapsed > 0 else None
+        report["status"] = "ok" if not (report["corrupt_chunks"] or report["missing_chunks"]) else "corrupt"
+        return report
+
+    def prune(self, keep: int = KEEP_GENERATIONS):
+        """Drop manifests beyond the newest `keep` and every chunk none of the kept ones reference."""
+        gens = self._generations(self.handler.list(self.MANIFEST_PREFIX))
+        if len(gens) <= keep:
+            return
+        referenced = set()
+        with tempfile.TemporaryDirectory() as tmp:
+            for generation in gens[-keep:]:
+                referenced.update(self.chunk_name(c) for c in self.load_manifest(generation, tmp)["chunks"])
+        stale = [self.manifest_name(g) for g in gens[:-keep]]
+        stale += [name for name in self.handler.list(self.CHUNK_PREFIX) if name not in referenced]
+        self.handler.delete_many(stale)
+
+    @classmethod
+    def mirror(cls, source_dir: str, handler) -> bool:
+        """
+        Copy store objects present in the local store at source_dir but missing on
+        handler, then apply the local store's pruning to the handler.
+        Objects are already sealed, so no key is required.
+        """
+        local = set()
+        for prefix in (cls.CHUNK_PREFIX, cls.MANIFEST_PREFIX):
+            for dirpath, _, files in os.walk(os.path.join(source_dir, prefix)):
+                for f in files:
+                    local.add(os.path.relpath(os.path.join(dirpath, f), source_dir))
+        remote = handler.list(cls.CHUNK_PREFIX) | handler.list(cls.MANIFEST_PREFIX)
+        missing = local - remote
+        chunks = sorted(n for n in missing if n.startswith(cls.CHUNK_PREFIX + "/"))
+        manifests = sorted(n for n in missing if n.startswith(cls.MANIFEST_PREFIX + "/"))
+        if not (handler.push_tree(source_dir, chunks) and handler.push_tree(source_dir, manifests)):
+            return False
+
+        # Only prune remotely when the local store is at least as new as the remote one,
+        # so a wiped or stale local store can never delete remote history.
+        local_gens = cls._generations(local)
+        remote_gens = cls._generations(remote)
+        if local_gens and (not remote_gens or local_gens[-1] >= remote_gens[-1]):
+            stale = [cls.manifest_name(g) for g in remote_gens if g < local_gens[0]]
+            stale += [n for n in remote if n.startswith(cls.CHUNK_PREFIX + "/") and n not in local]
+            if stale:
+                handler.delete_many(stale)
+        return True
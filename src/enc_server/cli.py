@@ -9,7 +9,6 @@ from enc_server.enc import EncServer
 from enc_server.authentications import Authentication
 from enc_server.session import Session
 from enc_server.debug import debug_log
-from pathlib import Path
 
 
 console = Console()
@@ -44,8 +43,8 @@ def check_server_permission(ctx):
     cmd_path = ctx.command_path.split(" ")[-1] # get leaf command
     debug_log(f"CLI: User '{user}' attempting command '{cmd_path}'")
     
-    # Check session for all commands except login and status
-    if cmd_path not in ["server-login", "server-status"]:
+    # Check session for all commands except login, status and backup scrubbing
+    if cmd_path not in ["server-login", "server-status", "server-backup-verify"]:
         session_id = ctx.obj.get("session_id")
         server = EncServer()
         is_valid, msg = server.verify_session(session_id)
@@ -106,13 +105,14 @@ def server_login(ctx, username, password):
 @cli.command("server-logout")
 @click.argument("session_id")
 @click.option("--password", default=None, help="User password for backup vault")
+@click.option("--background", is_flag=True, help="Return once unmounted; pack and push in a worker (see server-status)")
 @click.pass_context
-def server_logout(ctx, session_id, password):
+def server_logout(ctx, session_id, password, background):
     """Internal: Destroy a session."""
     check_server_permission(ctx)
     from enc_server.enc import EncServer
     server = EncServer()
-    res = server.logout_session(session_id, password)
+    res = server.logout_session(session_id, password, background=background)
     click.echo(json.dumps(res))
 
 @cli.command("server-status")
@@ -121,19 +121,66 @@ def server_logout(ctx, session_id, password):
 def server_status(ctx, username):
     """Internal: Get user backup status."""
     check_server_permission(ctx)
-    status_file = Path("/app/backups/status.json")
-    if not status_file.exists():
-        click.echo(json.dumps({}))
-        return
-    
+    from enc_server.sync_daemon import SyncQueue
+    from enc_server.status_store import StatusStore
+    from enc_server.logout_jobs import LogoutJob
     try:
-        with open(status_file, 'r') as f:
-            data = json.load(f)
-        click.echo(json.dumps(data.get(username, {})))
+        user_data = StatusStore().read(username)
+        # Pushes still waiting in the sync daemon's queue
+        for job in SyncQueue().jobs(username):
+            handler_data = user_data.setdefault(job["handler"], {"available": False, "status": "None"})
+            handler_data["job"] = {k: job.get(k) for k in ("state", "attempts", "error", "next_try", "updated_at")}
+            handler_data["job"]["pending"] = len(job["items"])
+        # Background logout still packing/pushing, or how the last one ended
+        logout_job = LogoutJob(f"/home/{username}/.enc_config").status()
+        if logout_job:
+            user_data["logout_job"] = logout_job
+        click.echo(json.dumps(user_data))
     except Exception as e:
         click.echo(json.dumps({"status": "error", "message": str(e)}))
 
 
+@cli.command("server-backup-verify")
+@click.option("--password", default=None, help="User password for backup vault (defaults to the cached vault token)")
+@click.option("--handler", "handler_names", multiple=True, help="Only verify these handlers (e.g. local, gdrive)")
+@click.pass_context
+def server_backup_verify(ctx, password, handler_names):
+    """Internal: Authenticate stored backups without restoring them."""
+    check_server_permission(ctx)
+    import getpass
+    from enc_server.backup_manager import BackupManager
+    try:
+        reports = BackupManager(getpass.getuser()).verify_backups(password, list(handler_names) or None)
+        ok = all(r.get("status") in ("ok", "disconnected") for r in reports.values())
+        click.echo(json.dumps({"status": "success" if ok else "error", "backups": reports}))
+    except Exception as e:
+        click.echo(json.dumps({"status": "error", "message": str(e)}))
+
+@cli.command("server-kdf-calibrate")
+@click.option("--target-ms", default=500, show_default=True, help="Target key derivation time per login")
+@click.option("--max-memory", default=256, show_default=True, help="Upper bound for Argon2 memory (MiB)")
+@click.option("--save/--no-save", default=False, help="Save as this host's defaults for new vaults and backups")
+@click.pass_context
+def server_kdf_calibrate(ctx, target_ms, max_memory, save):
+    """Internal: Benchmark Argon2id on this host and pick KDF parameters."""
+    check_server_permission(ctx)
+    ensure_admin(ctx)
+    from enc_server import kdf
+    params = kdf.calibrate(target_ms=target_ms, max_memory_mib=max_memory)
+    res = {"status": "success", "params": params, "saved": False}
+    if save:
+        try:
+            kdf.save_params(kdf.HOST_PARAMS_FILE, params)
+        except PermissionError:
+            # /etc/enc is root-owned; same fallback as the policy file
+            import subprocess
+            proc = subprocess.run(["sudo", "tee", kdf.HOST_PARAMS_FILE], input=json.dumps(kdf.normalize(params), indent=4),
+                                  capture_output=True, text=True)
+            if proc.returncode != 0:
+                res = {"status": "error", "params": params, "message": f"Failed to save: {proc.stderr.strip()}"}
+        res["saved"] = res["status"] == "success"
+    click.echo(json.dumps(res))
+
 @cli.command("server-project-init")
 @click.argument("project_name")
 @click.option("--password", default=None, help="Project encryption password (if not provided, will prompt)")
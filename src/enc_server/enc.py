@@ -8,6 +8,7 @@ from rich.console import Console
 from enc_server.authentications import Authentication
 from enc_server.session import Session
 from enc_server.backup_manager import BackupManager
+from enc_server.checkpoint import Checkpointer
 from enc_server.debug import debug_log
 
 console = Console()
@@ -113,6 +114,9 @@ class EncServer:
             
             # Start monitoring
             self.session.monitor_session(session_data["session_id"])
+            # Checkpoint backups while the session is idle (see checkpoint.py)
+            if isinstance(restore_res, dict) and restore_res.get("status") == "success":
+                Checkpointer.ensure_running(username)
             return session_data
         except Exception as e:
             debug_log(f"EncServer: Session creation failed: {e}")
@@ -140,8 +144,8 @@ class EncServer:
         """Log a command and its output to the session file."""
         return self.session.log_command(session_id, command, output)
 
-    def logout_session(self, session_id, password=None):
-        """Destroy a session."""
+    def logout_session(self, session_id, password=None, background=False):
+        """Destroy a session. With `background`, return once the vault is unmounted and back it up in a worker."""
         debug_log(f"EncServer: Logging out session {session_id}...")
         
         # Get user before destroying session
@@ -161,7 +165,10 @@ class EncServer:
                 # 3. Backup and Unmount user vault (~/.enc)
                 debug_log(f"EncServer: Initiating backup and unmount for {username}...")
                 backup_mgr = BackupManager(username)
-                backup_res = backup_mgr.perform_backup_and_unmount(password)
+                if background:
+                    backup_res = backup_mgr.start_backup_and_unmount(password)
+                else:
+                    backup_res = backup_mgr.perform_backup_and_unmount(password)
                 
                 # Combine session logout status with backup status
                 final_res = {"status": "success"}
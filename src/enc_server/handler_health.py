@@ -0,0 +1,100 @@
+"""
+Cached backup handler health.
+
+Probing a remote handler (e.g. `rclone lsd` for GDrive) is a network round trip,
+and every login and logout builds a BackupManager that needs each handler's
+health. Remote results are therefore cached in the user's status shard, refreshed
+by a detached probe once they are older than the TTL, and guarded by a circuit
+breaker: after repeated failures a handler is reported down without probing
+until a cooldown passes. Local handlers are cheap to probe and are always checked directly.
+
+    python -m enc_server.handler_health <username> <handler> [<handler> ...]
+"""
+import os
+import sys
+import time
+import subprocess
+from .debug import debug_log
+
+
+class HealthCache:
+    TTL = 300 # seconds a remote probe result is trusted
+    FAILURE_THRESHOLD = 3 # consecutive failed probes that open the breaker
+    BREAKER_COOLDOWN = 600 # seconds an open breaker skips probing
+    PROBE_TIMEOUT = 30 # seconds before a running probe counts as lost
+
+    def __init__(self, username: str, status_store):
+        self.username = username
+        self.store = status_store
+
+    def record(self, key: str, ok: bool) -> dict:
+        """Store a probe (or push) outcome and trip the breaker on repeated failures."""
+        entry = self.store.read(self.username).get(key, {})
+        failures = 0 if ok else entry.get("failures", 0) + 1
+        breaker_until = time.time() + self.BREAKER_COOLDOWN if failures >= self.FAILURE_THRESHOLD else 0
+        return self.store.update(self.username, key, available=ok, checked_at=time.time(),
+                                 failures=failures, breaker_until=breaker_until, probing_since=0)
+
+    def probe(self, key: str, handler) -> bool:
+        try:
+            ok = bool(handler.verify())
+        except Exception as e:
+            debug_log(f"HealthCache: probing '{key}' failed: {e}")
+            ok = False
+        self.record(key, ok)
+        return ok
+
+    def check(self, key: str, handler) -> bool:
+        """
+        Health of one handler without waiting on the network. A stale or missing
+        remote result is answered from cache (optimistically on first use) and
+        refreshed in the background.
+        """
+        if not handler.REMOTE:
+            return self.probe(key, handler)
+
+        now = time.time()
+        entry = self.store.read(self.username).get(key, {})
+        if entry.get("breaker_until", 0) > now:
+            return False
+        checked_at = entry.get("checked_at", 0)
+        if now - checked_at >= self.TTL:
+            self.refresh_async([key])
+        # Unknown remotes are assumed up: pulls fall through to the next handler and queued pushes retry
+        return entry.get("available", True) if checked_at else True
+
+    def refresh_async(self, keys):
+        """Probe handlers in a detached process, at most one probe per handler at a time."""
+        now = time.time()
+        user_data = self.store.read(self.username)
+        keys = [k for k in keys if now - user_data.get(k, {}).get("probing_since", 0) > self.PROBE_TIMEOUT]
+        if not keys:
+            return
+        for key in keys:
+            self.store.update(self.username, key, probing_since=now)
+        subprocess.Popen(
+            [sys.executable, "-m", "enc_server.handler_health", self.username] + keys,
+            start_new_session=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            stdin=subprocess.DEVNULL,
+            env=os.environ.copy() # Pass env for rclone config
+        )
+
+
+def main():
+    if len(sys.argv) < 3:
+        debug_log("HandlerHealth: Missing arguments (username, handler...)")
+        sys.exit(1)
+    from .backup_manager import BackupManager
+
+    username, keys = sys.argv[1], sys.argv[2:]
+    bm = BackupManager(username, verify_handlers=False)
+    for key in keys:
+        if key in bm.handlers:
+            ok = bm.health.probe(key, bm.handlers[key])
+            debug_log(f"HandlerHealth: '{key}' for {username}: {'up' if ok else 'down'}")
+
+
+if __name__ == "__main__":
+    main()
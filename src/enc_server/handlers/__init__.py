@@ -1 +1,10 @@
 # Handlers package
+from .local_handler import LocalHandler
+from .gdrive_handler import GDriveHandler
+
+# Backup handler types by name. A handler entry in user.yml picks its type with
+# `type:` and defaults to its own key, so `local:`/`gdrive:` keep working.
+HANDLER_TYPES = {
+    "local": LocalHandler,
+    "gdrive": GDriveHandler,
+}
@@ -1,8 +1,23 @@
+import os
+import tempfile
+import contextlib
 from abc import ABC, abstractmethod
 
 class BaseHandler(ABC):
-    def __init__(self, config: dict = None):
+    # Default object name for full backups
+    BACKUP_NAME = "user_backup.enc"
+    # Remote handlers are pushed in the background so logout does not wait on the network
+    REMOTE = False
+
+    def __init__(self, config: dict = None, config_dir: str = None):
         self.config = config or {}
+        # The owning user's ~/.enc_config, for handlers that keep local state
+        self.config_dir = config_dir
+
+    @property
+    def background(self) -> bool:
+        """Push after logout returns (config `background:` overrides the type default)."""
+        return bool(self.config.get("background", self.REMOTE))
 
     @abstractmethod
     def verify(self) -> bool:
@@ -10,11 +25,91 @@ class BaseHandler(ABC):
         pass
 
     @abstractmethod
-    def push(self, source_file: str) -> bool:
-        """Upload source_file to backup destination."""
+    def push(self, source_file: str, name: str = BACKUP_NAME) -> bool:
+        """Upload source_file to backup destination as object `name`."""
         pass
 
     @abstractmethod
-    def pull(self, dest_file: str) -> bool:
-        """Download backup to dest_file."""
+    def pull(self, dest_file: str, name: str = BACKUP_NAME) -> bool:
+        """Download object `name` to dest_file."""
         pass
+
+    @contextlib.contextmanager
+    def sink(self, name: str = BACKUP_NAME, staging_dir: str = None):
+        """
+        Path to write object `name` into. It is published when the block exits cleanly
+        and discarded otherwise. By default it is staged in staging_dir and pushed.
+        """
+        fd, path = tempfile.mkstemp(prefix=".enc_sink_", dir=staging_dir)
+        os.close(fd)
+        try:
+            yield path
+            if not self.push(path, name):
+                raise IOError(f"Failed to store {name} on {type(self).__name__}")
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+    @contextlib.contextmanager
+    def source(self, name: str = BACKUP_NAME, staging_dir: str = None):
+        """
+        Readable local path of object `name` for the duration of the block. By default
+        it is pulled into staging_dir. Raises FileNotFoundError if it cannot be fetched.
+        """
+        fd, path = tempfile.mkstemp(prefix=".enc_source_", dir=staging_dir)
+        os.close(fd)
+        try:
+            if not self.pull(path, name):
+                raise FileNotFoundError(f"{name} not found on {type(self).__name__}")
+            yield path
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+    @contextlib.contextmanager
+    def open_stream(self, name: str = BACKUP_NAME, staging_dir: str = None):
+        """
+        Readable binary file object over object `name`, for reading front to back.
+        Remote handlers hand out the download while it is still arriving; by default
+        it is the file from source().
+        """
+        with self.source(name, staging_dir) as path, open(path, "rb") as f:
+            yield f
+
+    def read_head(self, name: str = BACKUP_NAME, size: int = 4096) -> bytes:
+        """
+        First `size` bytes of object `name` (e.g. a backup header), or None if the
+        handler cannot read part of an object. Raises FileNotFoundError if it does not exist.
+        """
+        return None
+
+    def checksum(self, name: str = BACKUP_NAME, size: int = None) -> str:
+        """
+        SHA-256 of object `name` if the destination can tell without reading it back
+        (size is that of the local original), else None.
+        """
+        return None
+
+    def list(self, prefix: str) -> set:
+        """Return names (relative to the destination root) of all objects under prefix."""
+        raise NotImplementedError(f"{type(self).__name__} does not support listing")
+
+    def delete_many(self, names) -> bool:
+        """Delete the given objects from the destination."""
+        raise NotImplementedError(f"{type(self).__name__} does not support deletion")
+
+    def push_tree(self, source_dir: str, names) -> bool:
+        """Upload files from source_dir; names are paths relative to source_dir and the destination root."""
+        for name in names:
+            if not self.push(os.path.join(source_dir, name), name):
+                return False
+        return True
+
+    def pull_many(self, names, dest_dir: str) -> bool:
+        """Download objects into dest_dir, keeping their relative paths."""
+        for name in names:
+            dest_file = os.path.join(dest_dir, name)
+            os.makedirs(os.path.dirname(dest_file), exist_ok=True)
+            if not self.pull(dest_file, name):
+                return False
+        return True
@@ -0,0 +1,278 @@
+"""
+Offline stand-in for `rclone rcd`, for exercising GDriveHandler without Drive.
+
+Speaks the subset of the rc API the handler uses (operations/list, copyfile,
+deletefile, delete, uploadfile, hashsum, sync/copy, job/status, core/stats,
+core/quit, rc/noop and --rc-serve range reads) on a Unix socket. Remotes such as
+`enc_gdrive:` are directories under ENC_FAKE_RCD_ROOT; anything else is a local
+path. Methods listed in ENC_FAKE_RCD_FAIL (comma separated) fail, e.g. to test retries.
+Requests need Basic auth when --rc-user/--rc-pass (or RCLONE_RC_USER/RCLONE_RC_PASS) are set.
+
+    backup:
+      gdrive:
+        rclone: "python3 -m enc_server.handlers.fake_rcd"
+"""
+import os
+import sys
+import json
+import time
+import base64
+import shutil
+import hashlib
+import threading
+import socketserver
+import urllib.parse
+from http.server import BaseHTTPRequestHandler
+
+ROOT = os.environ.get("ENC_FAKE_RCD_ROOT", "/tmp/enc_fake_rcd")
+
+
+class RcError(Exception):
+    pass
+
+
+def _path(fs: str, remote: str = "") -> str:
+    if ":" in fs and not fs.startswith("/"):
+        # remote:path
+        name, _, sub = fs.partition(":")
+        base = os.path.join(ROOT, name, sub)
+    else:
+        base = fs
+    return os.path.join(base, remote) if remote else base
+
+
+def _files_from(params: dict) -> list:
+    names = []
+    for list_file in (params.get("_filter") or {}).get("FilesFromRaw", []):
+        with open(list_file) as f:
+            names += [line.rstrip("\n") for line in f if line.strip()]
+    return names
+
+
+def _walk(root: str) -> list:
+    found = []
+    for dirpath, dirs, files in os.walk(root):
+        for name in dirs + files:
+            found.append(os.path.relpath(os.path.join(dirpath, name), root))
+    return found
+
+
+def _copy(src: str, dst: str):
+    if not os.path.isfile(src):
+        raise RcError("object not found")
+    os.makedirs(os.path.dirname(dst) or ".", exist_ok=True)
+    shutil.copyfile(src, dst)
+
+
+class FakeRcd:
+    def __init__(self):
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.fail = set(filter(None, os.environ.get("ENC_FAKE_RCD_FAIL", "").split(",")))
+
+    def rc_noop(self, params):
+        return params
+
+    def operations_list(self, params):
+        remote = params.get("remote", "").strip("/")
+        top = _path(params["fs"], remote)
+        if not os.path.isdir(top):
+            raise RcError("directory not found")
+        opt = params.get("opt", {})
+        names = _walk(top) if opt.get("recurse") else os.listdir(top)
+        entries = []
+        for name in sorted(names):
+            full = os.path.join(top, name)
+            is_dir = os.path.isdir(full)
+            if (is_dir and opt.get("filesOnly")) or (not is_dir and opt.get("dirsOnly")):
+                continue
+            rel = os.path.join(remote, name) if remote else name
+            entries.append({"Path": rel, "Name": os.path.basename(name), "IsDir": is_dir,
+                            "Size": -1 if is_dir else os.path.getsize(full)})
+        return {"list": entries}
+
+    def operations_copyfile(self, params):
+        _copy(_path(params["srcFs"], params["srcRemote"]), _path(params["dstFs"], params["dstRemote"]))
+        return {}
+
+    def operations_deletefile(self, params):
+        path = _path(params["fs"], params["remote"])
+        if not os.path.isfile(path):
+            raise RcError("object not found")
+        os.remove(path)
+        return {}
+
+    def operations_delete(self, params):
+        for name in _files_from(params):
+            path = _path(params["fs"], name)
+            if os.path.isfile(path):
+                os.remove(path)
+        return {}
+
+    def operations_hashsum(self, params):
+        top = _path(params["fs"])
+        if params.get("hashType") != "md5":
+            raise RcError("only md5 is supported")
+        lines = []
+        for name in sorted(_walk(top)):
+            path = os.path.join(top, name)
+            if os.path.isfile(path):
+                with open(path, "rb") as f:
+                    lines.append(f"{hashlib.md5(f.read()).hexdigest()}  {name}")
+        return {"hashType": "md5", "hashsum": lines}
+
+    def sync_copy(self, params):
+        src = _path(params["srcFs"])
+        names = _files_from(params) or [n for n in _walk(src) if os.path.isfile(os.path.join(src, n))]
+        for name in names:
+            _copy(os.path.join(src, name), _path(params["dstFs"], name))
+        return {}
+
+    def job_status(self, params):
+        with self.lock:
+            job = self.jobs.get(params["jobid"])
+        if job is None:
+            raise RcError("job not found")
+        return dict(job)
+
+    def core_stats(self, params):
+        return {"bytes": 0, "speed": 0, "transfers": 0}
+
+    def core_quit(self, params):
+        # Reply first, then stop serving
+        threading.Thread(target=self.server.shutdown, daemon=True).start()
+        return {}
+
+    def call(self, method: str, params: dict) -> dict:
+        if method in self.fail:
+            raise RcError(f"injected failure for {method}")
+        handler = getattr(self, method.replace("/", "_"), None)
+        if handler is None:
+            raise RcError(f"couldn't find method \"{method}\"")
+        if not params.pop("_async", False):
+            return handler(params)
+
+        with self.lock:
+            job_id = len(self.jobs) + 1
+            self.jobs[job_id] = {"id": job_id, "finished": False, "success": False, "error": ""}
+
+        def run():
+            started = time.monotonic()
+            try:
+                handler(params)
+                result = {"success": True}
+            except Exception as e:
+                result = {"success": False, "error": str(e)}
+            with self.lock:
+                self.jobs[job_id].update(result, finished=True, duration=time.monotonic() - started)
+
+        threading.Thread(target=run, daemon=True).start()
+        return {"jobid": job_id}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, body: bytes, content_type: str = "application/json", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self) -> bool:
+        if self.server.auth is None:
+            return True
+        if self.headers.get("Authorization") == self.server.auth:
+            return True
+        self._reply(401, json.dumps({"error": "unauthorized", "path": self.path, "status": 401}).encode())
+        return False
+
+    def _upload(self, method: str, query: dict, length: int):
+        """operations/uploadfile: multipart/form-data body with one file part."""
+        if method in self.server.rcd.fail:
+            raise RcError(f"injected failure for {method}")
+        boundary = self.headers.get_param("boundary").encode()
+        body = self.rfile.read(length)
+        start = body.index(b"\r\n\r\n") + 4
+        header = body[:start].decode()
+        filename = header.split('filename="', 1)[1].split('"', 1)[0]
+        data = body[start:body.rindex(b"\r\n--" + boundary)]
+        dest = _path(query["fs"], os.path.join(query.get("remote", ""), filename))
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        with open(dest, "wb") as f:
+            f.write(data)
+        return {}
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        path, _, query = self.path.partition("?")
+        method = path.strip("/")
+        try:
+            if method == "operations/uploadfile":
+                query = {k: v[0] for k, v in urllib.parse.parse_qs(query).items()}
+                return self._reply(200, json.dumps(self._upload(method, query, length)).encode())
+            params = json.loads(self.rfile.read(length) or b"{}")
+            result = self.server.rcd.call(method, params)
+            self._reply(200, json.dumps(result).encode())
+        except Exception as e:
+            self._reply(500, json.dumps({"error": str(e), "path": method, "status": 500}).encode())
+
+    def do_GET(self):
+        # --rc-serve: /[remote:]/path
+        if not self._authorized():
+            return
+        if not self.path.startswith("/["):
+            return self._reply(404, b"not found", "text/plain")
+        fs, _, remote = self.path[2:].partition("]/")
+        path = _path(fs, remote)
+        if not os.path.isfile(path):
+            return self._reply(404, b"not found", "text/plain")
+        with open(path, "rb") as f:
+            data = f.read()
+        size = len(data)
+        byte_range = self.headers.get("Range", "")
+        if byte_range.startswith("bytes="):
+            start, _, end = byte_range[len("bytes="):].partition("-")
+            start, end = int(start or 0), min(int(end) if end else size - 1, size - 1)
+            return self._reply(206, data[start:end + 1], "application/octet-stream",
+                               {"Content-Range": f"bytes {start}-{end}/{size}"})
+        self._reply(200, data, "application/octet-stream")
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def main(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if not argv or argv[0] != "rcd" or "--rc-addr" not in argv:
+        sys.exit("usage: fake_rcd rcd --rc-addr unix:///path/to/socket [--rc-user U --rc-pass P] "
+                 "[--rc-no-auth] [--rc-serve]")
+    addr = argv[argv.index("--rc-addr") + 1]
+    if not addr.startswith("unix://"):
+        sys.exit("fake_rcd only listens on unix:// addresses")
+    socket_path = addr[len("unix://"):]
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = _Server(socket_path, _Handler)
+    server.rcd = FakeRcd()
+    server.rcd.server = server
+    user = argv[argv.index("--rc-user") + 1] if "--rc-user" in argv else os.environ.get("RCLONE_RC_USER")
+    password = argv[argv.index("--rc-pass") + 1] if "--rc-pass" in argv else os.environ.get("RCLONE_RC_PASS")
+    server.auth = None
+    if user and password and "--rc-no-auth" not in argv:
+        server.auth = f"Basic {base64.b64encode(f'{user}:{password}'.encode()).decode()}"
+    try:
+        server.serve_forever()
+    finally:
+        os.remove(socket_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,67 @@
 import subprocess
 import os
+import pwd
+import io
 import sys
+import hashlib
+import tempfile
+import threading
+import contextlib
 from .base_handler import BaseHandler
+from .rclone_rcd import RcdClient
+from .multipart import MultipartTransfer
+from enc_server.backup_packer import ChunkedReader
 
 class GDriveHandler(BaseHandler):
+    """
+    Google Drive through rclone. By default calls go to a long-lived `rclone rcd`
+    (see RcdClient), so Drive authentication and connections are reused; with
+    `rcd: false` in the handler config, or if the daemon cannot be started, every
+    call runs its own rclone process. `rclone:` overrides the command (e.g. the
+    offline stand-in `python3 -m enc_server.handlers.fake_rcd`).
+    """
+    REMOTE = True
+    VERIFY_TIMEOUT = 20 # seconds
+    FS = "enc_gdrive:"
+    _rcd_lock = threading.Lock() # parts upload in parallel; the first caller starts the daemon
+
+    def _state_dir(self, name: str) -> str:
+        """Local state of this handler under the owning user's config dir."""
+        config_dir = self.config_dir or os.path.join(pwd.getpwuid(os.getuid()).pw_dir, ".enc_config")
+        return os.path.join(str(config_dir), name)
+
+    def _rcd(self):
+        """The rcd client, or None to use one rclone process per call."""
+        if not self.config.get("rcd", True):
+            return None
+        with self._rcd_lock:
+            if not hasattr(self, "_rcd_client"):
+                client = None
+                try:
+                    client = RcdClient(self._setup_rclone_config(), self._state_dir("rclone"),
+                                       self.config.get("rclone", "rclone"))
+                    client.ensure_started()
+                except Exception as e:
+                    client = None
+                    from enc_server.debug import debug_log
+                    debug_log(f"GDriveHandler: rclone rcd unavailable ({e}); falling back to rclone per call.")
+                self._rcd_client = client
+        return self._rcd_client
+
     def verify(self) -> bool:
+        rcd = self._rcd()
+        if rcd:
+            try:
+                rcd.call("operations/list", timeout=self.VERIFY_TIMEOUT, fs=self.FS, remote="",
+                         opt={"dirsOnly": True})
+                return True
+            except Exception:
+                return False
         env = self._setup_rclone_config()
         try:
             # Check if we can list the remote
-            subprocess.run(["rclone", "lsd", "enc_gdrive:"], env=env, check=True, capture_output=True)
+            subprocess.run(["rclone", "lsd", "enc_gdrive:"], env=env, check=True, capture_output=True,
+                           timeout=self.VERIFY_TIMEOUT)
             return True
         except Exception:
             return False
@@ -27,14 +80,146 @@ class GDriveHandler(BaseHandler):
 
         return env
 
-    def push(self, source_file: str) -> bool:
+    # --- Objects larger than part_size go up in resumable parts (see MultipartTransfer) ---
+
+    def _multipart(self) -> MultipartTransfer:
+        return MultipartTransfer(self, self._state_dir("uploads"),
+                                 int(self.config.get("part_size", 64)) * 1024 * 1024,
+                                 int(self.config.get("upload_workers", MultipartTransfer.WORKERS)))
+
+    def push(self, source_file: str, name: str = BaseHandler.BACKUP_NAME) -> bool:
+        multipart = self._multipart()
+        if os.path.getsize(source_file) > multipart.part_size:
+            from enc_server.debug import debug_log
+            debug_log(f"GDriveHandler: Pushing {source_file} to GDrive in parts...")
+            return multipart.push(source_file, name)
+        multipart.drop(name)
+        return self._push_object(source_file, name)
+
+    def pull(self, dest_file: str, name: str = BaseHandler.BACKUP_NAME) -> bool:
+        multipart = self._multipart()
+        try:
+            manifest = multipart.load_manifest(name)
+            if manifest:
+                print("Pulling backup parts from Google Drive...", file=sys.stderr)
+                return multipart.pull(manifest, dest_file)
+        except Exception as e:
+            print(f"GDrive Download Failed: {e}", file=sys.stderr)
+            return False
+        return self._pull_object(dest_file, name)
+
+    @contextlib.contextmanager
+    def open_stream(self, name: str = BaseHandler.BACKUP_NAME, staging_dir: str = None):
+        """The object as it downloads, so the reader decrypts and extracts while the transfer runs."""
+        multipart = self._multipart()
+        manifest = multipart.load_manifest(name)
+        if not manifest:
+            with self._open_object(name) as f:
+                yield f
+            return
+        with contextlib.closing(multipart.stream(manifest)) as blocks:
+            yield io.BufferedReader(ChunkedReader(blocks), buffer_size=MultipartTransfer.HASH_BLOCK)
+
+    def read_head(self, name: str = BaseHandler.BACKUP_NAME, size: int = 4096) -> bytes:
+        manifest = self._multipart().load_manifest(name)
+        return self._read_head_object(manifest["parts"][0]["name"] if manifest else name, size)
+
+    def checksum(self, name: str = BaseHandler.BACKUP_NAME, size: int = None) -> str:
+        # Objects in parts carry their SHA-256 in the manifest; small ones are cheaper to re-send than to check
+        multipart = self._multipart()
+        if size is not None and size <= multipart.part_size:
+            return None
+        try:
+            manifest = multipart.load_manifest(name)
+        except Exception:
+            return None
+        return manifest["sha256"] if manifest else None
+
+    def list(self, prefix: str) -> set:
+        names = (MultipartTransfer.logical_name(n) for n in self._list_objects(prefix))
+        return {n for n in names if n}
+
+    def delete_many(self, names) -> bool:
+        names = set(names)
+        if not names:
+            return True
+        # Multipart objects also own their manifest and parts: one listing per directory
+        # (per object at the root, which would otherwise list the whole remote)
+        # A root-level object's manifest sits beside its parts directory, outside that listing
+        raw = names | {MultipartTransfer.manifest_name(n) for n in names}
+        prefixes = {os.path.dirname(n) or MultipartTransfer.parts_prefix(n) for n in names}
+        for prefix in prefixes:
+            for n in self._list_objects(prefix):
+                if MultipartTransfer.logical_name(n) in names or n.split(".parts/")[0] in names:
+                    raw.add(n)
+        return self._delete_objects(sorted(raw))
+
+    def put_range(self, source_file: str, offset: int, length: int, name: str) -> str:
+        """Upload part of source_file as name; returns the MD5 of the bytes sent."""
+        rcd = self._rcd()
+        if rcd:
+            return rcd.upload(self.FS, name, source_file, offset, length)
+        md5 = hashlib.md5()
+        proc = subprocess.Popen(["rclone", "rcat", self.FS + name], env=self._setup_rclone_config(),
+                                stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        try:
+            with open(source_file, "rb") as f:
+                f.seek(offset)
+                remaining = length
+                while remaining > 0:
+                    block = f.read(min(1024 * 1024, remaining))
+                    if not block:
+                        break
+                    md5.update(block)
+                    proc.stdin.write(block)
+                    remaining -= len(block)
+            proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        stderr = proc.stderr.read().decode(errors="replace")
+        if proc.wait() != 0:
+            raise Exception(f"rclone rcat failed: {stderr.strip()}")
+        return md5.hexdigest()
+
+    def hashsums(self, prefix: str) -> dict:
+        """MD5 of every object under prefix, as stored by Drive."""
+        rcd = self._rcd()
+        if rcd:
+            lines = rcd.call("operations/hashsum", fs=self.FS + prefix, hashType="md5").get("hashsum", [])
+        else:
+            res = subprocess.run(["rclone", "md5sum", self.FS + prefix], env=self._setup_rclone_config(),
+                                 capture_output=True, text=True)
+            if res.returncode != 0:
+                raise Exception(f"rclone md5sum failed: {res.stderr.strip()}")
+            lines = res.stdout.splitlines()
+        sums = {}
+        for line in lines:
+            digest, _, path = line.partition("  ")
+            if path:
+                sums[f"{prefix.rstrip('/')}/{path}"] = digest
+        return sums
+
+    # --- Single objects ---
+
+    def _push_object(self, source_file: str, name: str = BaseHandler.BACKUP_NAME) -> bool:
         env = self._setup_rclone_config()
         dest = "enc_gdrive:"
         
         from enc_server.debug import debug_log # Absolute import
         debug_log(f"GDriveHandler: Pushing {source_file} to GDrive...")
+        rcd = self._rcd()
+        if rcd:
+            try:
+                source_file = os.path.abspath(source_file)
+                rcd.run("operations/copyfile", srcFs=os.path.dirname(source_file),
+                        srcRemote=os.path.basename(source_file), dstFs=self.FS, dstRemote=name)
+                debug_log("GDriveHandler: Upload Successful.")
+                return True
+            except Exception as e:
+                debug_log(f"GDriveHandler: Upload Failed: {e}")
+                raise Exception(str(e))
         try:
-            cmd = ["rclone", "copyto", source_file, dest + "user_backup.enc"]
+            cmd = ["rclone", "copyto", source_file, dest + name]
             res = subprocess.run(cmd, env=env, check=True, capture_output=True, text=True)
             debug_log("GDriveHandler: Upload Successful.")
             return True
@@ -43,11 +228,22 @@ class GDriveHandler(BaseHandler):
             debug_log(f"GDriveHandler: Upload Failed: {msg}")
             raise Exception(msg)
 
-    def pull(self, dest_file: str) -> bool:
+    def _pull_object(self, dest_file: str, name: str = BaseHandler.BACKUP_NAME) -> bool:
         env = self._setup_rclone_config()
-        source = "enc_gdrive:user_backup.enc"
+        source = "enc_gdrive:" + name
         
         print("Pulling backup from Google Drive...", file=sys.stderr)
+        rcd = self._rcd()
+        if rcd:
+            try:
+                dest_file = os.path.abspath(dest_file)
+                rcd.run("operations/copyfile", srcFs=self.FS, srcRemote=name,
+                        dstFs=os.path.dirname(dest_file), dstRemote=os.path.basename(dest_file))
+                print("GDrive Download Successful.", file=sys.stderr)
+                return os.path.exists(dest_file)
+            except Exception as e:
+                print(f"GDrive Download Failed: {e}", file=sys.stderr)
+                return False
         try:
             cmd = ["rclone", "copyto", source, dest_file]
             subprocess.run(cmd, env=env, check=True)
@@ -60,3 +256,116 @@ class GDriveHandler(BaseHandler):
         except subprocess.CalledProcessError as e:
             print(f"GDrive Download Failed: {e}", file=sys.stderr)
             return False
+
+    @contextlib.contextmanager
+    def _open_object(self, name: str):
+        rcd = self._rcd()
+        if rcd:
+            with rcd.open_read(self.FS, name) as res:
+                yield res
+            return
+        proc = subprocess.Popen(["rclone", "cat", "enc_gdrive:" + name], env=self._setup_rclone_config(),
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            yield proc.stdout
+            # Only a fully read stream says whether rclone succeeded
+            if proc.stdout.read(1) == b"" and proc.wait() != 0:
+                stderr = proc.stderr.read().decode(errors="replace")
+                if "not found" in stderr:
+                    raise FileNotFoundError(f"{name} not found on GDrive")
+                raise Exception(f"rclone cat failed: {stderr.strip()}")
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+            proc.wait()
+            proc.stdout.close()
+            proc.stderr.close()
+
+    def _read_head_object(self, name: str, size: int) -> bytes:
+        rcd = self._rcd()
+        if rcd:
+            return rcd.read_range(self.FS, name, size)
+        env = self._setup_rclone_config()
+        res = subprocess.run(["rclone", "cat", "--count", str(size), "enc_gdrive:" + name],
+                             env=env, capture_output=True)
+        if res.returncode != 0:
+            stderr = res.stderr.decode(errors="replace")
+            if "not found" in stderr:
+                raise FileNotFoundError(f"{name} not found on GDrive")
+            raise Exception(f"rclone cat failed: {stderr.strip()}")
+        return res.stdout
+
+    def _list_objects(self, prefix: str) -> set:
+        rcd = self._rcd()
+        if rcd:
+            try:
+                entries = rcd.call("operations/list", fs=self.FS, remote=prefix,
+                                   opt={"recurse": True, "filesOnly": True}).get("list", [])
+            except Exception as e:
+                # A missing prefix directory simply means no objects yet
+                if "directory not found" in str(e):
+                    return set()
+                raise
+            root = prefix.rstrip("/")
+            # Paths are relative to the remote root
+            return {e["Path"] if not root or e["Path"].startswith(root + "/") else f"{root}/{e['Path']}"
+                    for e in entries}
+        env = self._setup_rclone_config()
+        cmd = ["rclone", "lsf", "-R", "--files-only", "enc_gdrive:" + prefix]
+        res = subprocess.run(cmd, env=env, capture_output=True, text=True)
+        if res.returncode != 0:
+            # A missing prefix directory simply means no objects yet
+            if "directory not found" in res.stderr:
+                return set()
+            raise Exception(f"rclone lsf failed: {res.stderr.strip()}")
+        root = prefix.rstrip("/")
+        # lsf prints paths relative to the listed directory
+        return {f"{root}/{line}" if root else line for line in res.stdout.splitlines() if line}
+
+    def _run_with_file_list(self, cmd, names, rc_method=None, **rc_params):
+        """Run an rclone command (or rc job) filtered to the given relative paths, one call for all."""
+        env = self._setup_rclone_config()
+        with tempfile.NamedTemporaryFile("w", suffix=".lst", delete=False) as f:
+            f.write("\n".join(names) + "\n")
+            list_file = f.name
+        rcd = self._rcd() if rc_method else None
+        if rcd:
+            try:
+                rcd.run(rc_method, _filter={"FilesFromRaw": [list_file]}, **rc_params)
+                return True
+            except Exception as e:
+                from enc_server.debug import debug_log
+                debug_log(f"GDriveHandler: {rc_method} failed: {e}")
+                return False
+            finally:
+                os.remove(list_file)
+        try:
+            subprocess.run(cmd + ["--files-from-raw", list_file], env=env, check=True, capture_output=True, text=True)
+            return True
+        except subprocess.CalledProcessError as e:
+            from enc_server.debug import debug_log
+            debug_log(f"GDriveHandler: {cmd[1]} failed: {e.stdout} {e.stderr}")
+            return False
+        finally:
+            os.remove(list_file)
+
+    def push_tree(self, source_dir: str, names) -> bool:
+        names = list(names)
+        if not names:
+            return True
+        return self._run_with_file_list(["rclone", "copy", source_dir, "enc_gdrive:"], names,
+                                        "sync/copy", srcFs=os.path.abspath(source_dir), dstFs=self.FS)
+
+    def pull_many(self, names, dest_dir: str) -> bool:
+        names = list(names)
+        if not names:
+            return True
+        return self._run_with_file_list(["rclone", "copy", "enc_gdrive:", dest_dir], names,
+                                        "sync/copy", srcFs=self.FS, dstFs=os.path.abspath(dest_dir))
+
+    def _delete_objects(self, names) -> bool:
+        names = list(names)
+        if not names:
+            return True
+        return self._run_with_file_list(["rclone", "delete", "enc_gdrive:"], names,
+                                        "operations/delete", fs=self.FS)
@@ -1,14 +1,62 @@
 import shutil
 import os
 import sys
+import time
+import fcntl
+import contextlib
 from .base_handler import BaseHandler
 
+FICLONE = 0x40049409 # ioctl: share all extents of another file (btrfs, xfs, ...)
+
+
+def copy_file(source_file: str, dest_file: str):
+    """
+    Copy a file without passing its data through user space: a reflink where the
+    filesystem supports one, else copy_file_range, else a plain buffered copy.
+    Metadata is copied as with shutil.copy2.
+    """
+    with open(source_file, "rb") as src, open(dest_file, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            size = os.fstat(src.fileno()).st_size
+            copied = 0
+            try:
+                while copied < size:
+                    n = os.copy_file_range(src.fileno(), dst.fileno(), size - copied)
+                    if n == 0:
+                        break
+                    copied += n
+            except (AttributeError, OSError):
+                # No copy_file_range (or not across these filesystems): finish from where it stopped
+                src.seek(copied)
+                dst.seek(copied)
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+    shutil.copystat(source_file, dest_file)
+
+
 class LocalHandler(BaseHandler):
+    """
+    Backups on a local (or mounted) filesystem. Objects are published by rename,
+    never rewritten in place, and after each push of a full-mode object the live
+    backup (user_backup.enc plus its deltas) is snapshotted into
+    generations/<UTC timestamp>/ as hardlinks. Generations therefore share every
+    unchanged file and cost only directory entries; they are thinned per `keep:`.
+    """
+    GENERATIONS_DIR = "generations"
+    INCOMING_DIR = ".incoming"
+    # Full-mode deltas live here; the chunk store keeps its own generations
+    DELTAS_DIR = "deltas"
+    # Newest `last` generations, plus the newest one of each of the last N hours/days/weeks
+    DEFAULT_KEEP = {"last": 5, "hourly": 24, "daily": 7, "weekly": 4}
+    THINNING = (("hourly", "%Y%m%d%H"), ("daily", "%Y%m%d"), ("weekly", "%G%V"))
+    STAMP = "%Y%m%dT%H%M%SZ"
+
     def verify(self) -> bool:
         dest_path = self.config.get("path")
         if not dest_path:
             return False
-        
+
         dest_path = os.path.expanduser(dest_path)
         try:
             if not os.path.exists(dest_path):
@@ -22,38 +70,232 @@ class LocalHandler(BaseHandler):
         except Exception:
             return False
 
-    def push(self, source_file: str) -> bool:
+    def _root(self):
         dest_path = self.config.get("path")
-        if not dest_path:
+        return os.path.expanduser(dest_path) if dest_path else None
+
+    def local_path(self, name: str = BaseHandler.BACKUP_NAME):
+        """Absolute path of an object, for reading it in place."""
+        root = self._root()
+        return os.path.join(root, name) if root else None
+
+    def _incoming(self, name: str) -> str:
+        """Temporary path for name on the destination filesystem, for publishing by rename."""
+        incoming = os.path.join(self._root(), self.INCOMING_DIR)
+        os.makedirs(incoming, exist_ok=True)
+        return os.path.join(incoming, f"{name.replace('/', '_')}.{os.getpid()}")
+
+    def _publish(self, tmp_file: str, name: str):
+        # A crash before this leaves the previous object intact, and generations keep their own link to it
+        dest_file = os.path.join(self._root(), name)
+        os.makedirs(os.path.dirname(dest_file), exist_ok=True)
+        os.replace(tmp_file, dest_file)
+        if name == self.BACKUP_NAME:
+            print(f"Backup saved locally to {self._root()}", file=sys.stderr)
+
+        if self._keep() and (name == self.BACKUP_NAME or name.startswith(f"{self.DELTAS_DIR}/")):
+            try:
+                self.snapshot()
+            except Exception as e:
+                # History is best effort; the backup itself landed
+                print(f"Local Backup: Failed to record generation: {e}", file=sys.stderr)
+
+    def push(self, source_file: str, name: str = BaseHandler.BACKUP_NAME) -> bool:
+        if not self._root():
             print("Error: Local backup path not configured.", file=sys.stderr)
             return False
-        
-        dest_path = os.path.expanduser(dest_path)
-        
+
+        tmp_file = None
         try:
-            os.makedirs(dest_path, exist_ok=True)
-            shutil.copy2(source_file, dest_path)
-            print(f"Backup saved locally to {dest_path}", file=sys.stderr)
+            tmp_file = self._incoming(name)
+            copy_file(source_file, tmp_file)
+            self._publish(tmp_file, name)
             return True
         except Exception as e:
             print(f"Local Backup Failed: {e}", file=sys.stderr)
             return False
+        finally:
+            if tmp_file and os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+    @contextlib.contextmanager
+    def sink(self, name: str = BaseHandler.BACKUP_NAME, staging_dir: str = None):
+        """Write straight into the destination; the object is renamed into place on success."""
+        if not self._root():
+            raise FileNotFoundError("Local backup path not configured.")
+        tmp_file = self._incoming(name)
+        try:
+            yield tmp_file
+            self._publish(tmp_file, name)
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+    @contextlib.contextmanager
+    def source(self, name: str = BaseHandler.BACKUP_NAME, staging_dir: str = None):
+        """The stored object itself, read in place. Published objects are never rewritten, only replaced."""
+        path = self.local_path(name)
+        if not path or not os.path.isfile(path):
+            raise FileNotFoundError(f"No backup file found at {path}")
+        yield path
+
+    def pull(self, dest_file: str, name: str = BaseHandler.BACKUP_NAME, generation: str = None) -> bool:
+        if generation:
+            try:
+                return self.at_generation(generation).pull(dest_file, name)
+            except FileNotFoundError as e:
+                print(f"Local Restore Failed: {e}", file=sys.stderr)
+                return False
 
-    def pull(self, dest_file: str) -> bool:
-        source_path = self.config.get("path")
+        source_path = self._root()
         if not source_path:
             return False
-            
-        source_path = os.path.expanduser(source_path)
-        backup_file = os.path.join(source_path, "user_backup.enc")
-        
+
+        backup_file = os.path.join(source_path, name)
+
         if not os.path.exists(backup_file):
             print(f"No backup file found at {backup_file}", file=sys.stderr)
             return False
-            
+
         try:
-            shutil.copy2(backup_file, dest_file)
+            copy_file(backup_file, dest_file)
             return True
         except Exception as e:
              print(f"Local Restore Failed: {e}", file=sys.stderr)
              return False
+
+    def read_head(self, name: str = BaseHandler.BACKUP_NAME, size: int = 4096) -> bytes:
+        path = self.local_path(name)
+        if not path:
+            raise FileNotFoundError("Local backup path not configured.")
+        with open(path, "rb") as f:
+            return f.read(size)
+
+    def list(self, prefix: str) -> set:
+        root = self._root()
+        if not root:
+            return set()
+        base = os.path.join(root, prefix)
+        names = set()
+        for dirpath, dirs, files in os.walk(base):
+            if os.path.normpath(dirpath) == os.path.normpath(root):
+                dirs[:] = [d for d in dirs if d not in (self.GENERATIONS_DIR, self.INCOMING_DIR)]
+            for f in files:
+                names.add(os.path.relpath(os.path.join(dirpath, f), root))
+        return names
+
+    def delete_many(self, names) -> bool:
+        root = self._root()
+        if not root:
+            return False
+        try:
+            for name in names:
+                path = os.path.join(root, name)
+                if os.path.exists(path):
+                    os.remove(path)
+            return True
+        except Exception as e:
+            print(f"Local Delete Failed: {e}", file=sys.stderr)
+            return False
+
+    # --- Generations ---
+
+    def _keep(self) -> dict:
+        """Retention rules, or None if history is disabled (`keep: false`)."""
+        keep = self.config.get("keep", True)
+        if keep is False:
+            return None
+        return dict(self.DEFAULT_KEEP, **(keep if isinstance(keep, dict) else {}))
+
+    def _generations_root(self):
+        root = self._root()
+        return os.path.join(root, self.GENERATIONS_DIR) if root else None
+
+    def _live_history(self) -> list:
+        root = self._root()
+        names = [self.BACKUP_NAME] if os.path.isfile(os.path.join(root, self.BACKUP_NAME)) else []
+        return names + sorted(self.list(self.DELTAS_DIR))
+
+    @classmethod
+    def _stamp_time(cls, generation: str):
+        return time.strptime(generation.split("-")[0], cls.STAMP)
+
+    def generations(self) -> list:
+        """Names of the stored generations, oldest first."""
+        gen_root = self._generations_root()
+        try:
+            names = [n for n in os.listdir(gen_root) if not n.startswith(".")]
+        except (OSError, TypeError):
+            return []
+        return sorted(names, key=self._order)
+
+    @staticmethod
+    def _order(generation: str):
+        stamp, _, n = generation.partition("-")
+        return stamp, int(n or 0)
+
+    def at_generation(self, generation: str) -> "LocalHandler":
+        """Read-only view of one generation, usable wherever a handler is (pull, list, read_head)."""
+        gen_root = self._generations_root()
+        path = os.path.join(gen_root, generation) if gen_root else None
+        if not path or generation.startswith(".") or "/" in generation or not os.path.isdir(path):
+            raise FileNotFoundError(f"No backup generation '{generation}'")
+        return LocalHandler({"path": path, "keep": False})
+
+    def snapshot(self):
+        """
+        Record the live full-mode objects as a new generation, unless they are the
+        same files as in the newest one. Returns the generation's name.
+        """
+        root, gen_root = self._root(), self._generations_root()
+        live = self._live_history()
+        if not live:
+            return None
+        inodes = {n: os.stat(os.path.join(root, n)).st_ino for n in live}
+        gens = self.generations()
+        if gens:
+            latest = self.at_generation(gens[-1])
+            try:
+                if {n: os.stat(latest.local_path(n)).st_ino for n in latest._live_history()} == inodes:
+                    return gens[-1]
+            except OSError:
+                pass
+
+        stamp = time.strftime(self.STAMP, time.gmtime())
+        # Several generations in one second get increasing suffixes (never a thinned-out name again)
+        same = [self._order(g)[1] for g in gens if g.partition("-")[0] == stamp]
+        name = f"{stamp}-{max(same) + 1}" if same else stamp
+        tmp_dir = os.path.join(gen_root, f".{name}")
+        for rel in live:
+            dest = os.path.join(tmp_dir, rel)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            try:
+                os.link(os.path.join(root, rel), dest)
+            except OSError:
+                # Filesystems without hardlinks get a reflink, or failing that a copy
+                copy_file(os.path.join(root, rel), dest)
+        os.rename(tmp_dir, os.path.join(gen_root, name))
+        self.thin()
+        return name
+
+    def thin(self) -> list:
+        """Drop generations no retention rule keeps. Returns the removed names."""
+        keep = self._keep()
+        gens = self.generations()[::-1] # newest first
+        if not keep or not gens:
+            return []
+        kept = set(gens[:max(1, int(keep["last"]))])
+        for rule, bucket_format in self.THINNING:
+            buckets = set()
+            for gen in gens:
+                bucket = time.strftime(bucket_format, self._stamp_time(gen))
+                if bucket in buckets:
+                    continue
+                if len(buckets) >= int(keep.get(rule, 0)):
+                    break
+                buckets.add(bucket)
+                kept.add(gen)
+        removed = [g for g in gens if g not in kept]
+        for gen in removed:
+            shutil.rmtree(os.path.join(self._generations_root(), gen), ignore_errors=True)
+        return removed
@@ -0,0 +1,211 @@
+import os
+import json
+import hashlib
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from enc_server.debug import debug_log
+
+
+class MultipartTransfer:
+    """
+    Large objects on a remote handler as parts plus a manifest:
+
+        <name>.parts/<upload id>/<index>   parts, uploaded in parallel
+        <name>.parts.json                  manifest, written last: sizes, MD5s, whole-file SHA-256
+
+    Acknowledged parts are recorded in a session file under state_dir (the owning
+    user's ~/.enc_config/uploads), so a retried push only sends the parts that
+    never landed. Before the manifest is published every
+    part's remote MD5 is checked against what was sent; pulls check each part and
+    the reassembled file's SHA-256.
+
+    The handler provides raw single-object primitives: put_range(source, offset,
+    length, name) -> md5, hashsums(prefix) -> {name: md5}, _push_object,
+    _pull_object, _list_objects and _delete_objects.
+    """
+    PART_SIZE = 64 * 1024 * 1024
+    WORKERS = 4
+    HASH_BLOCK = 1024 * 1024
+
+    def __init__(self, handler, state_dir: str, part_size: int = PART_SIZE, workers: int = WORKERS):
+        self.handler = handler
+        self.state_dir = state_dir
+        self.part_size = part_size
+        self.workers = workers
+
+    @staticmethod
+    def manifest_name(name: str) -> str:
+        return f"{name}.parts.json"
+
+    @staticmethod
+    def parts_prefix(name: str) -> str:
+        return f"{name}.parts"
+
+    @classmethod
+    def logical_name(cls, raw: str):
+        """Map a raw remote name to the object it belongs to (None for part files)."""
+        if raw.endswith(".parts.json"):
+            return raw[:-len(".parts.json")]
+        if ".parts/" in raw:
+            return None
+        return raw
+
+    # --- Upload ---
+
+    def _session_path(self, source: str, name: str) -> str:
+        st = os.stat(source)
+        key = f"{self.handler.FS}|{name}|{os.path.abspath(source)}|{st.st_size}|{st.st_mtime_ns}"
+        return os.path.join(self.state_dir, hashlib.sha256(key.encode()).hexdigest()[:32] + ".json")
+
+    def _load_session(self, path: str, source: str) -> dict:
+        try:
+            with open(path, "r") as f:
+                session = json.load(f)
+            if session.get("part_size") == self.part_size:
+                return session
+        except (OSError, ValueError):
+            pass
+        digest = hashlib.sha256()
+        with open(source, "rb") as f:
+            for block in iter(lambda: f.read(self.HASH_BLOCK), b""):
+                digest.update(block)
+        return {"sha256": digest.hexdigest(), "size": os.path.getsize(source),
+                "part_size": self.part_size, "acked": {}}
+
+    def _save_session(self, path: str, session: dict):
+        os.makedirs(self.state_dir, mode=0o700, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(session, f)
+        os.replace(tmp_path, path)
+
+    def push(self, source: str, name: str) -> bool:
+        session_path = self._session_path(source, name)
+        session = self._load_session(session_path, source)
+        upload_id = session["sha256"][:16]
+        prefix = f"{self.parts_prefix(name)}/{upload_id}"
+        size = session["size"]
+        count = max(1, -(-size // self.part_size))
+        parts = [(i, i * self.part_size, min(self.part_size, size - i * self.part_size)) for i in range(count)]
+        todo = [p for p in parts if str(p[0]) not in session["acked"]]
+        if len(todo) < count:
+            debug_log(f"Multipart: resuming {name}: {count - len(todo)}/{count} parts already uploaded.")
+
+        def upload(part):
+            index, offset, length = part
+            return index, self.handler.put_range(source, offset, length, f"{prefix}/{index:05d}")
+
+        errors = []
+        with ThreadPoolExecutor(max_workers=min(self.workers, max(1, len(todo)))) as executor:
+            for future in [executor.submit(upload, p) for p in todo]:
+                try:
+                    index, md5 = future.result()
+                    session["acked"][str(index)] = md5
+                    self._save_session(session_path, session)
+                except Exception as e:
+                    errors.append(str(e))
+        if errors:
+            raise Exception(f"{len(errors)}/{len(todo)} parts of {name} failed: {errors[0]}")
+
+        # Verify what the remote stored before publishing
+        remote = self.handler.hashsums(prefix)
+        bad = [i for i, _, _ in parts if remote.get(f"{prefix}/{i:05d}") != session["acked"][str(i)]]
+        if bad:
+            for i in bad:
+                session["acked"].pop(str(i), None)
+            self._save_session(session_path, session)
+            raise Exception(f"Checksum mismatch on {len(bad)} part(s) of {name}; they will be re-sent.")
+
+        manifest = {
+            "version": 1,
+            "size": size,
+            "sha256": session["sha256"],
+            "part_size": self.part_size,
+            "parts": [{"name": f"{prefix}/{i:05d}", "size": length, "md5": session["acked"][str(i)]}
+                      for i, _, length in parts],
+        }
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+            json.dump(manifest, f)
+            manifest_file = f.name
+        try:
+            if not self.handler._push_object(manifest_file, self.manifest_name(name)):
+                raise Exception(f"Failed to publish manifest for {name}")
+        finally:
+            os.remove(manifest_file)
+
+        # The manifest is the commit point; drop the superseded single object and older uploads
+        stale = [n for n in self.handler._list_objects(self.parts_prefix(name))
+                 if not n.startswith(prefix + "/")]
+        self.handler._delete_objects([name] + stale)
+        os.remove(session_path)
+        return True
+
+    def drop(self, name: str):
+        """Remove the multipart form of name (before a plain upload replaces it)."""
+        # Parts outlive their manifest (they are deleted after it), so no parts means no manifest
+        raw = self.handler._list_objects(self.parts_prefix(name))
+        if raw:
+            # Manifest first: a half-removed object then just looks absent
+            self.handler._delete_objects([self.manifest_name(name)])
+            self.handler._delete_objects(sorted(raw))
+
+    # --- Download ---
+
+    def load_manifest(self, name: str):
+        """The object's manifest, or None if name is not stored in parts."""
+        if not self.handler._list_objects(self.parts_prefix(name)):
+            return None
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "manifest.json")
+            if not self.handler._pull_object(path, self.manifest_name(name)):
+                return None
+            with open(path, "r") as f:
+                return json.load(f)
+
+    def stream(self, manifest: dict):
+        """
+        Yield the object's bytes part after part as they download. A part that fails
+        its MD5, or a whole that fails its SHA-256, raises once its bytes are read.
+        """
+        whole = hashlib.sha256()
+        for part in manifest["parts"]:
+            digest = hashlib.md5()
+            with self.handler._open_object(part["name"]) as f:
+                for block in iter(lambda: f.read(self.HASH_BLOCK), b""):
+                    digest.update(block)
+                    whole.update(block)
+                    yield block
+            if digest.hexdigest() != part["md5"]:
+                raise Exception(f"Part {part['name']} is corrupt")
+        if whole.hexdigest() != manifest["sha256"]:
+            raise Exception("Streamed object does not match its checksum")
+
+    def pull(self, manifest: dict, dest_file: str) -> bool:
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(dest_file))) as tmp:
+            def fetch(part):
+                path = os.path.join(tmp, os.path.basename(part["name"]))
+                if not self.handler._pull_object(path, part["name"]):
+                    raise Exception(f"Part {part['name']} is missing")
+                digest = hashlib.md5()
+                with open(path, "rb") as f:
+                    for block in iter(lambda: f.read(self.HASH_BLOCK), b""):
+                        digest.update(block)
+                if digest.hexdigest() != part["md5"]:
+                    raise Exception(f"Part {part['name']} is corrupt")
+                return path
+
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                paths = list(executor.map(fetch, manifest["parts"]))
+
+            digest = hashlib.sha256()
+            with open(dest_file, "wb") as out:
+                for path in paths:
+                    with open(path, "rb") as f:
+                        for block in iter(lambda: f.read(self.HASH_BLOCK), b""):
+                            digest.update(block)
+                            out.write(block)
+                    os.remove(path)
+        if digest.hexdigest() != manifest["sha256"]:
+            os.remove(dest_file)
+            raise Exception("Reassembled file does not match its checksum")
+        return True
@@ -0,0 +1,239 @@
+import os
+import stat
+import json
+import base64
+import time
+import fcntl
+import shlex
+import socket
+import hashlib
+import contextlib
+import subprocess
+import http.client
+import urllib.parse
+from enc_server.debug import debug_log
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class RcdError(Exception):
+    pass
+
+
+class RcdClient:
+    """
+    One long-lived `rclone rcd` per user and remote configuration, reached over a
+    Unix socket in a private runtime directory (0700, owned by this user). The daemon
+    keeps Drive tokens and connections between calls; transfers run as async jobs
+    that are polled for completion and progress.
+
+    Every start picks a random rc user and password, kept in a 0600 file next to the
+    socket for later clients, so nothing that reaches the socket gets in without them.
+    """
+    START_TIMEOUT = 10 # seconds for a new daemon to open its socket
+    CALL_TIMEOUT = 60
+    POLL_INTERVAL = 0.5
+    PROGRESS_EVERY = 10 # seconds between progress log lines
+    UPLOAD_BLOCK = 1024 * 1024
+    UPLOAD_TIMEOUT = 600 # seconds without progress before an upload is given up
+    MAX_SOCKET_PATH = 107 # sun_path limit
+
+    def __init__(self, env: dict, runtime: str, command: str = "rclone"):
+        self.env = env
+        self.command = shlex.split(command)
+        # A config change (credentials, folder) gets its own daemon
+        fingerprint = hashlib.sha256(json.dumps(
+            {k: v for k, v in sorted(env.items()) if k.startswith("RCLONE_CONFIG_")}).encode()).hexdigest()[:12]
+        os.makedirs(runtime, mode=0o700, exist_ok=True)
+        st = os.lstat(runtime)
+        if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or stat.S_IMODE(st.st_mode) != 0o700:
+            raise RcdError(f"{runtime} is not a private directory of this user")
+        self.socket_path = os.path.join(runtime, f"rcd-{fingerprint}.sock")
+        if len(self.socket_path.encode()) > self.MAX_SOCKET_PATH:
+            raise RcdError(f"Socket path {self.socket_path} is too long")
+        self.log_path = os.path.join(runtime, f"rcd-{fingerprint}.log")
+        self._lock_path = os.path.join(runtime, f"rcd-{fingerprint}.lock")
+        self._auth_path = os.path.join(runtime, f"rcd-{fingerprint}.auth")
+
+    def _headers(self, headers: dict = None) -> dict:
+        """headers plus the Basic auth of the running daemon (re-read: another process may have restarted it)."""
+        headers = dict(headers or {})
+        try:
+            with open(self._auth_path, "r") as f:
+                credentials = f.read().strip()
+        except FileNotFoundError:
+            return headers
+        headers["Authorization"] = f"Basic {base64.b64encode(credentials.encode()).decode()}"
+        return headers
+
+    def _new_credentials(self) -> dict:
+        user, password = "enc", os.urandom(24).hex()
+        fd = os.open(self._auth_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            f.write(f"{user}:{password}")
+        # --rc-user/--rc-pass through the environment, so they never show up in ps
+        return {"RCLONE_RC_USER": user, "RCLONE_RC_PASS": password}
+
+    def _connection(self, timeout: float = CALL_TIMEOUT):
+        return _UnixHTTPConnection(self.socket_path, timeout)
+
+    def _alive(self) -> bool:
+        try:
+            self._post("rc/noop", {}, start=False, timeout=2)
+            return True
+        except (OSError, RcdError, http.client.HTTPException):
+            return False
+
+    def ensure_started(self):
+        """Start the daemon unless it is already answering on the socket."""
+        if self._alive():
+            return
+        with open(self._lock_path, "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if self._alive():
+                return
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            debug_log(f"RcdClient: Starting rclone rcd on {self.socket_path}")
+            env = dict(self.env, **self._new_credentials())
+            with open(self.log_path, "a") as log:
+                subprocess.Popen(
+                    self.command + ["rcd", "--rc-addr", f"unix://{self.socket_path}", "--rc-serve"],
+                    env=env,
+                    start_new_session=True, # Outlives this process; later calls reuse it
+                    stdout=log,
+                    stderr=log,
+                    stdin=subprocess.DEVNULL
+                )
+            deadline = time.monotonic() + self.START_TIMEOUT
+            while time.monotonic() < deadline:
+                if self._alive():
+                    return
+                time.sleep(0.1)
+        raise RcdError(f"rclone rcd did not start within {self.START_TIMEOUT}s (see {self.log_path})")
+
+    def _post(self, method: str, params: dict, start: bool = True, timeout: float = CALL_TIMEOUT) -> dict:
+        if start:
+            self.ensure_started()
+        conn = self._connection(timeout)
+        try:
+            conn.request("POST", f"/{method}", body=json.dumps(params),
+                         headers=self._headers({"Content-Type": "application/json"}))
+            res = conn.getresponse()
+            body = res.read()
+        finally:
+            conn.close()
+        try:
+            data = json.loads(body) if body else {}
+        except ValueError:
+            raise RcdError(f"{method}: invalid response ({res.status})")
+        if res.status != 200:
+            raise RcdError(data.get("error") or f"{method} failed with HTTP {res.status}")
+        return data
+
+    def call(self, method: str, timeout: float = CALL_TIMEOUT, **params) -> dict:
+        return self._post(method, params, timeout=timeout)
+
+    def run(self, method: str, **params) -> dict:
+        """Submit method as an async job and wait for it, logging transfer progress."""
+        job_id = self._post(method, dict(params, _async=True))["jobid"]
+        last_report = time.monotonic()
+        while True:
+            status = self._post("job/status", {"jobid": job_id})
+            if status.get("finished"):
+                if not status.get("success"):
+                    raise RcdError(status.get("error") or f"{method} failed")
+                return status
+            if time.monotonic() - last_report >= self.PROGRESS_EVERY:
+                last_report = time.monotonic()
+                stats = self._post("core/stats", {"group": f"job/{job_id}"})
+                debug_log(f"RcdClient: {method} job {job_id}: {stats.get('bytes', 0)} bytes, "
+                          f"{round(stats.get('speed', 0) / (1024 * 1024), 2)} MB/s")
+            time.sleep(self.POLL_INTERVAL)
+
+    def upload(self, fs: str, name: str, source: str, offset: int, length: int) -> str:
+        """
+        Stream length bytes of source from offset to fs:name (operations/uploadfile),
+        without a temporary copy. Returns the MD5 of the bytes sent.
+        """
+        self.ensure_started()
+        directory, filename = os.path.dirname(name), os.path.basename(name)
+        boundary = f"enc-{os.urandom(12).hex()}"
+        head = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file0\"; filename=\"{filename}\"\r\n"
+                f"Content-Type: application/octet-stream\r\n\r\n").encode()
+        tail = f"\r\n--{boundary}--\r\n".encode()
+        md5 = hashlib.md5()
+
+        def body():
+            yield head
+            with open(source, "rb") as f:
+                f.seek(offset)
+                remaining = length
+                while remaining > 0:
+                    block = f.read(min(self.UPLOAD_BLOCK, remaining))
+                    if not block:
+                        raise RcdError(f"{source} shrank during upload")
+                    md5.update(block)
+                    remaining -= len(block)
+                    yield block
+            yield tail
+
+        query = urllib.parse.urlencode({"fs": fs, "remote": directory})
+        conn = self._connection(self.UPLOAD_TIMEOUT)
+        try:
+            conn.request("POST", f"/operations/uploadfile?{query}", body=body(), headers=self._headers({
+                "Content-Type": f"multipart/form-data; boundary={boundary}",
+                "Content-Length": str(len(head) + length + len(tail)),
+            }))
+            res = conn.getresponse()
+            data = res.read()
+        finally:
+            conn.close()
+        if res.status != 200:
+            try:
+                error = json.loads(data).get("error")
+            except ValueError:
+                error = None
+            raise RcdError(error or f"Upload of {name} failed with HTTP {res.status}")
+        return md5.hexdigest()
+
+    @contextlib.contextmanager
+    def open_read(self, fs: str, path: str):
+        """A remote file as a response body to read while it downloads (--rc-serve)."""
+        self.ensure_started()
+        conn = self._connection(self.UPLOAD_TIMEOUT)
+        try:
+            conn.request("GET", f"/[{fs}]/{path}", headers=self._headers())
+            res = conn.getresponse()
+            if res.status == 404:
+                raise FileNotFoundError(path)
+            if res.status != 200:
+                raise RcdError(f"Reading {path} failed with HTTP {res.status}")
+            yield res
+        finally:
+            conn.close()
+
+    def read_range(self, fs: str, path: str, size: int) -> bytes:
+        """First size bytes of a remote file, via the daemon's --rc-serve endpoint."""
+        self.ensure_started()
+        conn = self._connection()
+        try:
+            conn.request("GET", f"/[{fs}]/{path}", headers=self._headers({"Range": f"bytes=0-{size - 1}"}))
+            res = conn.getresponse()
+            body = res.read()
+        finally:
+            conn.close()
+        if res.status == 404:
+            raise FileNotFoundError(path)
+        if res.status not in (200, 206):
+            raise RcdError(f"Reading {path} failed with HTTP {res.status}")
+        return body[:size]
@@ -0,0 +1,124 @@
+import os
+import json
+import time
+from argon2 import low_level
+
+# Parameters every vault and backup used before they were configurable.
+# Anything without recorded parameters (ENCBKP01, version 2 headers, vaults
+# without ~/.enc_config/kdf.json) was derived with these.
+LEGACY_PARAMS = {"algorithm": "argon2id", "memory_cost": 65536, "time_cost": 4, "parallelism": 2}
+
+# Host defaults written by `server-kdf-calibrate`, used for new vaults and backups
+HOST_PARAMS_FILE = "/etc/enc/kdf.json"
+# Per-user pin: a vault password must always be derived with the parameters it was created with
+USER_PARAMS_NAME = "kdf.json"
+
+# Floors for calibration and for parameters read from untrusted headers
+MIN_MEMORY_COST = 19456 # 19 MiB
+MIN_TIME_COST = 1
+MAX_MEMORY_COST = 4 * 1024 * 1024 # 4 GiB
+MAX_TIME_COST = 64
+
+
+def normalize(params: dict) -> dict:
+    """Validate KDF parameters (e.g. from a backup header) and return a clean copy."""
+    if not isinstance(params, dict):
+        raise ValueError("Invalid KDF parameters")
+    algorithm = params.get("algorithm", "argon2id")
+    if algorithm != "argon2id":
+        raise ValueError(f"Unsupported KDF algorithm '{algorithm}'")
+    try:
+        clean = {
+            "algorithm": algorithm,
+            "memory_cost": int(params["memory_cost"]),
+            "time_cost": int(params["time_cost"]),
+            "parallelism": int(params["parallelism"]),
+        }
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("Invalid KDF parameters")
+    # Upper bounds stop a crafted header from exhausting memory or CPU before authentication
+    if not (1 <= clean["parallelism"] <= 16
+            and 8 * clean["parallelism"] <= clean["memory_cost"] <= MAX_MEMORY_COST
+            and MIN_TIME_COST <= clean["time_cost"] <= MAX_TIME_COST):
+        raise ValueError(f"KDF parameters out of range: {clean}")
+    return clean
+
+
+def derive(secret: bytes, salt: bytes, params: dict = None, length: int = 32) -> bytes:
+    """Argon2id with the given (or legacy) parameters."""
+    params = normalize(params or LEGACY_PARAMS)
+    return low_level.hash_secret_raw(
+        secret=secret,
+        salt=salt,
+        time_cost=params["time_cost"],
+        memory_cost=params["memory_cost"],
+        parallelism=params["parallelism"],
+        hash_len=length,
+        type=low_level.Type.ID
+    )
+
+
+def load_params(path) -> dict:
+    """Read parameters from a JSON file. Returns None if the file does not exist."""
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return normalize(json.load(f))
+
+
+def save_params(path, params: dict):
+    """Atomically write parameters to a JSON file."""
+    params = normalize(params)
+    os.makedirs(os.path.dirname(str(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(params, f, indent=4)
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, path)
+
+
+def host_params() -> dict:
+    """Calibrated parameters of this host, or the legacy defaults."""
+    try:
+        return load_params(HOST_PARAMS_FILE) or dict(LEGACY_PARAMS)
+    except (OSError, ValueError):
+        return dict(LEGACY_PARAMS)
+
+
+def measure(params: dict) -> float:
+    """Seconds taken by one derivation with params."""
+    start = time.perf_counter()
+    derive(b"enc-kdf-calibration", b"enc-kdf-calibrate", params)
+    return time.perf_counter() - start
+
+
+def calibrate(target_ms: int = 500, max_memory_mib: int = 256, parallelism: int = 2) -> dict:
+    """
+    Pick Argon2id parameters that take about target_ms on this host.
+    Memory is raised first (doubling up to max_memory_mib), then passes, since
+    memory hardness is what makes offline guessing expensive.
+    Returns the parameters plus the measured time in "ms".
+    """
+    target = target_ms / 1000.0
+    max_memory = max(MIN_MEMORY_COST, min(max_memory_mib * 1024, MAX_MEMORY_COST))
+    params = {"algorithm": "argon2id", "memory_cost": MIN_MEMORY_COST, "time_cost": 1, "parallelism": parallelism}
+    elapsed = measure(params)
+
+    while elapsed < target and params["memory_cost"] < max_memory:
+        candidate = dict(params, memory_cost=min(params["memory_cost"] * 2, max_memory))
+        candidate_elapsed = measure(candidate)
+        if candidate_elapsed > target * 1.25:
+            break
+        params, elapsed = candidate, candidate_elapsed
+
+    while elapsed < target and params["time_cost"] < MAX_TIME_COST:
+        # Time scales linearly with passes, so estimate instead of stepping one at a time
+        per_pass = elapsed / params["time_cost"]
+        passes = min(MAX_TIME_COST, max(params["time_cost"] + 1, int(target / per_pass)))
+        candidate = dict(params, time_cost=passes)
+        candidate_elapsed = measure(candidate)
+        if candidate_elapsed > target * 1.25:
+            break
+        params, elapsed = candidate, candidate_elapsed
+
+    return dict(normalize(params), ms=round(elapsed * 1000))
@@ -0,0 +1,159 @@
+"""
+Background half of an asynchronous logout (`server-logout --background`).
+
+The logout unmounts the vault, renames .enc_cipher to .enc_cipher.logout and
+starts this worker, which packs and pushes the snapshot exactly as a blocking
+logout would and records its progress for server-status. The derived vault
+token arrives on stdin and is never written to disk.
+
+    python -m enc_server.logout_jobs --user alice     # started by the logout
+"""
+import os
+import sys
+import json
+import uuid
+import fcntl
+import datetime
+import subprocess
+import click
+from .debug import debug_log
+
+JOB_NAME = "logout_job.json"
+LOCK_NAME = "logout_job.lock"
+
+
+def _now() -> str:
+    return datetime.datetime.now().isoformat(timespec="seconds")
+
+
+class LogoutJob:
+    """
+    The user's latest asynchronous logout, in the user's config dir:
+
+        {"id", "state": running|success|failed, "phase": queued|packing|pushing,
+         "error", "result", "started_at", "updated_at"}
+
+    The worker holds a flock on logout_job.lock for as long as it runs. The logout
+    takes that lock before spawning it and hands the descriptor down, so a login
+    never sees a job that was started but is not yet running.
+    """
+
+    def __init__(self, config_dir):
+        self.path = os.path.join(str(config_dir), JOB_NAME)
+        self.lock_path = os.path.join(str(config_dir), LOCK_NAME)
+
+    def read(self) -> dict:
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            debug_log(f"LogoutJob: unreadable job {self.path}: {e}")
+            return {}
+
+    def _write(self, data: dict):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=2)
+        os.chmod(tmp_path, 0o600)
+        os.replace(tmp_path, self.path)
+
+    def update(self, **fields) -> dict:
+        # Only the worker writes once it runs; no lock needed beyond the one it holds
+        data = self.read()
+        data.update(fields, updated_at=_now())
+        self._write(data)
+        return data
+
+    def running(self) -> bool:
+        try:
+            fd = os.open(self.lock_path, os.O_RDONLY)
+        except OSError:
+            return False
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            return False
+        except BlockingIOError:
+            return True
+        finally:
+            os.close(fd)
+
+    def wait(self):
+        """Block until no worker holds the job lock."""
+        try:
+            fd = os.open(self.lock_path, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH)
+        finally:
+            os.close(fd)
+
+    def status(self) -> dict:
+        """The job as server-status reports it; a worker that died mid-way shows as failed."""
+        job = self.read()
+        if job.get("state") == "running" and not self.running():
+            job.update(state="failed", error=job.get("error") or "logout worker exited unexpectedly")
+        return job
+
+    def spawn(self, username: str, secret: dict) -> str:
+        """Start the worker for username, handing it secret on stdin. Returns the job ID."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            job_id = uuid.uuid4().hex[:12]
+            self._write({"id": job_id, "state": "running", "phase": "queued", "error": None,
+                         "result": None, "started_at": _now(), "updated_at": _now()})
+            try:
+                proc = subprocess.Popen(
+                    [sys.executable, "-m", "enc_server.logout_jobs", "--user", username],
+                    pass_fds=(fd,), # Inherited: the lock lives exactly as long as the worker
+                    start_new_session=True,
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL
+                )
+                proc.stdin.write(json.dumps(secret).encode())
+                proc.stdin.close()
+            except Exception as e:
+                self.update(state="failed", error=f"Could not start logout worker: {e}")
+                raise
+            return job_id
+        finally:
+            os.close(fd)
+
+
+def run(username: str, secret: dict) -> bool:
+    """Back up the snapshot an asynchronous logout set aside; True once it is done."""
+    from .backup_manager import BackupManager
+
+    bm = BackupManager(username)
+    bm.job = LogoutJob(bm.config_dir)
+    # A snapshot the backup does not clean up stays where it is; the next login mounts it
+    bm.enc_cipher = bm.logout_snapshot
+    results = {key: "skipped" for key in bm.handlers}
+    try:
+        if not secret.get("token"):
+            raise ValueError("No vault token handed to the logout worker")
+        res = bm._backup_cipher(secret["token"], secret.get("aliases") or {}, results)
+    except Exception as e:
+        res = {"status": "error", "message": str(e), "backups": results}
+    ok = res.get("status") == "success"
+    bm.job.update(state="success" if ok else "failed", phase=None,
+                  error=None if ok else res.get("message"), result=res)
+    debug_log(f"LogoutJob: background backup for {username} {'finished' if ok else 'failed'}.")
+    return ok
+
+
+@click.command()
+@click.option("--user", "username", required=True, help="User whose logout is being backed up")
+def main(username):
+    """Pack and push the vault set aside by an asynchronous logout (token on stdin)."""
+    secret = json.loads(sys.stdin.read() or "{}")
+    sys.exit(0 if run(username, secret) else 1)
+
+
+if __name__ == "__main__":
+    main()
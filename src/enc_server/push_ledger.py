@@ -0,0 +1,80 @@
+import os
+import json
+import fcntl
+from .debug import debug_log
+
+
+class PushLedger:
+    """
+    What each handler holds of the full-mode backup, as pushed from this account:
+
+        {"chain": {"tree": digest, "objects": {name: sha256}},
+         "handlers": {handler: {"tree": digest or None, "objects": {name: sha256}}}}
+
+    `chain` is the newest backup state: the full backup plus the deltas on top of
+    it, and the TreeManifest digest they restore to. A handler whose tree matches
+    needs nothing; otherwise only the objects it lacks are sent. The file lives in
+    the user's config dir and is written by logouts and the sync daemon alike.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+
+    def _locked(self):
+        fd = os.open(f"{self.path}.lock", os.O_RDONLY | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        return os.fdopen(fd, "r")
+
+    def read(self) -> dict:
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            debug_log(f"PushLedger: unreadable ledger {self.path}: {e}")
+            return {}
+
+    def _write(self, data: dict):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=2)
+        os.chmod(tmp_path, 0o600)
+        os.replace(tmp_path, self.path)
+
+    def chain(self) -> dict:
+        return self.read().get("chain") or {"tree": None, "objects": {}}
+
+    def set_chain(self, chain: dict):
+        with self._locked():
+            data = self.read()
+            data["chain"] = chain
+            self._write(data)
+
+    def entry(self, key: str) -> dict:
+        return self.read().get("handlers", {}).get(key) or {"tree": None, "objects": {}}
+
+    def holds(self, key: str, name: str, sha256: str) -> bool:
+        return self.entry(key)["objects"].get(name) == sha256
+
+    def current(self, key: str, tree: str) -> bool:
+        return tree is not None and self.entry(key)["tree"] == tree
+
+    def record(self, key: str, name: str, sha256: str, chain: dict) -> dict:
+        """Note that key now holds name; objects of other chains are forgotten (they get pruned)."""
+        with self._locked():
+            data = self.read()
+            entry = data.setdefault("handlers", {}).get(key) or {"tree": None, "objects": {}}
+            objects = dict(entry["objects"], **{name: sha256})
+            objects = {n: s for n, s in objects.items() if chain["objects"].get(n) == s}
+            entry = {"tree": chain["tree"] if objects == chain["objects"] else None, "objects": objects}
+            data["handlers"][key] = entry
+            self._write(data)
+            return entry
+
+    def forget(self, key: str):
+        """Drop what key is known to hold, e.g. after it failed verification."""
+        with self._locked():
+            data = self.read()
+            if data.get("handlers", {}).pop(key, None) is not None:
+                self._write(data)
@@ -0,0 +1,81 @@
+import time
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .debug import debug_log
+
+
+class PushScheduler:
+    """
+    Push one artifact to any number of handlers concurrently, with per-handler
+    retries and progress. A slow or failing handler never holds up the others.
+    Progress entries: state (queued|running|retrying|success|failed), attempts,
+    bytes, seconds, mb_per_s, error, updated_at.
+    """
+    MAX_WORKERS = 8
+    # Errors that retrying cannot fix
+    FATAL_ERRORS = {"storageQuotaExceeded": "Quota Exceeded"}
+
+    def __init__(self, on_update=None, max_workers: int = MAX_WORKERS):
+        # on_update(handler_name, progress_entry) is called on every state change
+        self.on_update = on_update
+        self.max_workers = max_workers
+        self.progress = {}
+        self._lock = threading.Lock()
+
+    def _set(self, name: str, **fields):
+        with self._lock:
+            entry = self.progress[name]
+            entry.update(fields, updated_at=datetime.datetime.now().isoformat(timespec="seconds"))
+            snapshot = dict(entry)
+        if self.on_update:
+            try:
+                self.on_update(name, snapshot)
+            except Exception as e:
+                debug_log(f"PushScheduler: progress callback failed for {name}: {e}")
+
+    def run(self, jobs: dict, size: int = None, retries: int = 0, delay: float = 5, max_delay: float = 300) -> dict:
+        """
+        Run jobs (handler name -> callable returning True on success) in parallel and
+        block until all are done. Returns the final progress per handler.
+        """
+        if not jobs:
+            return {}
+        for name in jobs:
+            self.progress[name] = {"state": "queued", "attempts": 0, "bytes": size}
+            self._set(name)
+        with ThreadPoolExecutor(max_workers=min(len(jobs), self.max_workers)) as executor:
+            futures = [executor.submit(self._run_one, name, push, retries, delay, max_delay)
+                       for name, push in jobs.items()]
+            for future in futures:
+                future.result()
+        return {name: dict(entry) for name, entry in self.progress.items()}
+
+    def _run_one(self, name: str, push, retries: int, delay: float, max_delay: float):
+        started = time.monotonic()
+        error = None
+        for attempt in range(retries + 1):
+            self._set(name, state="running", attempts=attempt + 1)
+            try:
+                if push():
+                    elapsed = time.monotonic() - started
+                    size = self.progress[name]["bytes"]
+                    self._set(name, state="success", error=None, seconds=round(elapsed, 3),
+                              mb_per_s=round(size / (1024 * 1024) / elapsed, 2) if size and elapsed > 0 else None)
+                    debug_log(f"PushScheduler: {name} push successful.")
+                    return
+                error = "push failed"
+            except Exception as e:
+                error = str(e)
+                fatal = next((label for marker, label in self.FATAL_ERRORS.items() if marker in error), None)
+                if fatal:
+                    debug_log(f"PushScheduler: {name} failed permanently: {error}")
+                    self._set(name, state="failed", error=fatal, seconds=round(time.monotonic() - started, 3))
+                    return
+            if attempt < retries:
+                debug_log(f"PushScheduler: {name} push failed ({error}). Retrying in {delay}s...")
+                self._set(name, state="retrying", error=error, retry_in=delay)
+                time.sleep(delay)
+                delay = min(delay * 2, max_delay)
+        debug_log(f"PushScheduler: {name} push failed after {retries + 1} attempts.")
+        self._set(name, state="failed", error=error, seconds=round(time.monotonic() - started, 3))
@@ -0,0 +1,50 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from .debug import debug_log
+
+
+class RestorePlanner:
+    """
+    Ask every handler at once which backup it holds, using only cheap metadata
+    (a header read, a listing), and rank the copies: newest generation first, and
+    among equally new copies the one that answered fastest. Handlers that have not
+    answered by the deadline are left out, so a slow remote cannot hold up a login
+    that a local copy can serve.
+    """
+    MAX_WORKERS = 8
+    TIMEOUT = 10 # seconds to wait for all handlers to answer
+
+    def __init__(self, survey, max_workers: int = MAX_WORKERS, timeout: float = TIMEOUT):
+        # survey(handler_name) -> comparable generation (e.g. (base, seq)); raises if there is no usable copy
+        self.survey = survey
+        self.max_workers = max_workers
+        self.timeout = timeout
+
+    def _timed(self, key):
+        started = time.monotonic()
+        generation = self.survey(key)
+        return {"handler": key, "generation": generation, "seconds": round(time.monotonic() - started, 3)}
+
+    def plan(self, keys) -> list:
+        """Candidates ({handler, generation, seconds}), best first."""
+        keys = list(keys)
+        if not keys:
+            return []
+        executor = ThreadPoolExecutor(max_workers=min(len(keys), self.max_workers))
+        futures = {executor.submit(self._timed, key): key for key in keys}
+        try:
+            done, pending = wait(futures, timeout=self.timeout)
+            for future in pending:
+                debug_log(f"RestorePlanner: '{futures[future]}' did not answer within {self.timeout}s, skipping.")
+            candidates = []
+            for future in done:
+                try:
+                    candidates.append(future.result())
+                except Exception as e:
+                    debug_log(f"RestorePlanner: no usable backup on '{futures[future]}': {e}")
+        finally:
+            # Do not wait for stragglers; their threads finish on their own
+            executor.shutdown(wait=False)
+        candidates.sort(key=lambda c: c["seconds"])
+        candidates.sort(key=lambda c: c["generation"], reverse=True)
+        return candidates
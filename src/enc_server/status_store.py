@@ -0,0 +1,111 @@
+import os
+import pwd
+import stat
+import json
+import fcntl
+from .debug import debug_log
+
+STATUS_DIR = "/app/backups/status"
+# Single file every user shared before status was sharded; still read as a fallback
+LEGACY_STATUS_FILE = "/app/backups/status.json"
+
+
+class StatusStore:
+    """
+    Backup status per user, one JSON shard each: {handler: {available, status, ...}}.
+    An update locks only that user's shard, merges the changed fields and atomically
+    replaces the file, so concurrent writers (login, logout, push threads, the sync
+    daemon) never lose each other's changes and cost does not grow with the user count.
+
+    Each user's shard and its lock live in <root>/<user>/, a 0700 directory owned by
+    that user, so no other user can rewrite the shard or hold its lock. A directory or
+    shard owned by anyone else is ignored.
+    """
+
+    def __init__(self, root: str = STATUS_DIR, legacy_file: str = LEGACY_STATUS_FILE):
+        self.root = root
+        self.legacy_file = legacy_file
+
+    def _user_dir(self, username: str) -> str:
+        return os.path.join(self.root, username)
+
+    def _path(self, username: str) -> str:
+        return os.path.join(self._user_dir(username), "status.json")
+
+    @staticmethod
+    def _owner_uid(username: str) -> int:
+        try:
+            return pwd.getpwnam(username).pw_uid
+        except KeyError:
+            # No such account: only root can have written it
+            return 0
+
+    def _owned_by(self, st: os.stat_result, username: str) -> bool:
+        return st.st_uid == self._owner_uid(username)
+
+    def _user_dir_ok(self, username: str) -> bool:
+        try:
+            st = os.lstat(self._user_dir(username))
+        except OSError:
+            return False
+        return stat.S_ISDIR(st.st_mode) and self._owned_by(st, username)
+
+    def _locked(self, username: str):
+        path = self._user_dir(username)
+        if not os.path.isdir(path):
+            os.makedirs(self.root, exist_ok=True)
+            try:
+                os.mkdir(path, 0o700)
+                if os.geteuid() == 0:
+                    os.chown(path, self._owner_uid(username), -1)
+            except FileExistsError:
+                pass
+        if not self._user_dir_ok(username):
+            raise PermissionError(f"Status directory {path} is not owned by {username}")
+        fd = os.open(os.path.join(path, ".lock"), os.O_RDONLY | os.O_CREAT | os.O_NOFOLLOW, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        return os.fdopen(fd, "r")
+
+    def _legacy(self, username: str) -> dict:
+        try:
+            with open(self.legacy_file, "r") as f:
+                content = f.read().strip()
+            return json.loads(content).get(username, {}) if content else {}
+        except (OSError, ValueError, AttributeError):
+            return {}
+
+    def read(self, username: str) -> dict:
+        """Status of every handler of username. Lock-free: shards are only ever replaced whole."""
+        if os.path.lexists(self._user_dir(username)) and not self._user_dir_ok(username):
+            debug_log(f"StatusStore: ignoring status directory of {username} not owned by them.")
+            return {}
+        try:
+            with open(self._path(username), "r") as f:
+                if not self._owned_by(os.fstat(f.fileno()), username):
+                    debug_log(f"StatusStore: ignoring status for {username} not owned by them.")
+                    return {}
+                return json.load(f)
+        except FileNotFoundError:
+            return self._legacy(username)
+        except (OSError, ValueError) as e:
+            debug_log(f"StatusStore: unreadable status for {username}: {e}")
+            return {}
+
+    def update(self, username: str, handler: str, **fields) -> dict:
+        """Merge fields into one handler's entry. Fields set to None are left unchanged."""
+        with self._locked(username):
+            data = self.read(username)
+            entry = data.get(handler, {"available": False, "status": "None"})
+            entry.update({k: v for k, v in fields.items() if v is not None})
+            data[handler] = entry
+
+            path = self._path(username)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(data, f, indent=2)
+            os.chmod(tmp_path, 0o644)
+            if os.geteuid() == 0:
+                # Keep shards owned by their user, who replaces them on every update
+                os.chown(tmp_path, self._owner_uid(username), -1)
+            os.replace(tmp_path, path)
+            return entry
@@ -0,0 +1,412 @@
+"""
+Background sync daemon.
+
+Logouts enqueue pushes for background (remote) handlers as job files in
+/app/backups/queue instead of forking a process each. One long-lived daemon
+works through the queue with a small worker pool, so retries survive a
+container restart and several logouts of one user collapse into one push.
+
+    python -m enc_server.sync_daemon            # started by entrypoint.sh (root)
+    python -m enc_server.sync_daemon --once     # drain due jobs and exit
+"""
+import os
+import re
+import sys
+import json
+import time
+import pwd
+import stat
+import fcntl
+import getpass
+import datetime
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import click
+from .debug import debug_log
+
+QUEUE_DIR = "/app/backups/queue"
+
+
+def _now() -> str:
+    return datetime.datetime.now().isoformat(timespec="seconds")
+
+
+class SyncQueue:
+    """
+    On-disk queue: one JSON job per (user, handler) holding the artifacts still to push.
+    A full backup or a chunk store mirror replaces whatever was pending for that
+    handler, deltas are appended, so the remote always ends up with a complete chain.
+
+    Jobs live in <root>/<user>/, a directory owned by that user inside the sticky,
+    group-writable root, next to the lock that guards them (0600, so no one else can
+    hold it). A job is only loaded if its directory and file are owned by the user it
+    names, so one user cannot queue pushes (or prunes) for another.
+    """
+    MAX_ATTEMPTS = 10
+    RETRY_DELAY = 5 # seconds, doubled per attempt
+    MAX_RETRY_DELAY = 300
+
+    def __init__(self, root: str = QUEUE_DIR):
+        self.root = root
+
+    @staticmethod
+    def job_id(username: str, handler: str) -> str:
+        # Handler names come from user config; keep them usable as file names
+        return f"{username}.{re.sub(r'[^A-Za-z0-9_-]', '_', handler)}"
+
+    @staticmethod
+    def job_user(job_id: str) -> str:
+        # Sanitized handler names never contain a dot
+        return job_id.rsplit(".", 1)[0]
+
+    def _user_dir(self, username: str) -> str:
+        return os.path.join(self.root, username)
+
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self._user_dir(self.job_user(job_id)), f"{job_id}.json")
+
+    def _owned_by(self, path: str, username: str, directory: bool = False) -> bool:
+        try:
+            st = os.lstat(path)
+            uid = pwd.getpwnam(username).pw_uid
+        except (OSError, KeyError):
+            return False
+        kind = stat.S_ISDIR if directory else stat.S_ISREG
+        return kind(st.st_mode) and st.st_uid == uid
+
+    def _ensure_user_dir(self, username: str) -> str:
+        path = self._user_dir(username)
+        if not os.path.isdir(path):
+            os.makedirs(self.root, exist_ok=True)
+            try:
+                os.mkdir(path, 0o755)
+                if os.geteuid() == 0:
+                    os.chown(path, pwd.getpwnam(username).pw_uid, -1)
+            except FileExistsError:
+                pass
+        if not self._owned_by(path, username, directory=True):
+            raise PermissionError(f"Sync queue directory {path} is not owned by {username}")
+        return path
+
+    def _locked(self, username: str):
+        """Exclusive lock around every read-modify-write of username's job files."""
+        path = os.path.join(self._ensure_user_dir(username), ".lock")
+        fd = os.open(path, os.O_RDONLY | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+        if os.geteuid() == 0:
+            # The root daemon may create it; the user has to be able to open it too
+            os.fchown(fd, pwd.getpwnam(username).pw_uid, -1)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        return os.fdopen(fd, "r")
+
+    def load(self, job_id: str) -> dict:
+        """The job, or None if it is missing, unreadable or not owned by the user it names."""
+        user = self.job_user(job_id)
+        path = self._path(job_id)
+        if not os.path.exists(path):
+            return None
+        if not (self._owned_by(self._user_dir(user), user, directory=True) and self._owned_by(path, user)):
+            debug_log(f"SyncQueue: ignoring {path}: not owned by {user}.")
+            return None
+        try:
+            with open(path, "r") as f:
+                job = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(job, dict) or job.get("id") != job_id or job.get("user") != user:
+            debug_log(f"SyncQueue: ignoring {path}: names another job or user.")
+            return None
+        return job
+
+    def _save(self, job: dict):
+        self._ensure_user_dir(job["user"])
+        path = self._path(job["id"])
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(job, f, indent=2)
+        os.chmod(tmp_path, 0o640)
+        if os.geteuid() == 0:
+            # Keep jobs owned by their user, or load() no longer trusts them
+            os.chown(tmp_path, pwd.getpwnam(job["user"]).pw_uid, -1)
+        os.replace(tmp_path, path)
+
+    def enqueue(self, username: str, handler: str, source: str, name: str,
+                base: int = None, replace: bool = True, chain: dict = None) -> dict:
+        """Add an artifact to the (user, handler) job. Returns the job."""
+        item = {"source": source, "name": name, "base": base}
+        if chain:
+            # Backup state the artifact belongs to, for the push ledger
+            item["chain"] = chain
+        job_id = self.job_id(username, handler)
+        with self._locked(username):
+            job = self.load(job_id)
+            if job is None or replace:
+                items = [item]
+            else:
+                items = [i for i in job["items"] if i["name"] != name] + [item]
+            job = {
+                "id": job_id,
+                "user": username,
+                "handler": handler,
+                "items": items,
+                "state": "queued",
+                "attempts": 0,
+                "next_try": 0,
+                "error": None,
+                "created_at": job["created_at"] if job else _now(),
+                "updated_at": _now(),
+            }
+            self._save(job)
+        return job
+
+    def jobs(self, username: str = None) -> list:
+        try:
+            users = [username] if username else sorted(os.listdir(self.root))
+        except OSError:
+            return []
+        jobs = []
+        for user in users:
+            try:
+                names = sorted(os.listdir(self._user_dir(user)))
+            except OSError:
+                continue
+            for name in names:
+                if name.endswith(".json") and name.startswith(f"{user}."):
+                    job = self.load(name[:-len(".json")])
+                    if job:
+                        jobs.append(job)
+        return jobs
+
+    def due(self, username: str = None) -> list:
+        """Jobs ready to run now, oldest first."""
+        now = time.time()
+        jobs = [j for j in self.jobs(username) if j["state"] in ("queued", "retrying", "running")
+                and j["next_try"] <= now]
+        return sorted(jobs, key=lambda j: j["updated_at"])
+
+    def pending(self, username: str = None) -> list:
+        return [j for j in self.jobs(username) if j["state"] != "failed"]
+
+    def mark_running(self, job_id: str) -> dict:
+        with self._locked(self.job_user(job_id)):
+            job = self.load(job_id)
+            if job is None:
+                return None
+            job.update(state="running", attempts=job["attempts"] + 1, updated_at=_now())
+            self._save(job)
+            return job
+
+    def done_item(self, job_id: str, item: dict):
+        """Drop a pushed artifact; the job is removed once nothing is left."""
+        with self._locked(self.job_user(job_id)):
+            job = self.load(job_id)
+            if job is None:
+                return
+            job["items"] = [i for i in job["items"] if i != item]
+            if job["items"]:
+                job["updated_at"] = _now()
+                self._save(job)
+            else:
+                os.remove(self._path(job_id))
+
+    def failed(self, job_id: str, error: str, fatal: bool = False) -> dict:
+        """Record a failed attempt and schedule the next one with exponential backoff."""
+        with self._locked(self.job_user(job_id)):
+            job = self.load(job_id)
+            if job is None:
+                return None
+            if fatal or job["attempts"] >= self.MAX_ATTEMPTS:
+                job.update(state="failed", next_try=0)
+            else:
+                delay = min(self.RETRY_DELAY * 2 ** max(job["attempts"] - 1, 0), self.MAX_RETRY_DELAY)
+                job.update(state="retrying", next_try=time.time() + delay, retry_in=delay)
+            job.update(error=error, updated_at=_now())
+            self._save(job)
+            return job
+
+
+def run_job(job_id: str, queue: SyncQueue = None) -> bool:
+    """One attempt at a job: push its artifacts in order, dropping each once it landed."""
+    from .backup_manager import BackupManager
+    from .push_scheduler import PushScheduler
+
+    queue = queue or SyncQueue()
+    job = queue.mark_running(job_id)
+    if job is None:
+        return True
+    key = job["handler"]
+    # Handlers were verified by the logout that queued the job
+    bm = BackupManager(job["user"], verify_handlers=False)
+    if key not in bm.handlers:
+        queue.failed(job_id, f"Handler '{key}' is no longer configured", fatal=True)
+        return False
+
+    for item in job["items"]:
+        if not os.path.exists(item["source"]):
+            # Superseded and pruned locally (e.g. the deltas of a rebased chain)
+            debug_log(f"SyncDaemon: {job_id}: {item['source']} is gone, skipping.")
+            queue.done_item(job_id, item)
+            continue
+        sha256 = (item.get("chain") or {}).get("objects", {}).get(item["name"])
+        if sha256 and os.path.isfile(item["source"]) and bm._file_sha256(item["source"]) != sha256:
+            # Never push other bytes under this name; the ledger keeps the handler behind instead
+            debug_log(f"SyncDaemon: {job_id}: {item['source']} no longer holds {item['name']}, skipping.")
+            queue.done_item(job_id, item)
+            continue
+        entry = bm._push_artifact([key], item["source"], item["name"], item["base"],
+                                   chain=item.get("chain"))[key]
+        if entry["state"] != "success":
+            fatal = entry.get("error") in PushScheduler.FATAL_ERRORS.values()
+            job = queue.failed(job_id, entry.get("error"), fatal=fatal)
+            if job and job["state"] == "retrying":
+                bm._update_status(key, status="syncing")
+            debug_log(f"SyncDaemon: {job_id} attempt {job['attempts'] if job else '?'} failed: {entry.get('error')}")
+            return False
+        queue.done_item(job_id, item)
+        bm._release_outgoing(item["source"], queue)
+    debug_log(f"SyncDaemon: {job_id} synced.")
+    return True
+
+
+class SyncDaemon:
+    """
+    Works through the queue with a thread pool. Run as root it serves every user,
+    running each job as its user; otherwise only the caller's jobs, and it exits once
+    they are done. A flock on <user>/daemon.pid keeps one daemon per user; the root
+    daemon locks a private .daemon.root.lock and advertises its pid in daemon.root.pid.
+    Both lock files are 0600, so no other user can hold them.
+    """
+    WORKERS = 4
+    POLL_INTERVAL = 2 # seconds
+    ROOT_PID_NAME = "daemon.root.pid"
+
+    def __init__(self, queue: SyncQueue = None, workers: int = WORKERS):
+        self.queue = queue or SyncQueue()
+        self.workers = workers
+        self.owner = getpass.getuser()
+        self.serves_all = os.geteuid() == 0
+        self._running = set()
+        self._pid_file = None
+
+    @staticmethod
+    def pid_path(owner: str, root: str = QUEUE_DIR) -> str:
+        if owner == "root":
+            return os.path.join(root, ".daemon.root.lock")
+        return os.path.join(root, owner, "daemon.pid")
+
+    @staticmethod
+    def _root_pid_alive(root: str) -> bool:
+        path = os.path.join(root, SyncDaemon.ROOT_PID_NAME)
+        try:
+            if os.lstat(path).st_uid != 0:
+                return False
+            with open(path, "r") as f:
+                os.kill(int(f.read().strip()), 0)
+        except PermissionError:
+            return True # Alive, just not ours to signal
+        except (OSError, ValueError):
+            return False
+        return True
+
+    @staticmethod
+    def is_running(owner: str, root: str = QUEUE_DIR) -> bool:
+        try:
+            fd = os.open(SyncDaemon.pid_path(owner, root), os.O_RDONLY)
+        except PermissionError:
+            # Only root may open the root daemon's lock; others go by the pid it advertises
+            return owner == "root" and SyncDaemon._root_pid_alive(root)
+        except OSError:
+            return False
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            return False
+        except BlockingIOError:
+            return True
+        finally:
+            os.close(fd)
+
+    @classmethod
+    def ensure_running(cls, username: str, root: str = QUEUE_DIR):
+        """Start a daemon for username unless one (or the root daemon) already serves the queue."""
+        if cls.is_running("root", root) or cls.is_running(username, root):
+            return
+        cmd = [sys.executable, "-m", "enc_server.sync_daemon"]
+        subprocess.Popen(
+            cmd,
+            start_new_session=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            stdin=subprocess.DEVNULL
+        )
+
+    def _acquire(self) -> bool:
+        if self.owner == "root":
+            os.makedirs(self.queue.root, exist_ok=True)
+        else:
+            self.queue._ensure_user_dir(self.owner)
+        fd = os.open(self.pid_path(self.owner, self.queue.root), os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, f"{os.getpid()}\n".encode())
+        self._pid_file = fd
+        if self.owner == "root":
+            path = os.path.join(self.queue.root, self.ROOT_PID_NAME)
+            with open(f"{path}.tmp", "w") as f:
+                f.write(f"{os.getpid()}\n")
+            os.chmod(f"{path}.tmp", 0o644)
+            os.replace(f"{path}.tmp", path)
+        return True
+
+    def _execute(self, job: dict):
+        try:
+            if self.serves_all and job["user"] != self.owner:
+                # job came from load(), so its file is owned by job["user"]. Push with the user's own credentials and file ownership
+                subprocess.run([sys.executable, "-m", "enc_server.sync_daemon", "--job", job["id"]],
+                               user=job["user"], env=dict(os.environ, HOME=f"/home/{job['user']}"))
+            else:
+                run_job(job["id"], self.queue)
+        except Exception as e:
+            debug_log(f"SyncDaemon: {job['id']} crashed: {e}")
+        finally:
+            # An attempt that died without recording its outcome still counts
+            current = self.queue.load(job["id"])
+            if current and current["state"] == "running":
+                self.queue.failed(job["id"], current.get("error") or "sync process exited unexpectedly")
+            self._running.discard(job["id"])
+
+    def run(self, once: bool = False):
+        if not self._acquire():
+            debug_log(f"SyncDaemon: already running for {self.owner}.")
+            return
+        user = None if self.serves_all else self.owner
+        debug_log(f"SyncDaemon: serving {'all users' if user is None else user} from {self.queue.root}")
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while True:
+                for job in self.queue.due(user):
+                    if job["id"] not in self._running:
+                        self._running.add(job["id"])
+                        executor.submit(self._execute, job)
+                idle = not self._running
+                if idle and (once or (user is not None and not self.queue.pending(user))):
+                    break
+                time.sleep(self.POLL_INTERVAL)
+        os.close(self._pid_file)
+        debug_log("SyncDaemon: queue drained, exiting.")
+
+
+@click.command()
+@click.option("--once", is_flag=True, help="Exit once no job is due")
+@click.option("--workers", default=SyncDaemon.WORKERS, show_default=True, help="Jobs pushed in parallel")
+@click.option("--job", "job_id", default=None, hidden=True)
+def main(once, workers, job_id):
+    """Push queued backups to background handlers."""
+    if job_id:
+        sys.exit(0 if run_job(job_id) else 1)
+    SyncDaemon(workers=workers).run(once=once)
+
+
+if __name__ == "__main__":
+    main()
@@ -72,6 +72,8 @@ class UserManager:
                 user_data["backup"] = backup_config
             if config.get("url"):
                 user_data["url"] = config.get("url")
+            if config.get("checkpoint") is not None:
+                user_data["checkpoint"] = config.get("checkpoint")
 
             with open(user_config_path, 'w') as f:
                 yaml.dump(user_data, f)
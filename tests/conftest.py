@@ -0,0 +1,90 @@
+import os
+import sys
+import getpass
+import functools
+import subprocess
+import yaml
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src"))
+
+from enc_server import kdf  # noqa: E402
+from enc_server import backup_manager as backup_manager_module  # noqa: E402
+from enc_server.backup_manager import BackupManager  # noqa: E402
+from enc_server.status_store import StatusStore  # noqa: E402
+from enc_server.sync_daemon import SyncQueue, SyncDaemon  # noqa: E402
+from enc_server.handler_health import HealthCache  # noqa: E402
+
+# Queue and status ownership checks resolve the user, so tests run as whoever runs them
+USER = getpass.getuser()
+PASSWORD = "correct horse"
+FAST_KDF = {"algorithm": "argon2id", "memory_cost": 1024, "time_cost": 1, "parallelism": 1}
+
+_real_run = subprocess.run
+
+
+class Vault:
+    """One user's home under a temp dir, with gocryptfs and fusermount stubbed out."""
+
+    def __init__(self, root):
+        self.root = root
+        self.home = root / "home" / USER
+        self.cipher = self.home / BackupManager.CIPHER_DIR_NAME
+        self.snapshot = self.home / BackupManager.LOGOUT_SNAPSHOT_NAME
+        self.config_dir = self.home / ".enc_config"
+        self.queue_dir = root / "queue"
+        self.mounts = []
+        self._token = None
+        self.config_dir.mkdir(parents=True)
+
+    @property
+    def token(self):
+        if self._token is None:
+            self._token = BackupManager(USER, verify_handlers=False)._derive_system_password(PASSWORD)
+        return self._token
+
+    def configure(self, backup: dict, **sections):
+        with open(self.config_dir / "user.yml", "w") as f:
+            yaml.safe_dump(dict(sections, backup=backup), f)
+
+    def manager(self, **kwargs) -> BackupManager:
+        return BackupManager(USER, **kwargs)
+
+    def write(self, files: dict):
+        for rel, data in files.items():
+            path = self.cipher / rel
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(data)
+
+    def tree(self, root=None) -> dict:
+        root = root or self.cipher
+        return {str(p.relative_to(root)): p.read_bytes() for p in sorted(root.rglob("*")) if p.is_file()}
+
+    def run(self, cmd, *args, **kwargs):
+        if cmd[0] == "fusermount":
+            return subprocess.CompletedProcess(cmd, 0)
+        if cmd[0] == "gocryptfs":
+            if "-init" in cmd:
+                return subprocess.CompletedProcess(cmd, 0)
+            given = kwargs.get("input")
+            if isinstance(given, bytes):
+                given = given.decode()
+            if given != self.token:
+                raise subprocess.CalledProcessError(12, cmd, "", "Password incorrect.")
+            self.mounts.append(cmd[-1])
+            return subprocess.CompletedProcess(cmd, 0)
+        return _real_run(cmd, *args, **kwargs)
+
+
+@pytest.fixture
+def vault(tmp_path, monkeypatch):
+    monkeypatch.setattr(BackupManager, "HOME_ROOT", str(tmp_path / "home"))
+    monkeypatch.setattr(kdf, "LEGACY_PARAMS", dict(FAST_KDF))
+    monkeypatch.setattr(backup_manager_module, "StatusStore",
+                        functools.partial(StatusStore, str(tmp_path / "status"), str(tmp_path / "status.json")))
+    monkeypatch.setattr(backup_manager_module, "SyncQueue", functools.partial(SyncQueue, str(tmp_path / "queue")))
+    monkeypatch.setattr(SyncDaemon, "ensure_running", classmethod(lambda cls, username, root=None: None))
+    monkeypatch.setattr(HealthCache, "refresh_async", lambda self, keys: None)
+    v = Vault(tmp_path)
+    monkeypatch.setattr(subprocess, "run", v.run)
+    return v
@@ -0,0 +1,134 @@
+import os
+import pytest
+
+from conftest import FAST_KDF
+from enc_server.backup_packer import BackupPacker
+
+TOKEN = "ab" * 32
+CHUNK = 64 * 1024
+
+
+@pytest.fixture
+def packer(monkeypatch):
+    # Small chunks so a few hundred KiB span many records
+    monkeypatch.setattr(BackupPacker, "CHUNK_SIZE", CHUNK)
+    return BackupPacker(codec="store", workers=2, kdf_params=FAST_KDF)
+
+
+@pytest.fixture
+def source(tmp_path):
+    root = tmp_path / ".enc_cipher"
+    (root / "a" / "b").mkdir(parents=True)
+    (root / "gocryptfs.conf").write_bytes(b"conf")
+    (root / "a" / "big").write_bytes(os.urandom(5 * CHUNK + 123))
+    (root / "a" / "b" / "text").write_bytes(b"hello " * 20000)
+    (root / "empty").write_bytes(b"")
+    return root
+
+
+def _tree(root) -> dict:
+    return {str(p.relative_to(root)): p.read_bytes() for p in sorted(root.rglob("*")) if p.is_file()}
+
+
+def _pack(packer, source, tmp_path, password=TOKEN) -> str:
+    out = str(tmp_path / "backup.enc")
+    packer.pack(str(source), out, password)
+    return out
+
+
+@pytest.mark.parametrize("codec", ["store", "gzip", "auto"])
+def test_round_trip(packer, source, tmp_path, codec):
+    packer.codec = codec
+    out = _pack(packer, source, tmp_path)
+    with open(out, "rb") as f:
+        assert f.read(len(BackupPacker.MAGIC)) == BackupPacker.MAGIC
+    header = packer.read_header(out)
+    assert header["chunk_size"] == CHUNK and header["indexed"]
+
+    dest = tmp_path / "restored"
+    index = packer.unpack(out, str(dest), TOKEN)
+    assert _tree(dest / ".enc_cipher") == _tree(source)
+    assert index == packer.read_index(out, TOKEN)
+    assert ".enc_cipher/a/big" in [name for name, _ in index["members"]]
+
+    report = packer.verify(out, TOKEN)
+    assert report["status"] == "ok" and report["index"]
+    assert report["chunks"] > 5
+
+
+def test_round_trip_with_a_password(packer, source, tmp_path):
+    out = _pack(packer, source, tmp_path, password="correct horse")
+    assert packer.read_header(out)["key"]["master"] == "argon2id"
+    dest = tmp_path / "restored"
+    packer.unpack(out, str(dest), "correct horse")
+    assert _tree(dest / ".enc_cipher") == _tree(source)
+
+
+def test_partial_restore(packer, source, tmp_path):
+    out = _pack(packer, source, tmp_path)
+    dest = tmp_path / "restored"
+    packer.unpack(out, str(dest), TOKEN, paths=[".enc_cipher/a/b"])
+    assert _tree(dest / ".enc_cipher") == {"a/b/text": b"hello " * 20000}
+    with pytest.raises(FileNotFoundError):
+        packer.unpack(out, str(tmp_path / "other"), TOKEN, paths=[".enc_cipher/missing"])
+
+
+def test_wrong_password(packer, source, tmp_path):
+    out = _pack(packer, source, tmp_path)
+    with pytest.raises(ValueError):
+        packer.unpack(out, str(tmp_path / "restored"), "cd" * 32)
+    with pytest.raises(ValueError):
+        packer.read_index(out, "cd" * 32)
+
+
+@pytest.mark.parametrize("where", [0.3, 0.6, 0.95])
+def test_tampered_chunk(packer, source, tmp_path, where):
+    out = _pack(packer, source, tmp_path)
+    size = os.path.getsize(out)
+    offset = int(size * where)
+    with open(out, "r+b") as f:
+        f.seek(offset)
+        byte = f.read(1)
+        f.seek(offset)
+        f.write(bytes([byte[0] ^ 0xFF]))
+
+    with pytest.raises(ValueError):
+        packer.unpack(out, str(tmp_path / "restored"), TOKEN)
+    report = packer.verify(out, TOKEN)
+    assert report["status"] == "corrupt"
+    assert any(start <= offset < end for start, end in report["corrupt_ranges"])
+
+
+def test_tampered_header(packer, source, tmp_path):
+    out = _pack(packer, source, tmp_path)
+    with open(out, "rb") as f:
+        data = f.read()
+    # Same length, so only authentication can catch it
+    tampered = data.replace(b'"compression": "none"', b'"compression": "nonE"', 1)
+    assert tampered != data
+    with open(out, "wb") as f:
+        f.write(tampered)
+    with pytest.raises(ValueError):
+        packer.unpack(out, str(tmp_path / "restored"), TOKEN)
+    assert packer.verify(out, TOKEN)["status"] == "corrupt"
+
+
+def test_truncation(packer, source, tmp_path):
+    out = _pack(packer, source, tmp_path)
+    with open(out, "rb") as f:
+        data = f.read()
+    header_end = len(BackupPacker.MAGIC) + 4 + int.from_bytes(data[8:12], "big")
+    cut = tmp_path / "cut.enc"
+    # Mid-header, right after the header, mid-chunk, inside the trailer and without the trailer
+    for length in (10, header_end, header_end + CHUNK // 2, len(data) - 3, len(data) - BackupPacker.TRAILER.size):
+        cut.write_bytes(data[:length])
+        with pytest.raises(ValueError):
+            packer.unpack(str(cut), str(tmp_path / f"restored{length}"), TOKEN)
+        assert packer.verify(str(cut), TOKEN)["status"] == "corrupt"
+
+
+def test_trailing_data(packer, source, tmp_path):
+    out = _pack(packer, source, tmp_path)
+    with open(out, "ab") as f:
+        f.write(b"junk")
+    assert packer.verify(out, TOKEN)["status"] == "corrupt"
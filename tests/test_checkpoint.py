@@ -0,0 +1,83 @@
+import os
+import time
+import datetime
+import pytest
+
+from enc_server import checkpoint
+from enc_server.checkpoint import Checkpointer, load_config
+from enc_server.session import Session
+
+
+class _Auth:
+    def get_user_permissions(self, username):
+        return []
+
+
+@pytest.fixture
+def vault(tmp_path, monkeypatch):
+    """A mounted vault's system/ and sessions/ layout, as Session writes it."""
+    home = tmp_path / "home"
+    (home / ".enc" / "system").mkdir(parents=True)
+    (home / ".enc_config").mkdir()
+    monkeypatch.setenv("HOME", str(home))
+    return home
+
+
+def _checkpointer(home, **config) -> Checkpointer:
+    cp = Checkpointer("alice", dict(checkpoint.DEFAULTS, enabled=True, **config))
+    cp.home = str(home)
+    cp.mount = str(home / ".enc")
+    cp.lock_path = str(home / ".enc_config" / checkpoint.LOCK_NAME)
+    return cp
+
+
+def _age(session: Session, session_id: str, seconds: float):
+    data = session.get_session(session_id)
+    data["updated_at"] = (datetime.datetime.now() - datetime.timedelta(seconds=seconds)).isoformat()
+    session.save_session(data)
+
+
+def test_checkpoints_are_off_by_default():
+    assert load_config("no-such-user")["enabled"] is False
+
+
+def test_last_activity_follows_the_current_session(vault):
+    cp = _checkpointer(vault)
+    assert cp._last_activity() is None
+
+    session = Session()
+    assert session.session_dir == vault / ".enc" / "sessions"
+    session.init_session_storage()
+    session_id = session.create_session("alice", _Auth())["session_id"]
+    assert abs(cp._last_activity() - time.time()) < 5
+
+    _age(session, session_id, 300)
+    assert abs(cp._last_activity() - (time.time() - 300)) < 5
+    session.update_time(session_id)
+    assert abs(cp._last_activity() - time.time()) < 5
+
+    session.logout_session(session_id)
+    assert cp._last_activity() is None
+
+
+def test_run_checkpoints_only_when_idle(vault, monkeypatch):
+    session = Session()
+    session.init_session_storage()
+    session_id = session.create_session("alice", _Auth())["session_id"]
+    cp = _checkpointer(vault, interval=0, idle=60)
+    taken = []
+    cp.checkpoint = lambda: taken.append(cp._last_activity()) or {"status": "success", "kind": "delta"}
+
+    polls = []
+
+    def mounted(path):
+        polls.append(path)
+        if len(polls) == 2:
+            _age(session, session_id, 120)
+        return len(polls) <= 2
+
+    monkeypatch.setattr(checkpoint.os.path, "ismount", mounted)
+    monkeypatch.setattr(checkpoint.time, "sleep", lambda seconds: None)
+    cp.run()
+    assert len(taken) == 1
+    assert time.time() - taken[0] >= 120
@@ -0,0 +1,97 @@
+import os
+import shutil
+from conftest import PASSWORD
+
+CONF = {"gocryptfs.conf": b"conf" * 4096}
+
+
+def _session(vault, files=None, remove=()):
+    """Log in (restoring from the chain), change the vault and log out; returns (kind, tree logged out)."""
+    if not vault.cipher.exists():
+        res = vault.manager().perform_restore_and_mount(PASSWORD)
+        assert res["status"] == "success", res
+    vault.write(files or {})
+    for rel in remove:
+        path = vault.cipher / rel
+        shutil.rmtree(path) if path.is_dir() else path.unlink()
+    tree = vault.tree()
+    res = vault.manager().perform_backup_and_unmount(PASSWORD)
+    assert res["status"] == "success", res
+    return res["kind"], tree
+
+
+def _deltas(vault) -> list:
+    deltas = vault.root / "disk" / "deltas"
+    return sorted(os.listdir(deltas)) if deltas.exists() else []
+
+
+def _restored(vault) -> dict:
+    res = vault.manager().perform_restore_and_mount(PASSWORD)
+    assert res["status"] == "success", res
+    return vault.tree()
+
+
+def test_full_then_deltas_restore(vault):
+    vault.configure({"local": {"path": str(vault.root / "disk")}})
+    vault.write(dict(CONF, **{"d/a": b"v0", "d/b": b"b", "e/x": b"x"}))
+    sessions = [
+        ({}, ()),
+        ({"d/a": b"v1", "d/new": b"n"}, ()),
+        ({}, ("e",)),
+        ({"d/b": b"b2", "e/y": b"y"}, ("d/new",)),
+        ({}, ()),
+    ]
+    results = [_session(vault, files, remove) for files, remove in sessions]
+    assert [kind for kind, _ in results] == ["full", "delta", "delta", "delta", "unchanged"]
+    assert len(_deltas(vault)) == 3
+    assert not vault.cipher.exists()
+    assert _restored(vault) == results[-1][1]
+
+
+def test_rebase_starts_a_new_chain(vault):
+    vault.configure({"local": {"path": str(vault.root / "disk")}, "rebase_every": 2})
+    vault.write(dict(CONF, **{"d/a": b"v0"}))
+    kinds = []
+    for i in range(4):
+        kind, tree = _session(vault, {"d/a": f"v{i + 1}".encode()})
+        kinds.append(kind)
+    assert kinds == ["full", "delta", "delta", "full"]
+    assert _deltas(vault) == []
+    assert _restored(vault) == tree
+
+    kind, tree = _session(vault, {"d/b": b"b"})
+    assert kind == "delta"
+    (name,) = _deltas(vault)
+    assert name.endswith(".000001.enc")
+    assert _restored(vault) == tree
+
+
+def test_restore_paths_applies_the_chain(vault):
+    vault.configure({"local": {"path": str(vault.root / "disk")}, "keep_cipher": True})
+    vault.write(dict(CONF, **{"d/a": b"v0", "d/gone": b"g", "e/x": b"x"}))
+    _session(vault)
+    _session(vault, {"d/a": b"v1"}, ("d/gone",))
+    _, tree = _session(vault, {"d/c": b"c", "e/x": b"x2"})
+
+    # Only d comes back; e keeps what is on disk
+    vault.write({"d/a": b"local", "d/gone": b"stale", "e/x": b"local"})
+    res = vault.manager().restore_paths(PASSWORD, ["d"])
+    assert res["status"] == "success", res
+    restored = vault.tree()
+    assert {k: v for k, v in restored.items() if k.startswith("d/")} == \
+        {k: v for k, v in tree.items() if k.startswith("d/")}
+    assert restored["e/x"] == b"local"
+
+
+def test_restore_stops_at_a_missing_delta(vault):
+    vault.configure({"local": {"path": str(vault.root / "disk")}})
+    vault.write(dict(CONF, **{"d/a": b"v0"}))
+    _session(vault)
+    _, first = _session(vault, {"d/a": b"v1"})
+    _session(vault, {"d/a": b"v2"})
+    _session(vault, {"d/a": b"v3"})
+    deltas = _deltas(vault)
+    assert len(deltas) == 3
+
+    os.remove(vault.root / "disk" / "deltas" / deltas[1])
+    assert _restored(vault) == first
@@ -0,0 +1,88 @@
+import os
+import sys
+import subprocess
+import pytest
+
+import enc_server
+from enc_server.handlers.gdrive_handler import GDriveHandler
+
+MiB = 1024 * 1024
+
+
+@pytest.fixture
+def drive(tmp_path, monkeypatch):
+    """A GDriveHandler against the offline fake rcd, with 1 MiB parts."""
+    root = tmp_path / "remote"
+    (root / "enc_gdrive").mkdir(parents=True)
+    monkeypatch.setenv("ENC_FAKE_RCD_ROOT", str(root))
+    # The rcd runs as its own process and imports enc_server from the same tree
+    src = os.path.dirname(os.path.dirname(enc_server.__file__))
+    monkeypatch.setenv("PYTHONPATH", os.pathsep.join(filter(None, [src, os.environ.get("PYTHONPATH")])))
+    # Short config dir: the rcd socket lives under it
+    handler = GDriveHandler({"rclone": f"{sys.executable} -m enc_server.handlers.fake_rcd", "part_size": 1},
+                            config_dir=str(tmp_path / "c"))
+    handler.remote = root / "enc_gdrive"
+    yield handler
+    rcd = handler._rcd()
+    if rcd:
+        rcd.call("core/quit")
+
+
+def _remote_files(drive) -> set:
+    return {str(p.relative_to(drive.remote)) for p in drive.remote.rglob("*") if p.is_file()}
+
+
+@pytest.mark.parametrize("name", ["user_backup.enc", "deltas/user_backup.delta.abc.000001.enc"])
+def test_multipart_push_pull_delete(drive, tmp_path, name):
+    data = os.urandom(3 * MiB + 5)
+    source = tmp_path / "big.bin"
+    source.write_bytes(data)
+
+    assert drive.push(str(source), name)
+    files = _remote_files(drive)
+    assert f"{name}.parts.json" in files
+    assert len([f for f in files if f.startswith(f"{name}.parts/")]) == 4
+    assert name in drive.list(os.path.dirname(name))
+    assert drive.checksum(name, len(data))
+
+    dest = tmp_path / "out.bin"
+    assert drive.pull(str(dest), name)
+    assert dest.read_bytes() == data
+    assert drive.read_head(name, 10) == data[:10]
+
+    assert drive.delete_many([name])
+    assert _remote_files(drive) == set()
+
+
+def test_pull_rejects_a_corrupt_part(drive, tmp_path):
+    source = tmp_path / "big.bin"
+    source.write_bytes(os.urandom(2 * MiB + 1))
+    assert drive.push(str(source), "user_backup.enc")
+    part = sorted(drive.remote.glob("user_backup.enc.parts/*/*"))[0]
+    with open(part, "ab") as f:
+        f.write(b"x")
+    assert not drive.pull(str(tmp_path / "out.bin"), "user_backup.enc")
+
+
+def test_small_push_replaces_multipart_object(drive, tmp_path):
+    big, small = tmp_path / "big.bin", tmp_path / "small.bin"
+    big.write_bytes(os.urandom(2 * MiB + 1))
+    small.write_bytes(b"small")
+    assert drive.push(str(big), "user_backup.enc")
+    assert drive.push(str(small), "user_backup.enc")
+    assert _remote_files(drive) == {"user_backup.enc"}
+    assert drive.list("") == {"user_backup.enc"}
+    dest = tmp_path / "out.bin"
+    assert drive.pull(str(dest), "user_backup.enc")
+    assert dest.read_bytes() == b"small"
+
+
+def test_list_root_without_rcd(monkeypatch):
+    def lsf(cmd, **kwargs):
+        assert cmd[:4] == ["rclone", "lsf", "-R", "--files-only"]
+        return subprocess.CompletedProcess(cmd, 0, "user_backup.enc\nbig.enc.parts.json\nbig.enc.parts/u/00000\n", "")
+    monkeypatch.setattr(subprocess, "run", lsf)
+    drive = GDriveHandler({"rcd": False})
+    assert drive.list("") == {"user_backup.enc", "big.enc"}
+    assert drive._list_objects("deltas/") == {"deltas/user_backup.enc", "deltas/big.enc.parts.json",
+                                              "deltas/big.enc.parts/u/00000"}
@@ -0,0 +1,37 @@
+import os
+import subprocess
+import pytest
+from conftest import PASSWORD
+
+
+def _leave_snapshot(vault, files):
+    """Back up, then change the tree and set it aside as a background logout whose worker failed would."""
+    vault.configure({"local": {"path": str(vault.root / "disk")}})
+    vault.write({"gocryptfs.conf": b"conf", "d/a": b"old"})
+    assert vault.manager().perform_backup_and_unmount(PASSWORD)["status"] == "success"
+    assert vault.manager().perform_restore_and_mount(PASSWORD)["status"] == "success"
+    vault.write(files)
+    os.rename(vault.cipher, vault.snapshot)
+
+
+def test_failed_login_keeps_logout_snapshot(vault):
+    _leave_snapshot(vault, {"d/a": b"unsaved work"})
+    newest = vault.tree(vault.snapshot)
+
+    with pytest.raises(subprocess.CalledProcessError):
+        vault.manager().perform_restore_and_mount("mistyped")
+    assert vault.snapshot.exists()
+    assert not vault.cipher.exists()
+
+    res = vault.manager().perform_restore_and_mount(PASSWORD)
+    assert res["source"] == "logout-snapshot"
+    assert vault.tree() == newest
+
+
+def test_login_takes_back_logout_snapshot(vault):
+    _leave_snapshot(vault, {"d/b": b"new file"})
+    newest = vault.tree(vault.snapshot)
+    res = vault.manager().perform_restore_and_mount(PASSWORD)
+    assert res["source"] == "logout-snapshot"
+    assert not vault.snapshot.exists()
+    assert vault.tree() == newest
@@ -0,0 +1,54 @@
+import os
+import json
+import stat
+import threading
+from conftest import USER
+from enc_server.status_store import StatusStore
+
+
+def _store(tmp_path):
+    return StatusStore(str(tmp_path / "status"), str(tmp_path / "status.json"))
+
+
+def test_concurrent_updates_are_merged(tmp_path):
+    store = _store(tmp_path)
+
+    def worker(i):
+        for n in range(20):
+            store.update(USER, f"h{i}", status=f"s{n}")
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    data = store.read(USER)
+    assert {k: v["status"] for k, v in data.items()} == {f"h{i}": "s19" for i in range(4)}
+
+
+def test_shard_and_lock_are_private(tmp_path):
+    store = _store(tmp_path)
+    store.update(USER, "local", status="backuped")
+    user_dir = tmp_path / "status" / USER
+    assert stat.S_IMODE(os.lstat(user_dir).st_mode) == 0o700
+    assert sorted(os.listdir(user_dir)) == [".lock", "status.json"]
+    assert sorted(os.listdir(tmp_path / "status")) == [USER]
+
+
+def test_foreign_directory_is_ignored(tmp_path):
+    store = _store(tmp_path)
+    os.makedirs(tmp_path / "elsewhere")
+    with open(tmp_path / "elsewhere" / "status.json", "w") as f:
+        json.dump({"local": {"status": "forged"}}, f)
+    os.makedirs(tmp_path / "status")
+    os.symlink(tmp_path / "elsewhere", tmp_path / "status" / USER)
+    assert store.read(USER) == {}
+
+
+def test_legacy_file_is_the_fallback(tmp_path):
+    with open(tmp_path / "status.json", "w") as f:
+        json.dump({USER: {"gdrive": {"available": True, "status": "backuped"}}}, f)
+    store = _store(tmp_path)
+    assert store.read(USER)["gdrive"]["status"] == "backuped"
+    store.update(USER, "gdrive", available=False)
+    assert store.read(USER)["gdrive"] == {"available": False, "status": "backuped"}
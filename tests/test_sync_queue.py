@@ -0,0 +1,109 @@
+import os
+import json
+import stat
+from conftest import USER, PASSWORD
+from enc_server.backup_manager import BackupManager
+from enc_server.handlers.base_handler import BaseHandler
+from enc_server.sync_daemon import SyncQueue, SyncDaemon, run_job
+
+
+def _remote_only(vault):
+    # A background-only handler: nothing stores artifacts in place, everything goes through the queue
+    vault.configure({"far": {"type": "local", "path": str(vault.root / "far"), "background": True}})
+    vault.write({"gocryptfs.conf": b"conf" * 1024, "d/a": b"v0"})
+
+
+def _logout(vault, files=None):
+    if files:
+        vault.write(files)
+    res = vault.manager().perform_backup_and_unmount(PASSWORD)
+    assert res["status"] == "success", res
+    return res
+
+
+def test_queued_artifacts_keep_their_own_bytes(vault):
+    _remote_only(vault)
+    assert _logout(vault)["kind"] == "full"
+    assert _logout(vault, {"d/a": b"v1"})["kind"] == "delta"
+    assert _logout(vault, {"d/b": b"v2"})["kind"] == "delta"
+    newest = vault.tree()
+
+    queue = SyncQueue(str(vault.queue_dir))
+    job_id = SyncQueue.job_id(USER, "far")
+    items = queue.load(job_id)["items"]
+    assert len({i["source"] for i in items}) == 3
+    assert run_job(job_id, queue)
+    assert queue.load(job_id) is None
+    assert os.listdir(vault.config_dir / BackupManager.OUTGOING_NAME) == []
+
+    bm = vault.manager()
+    chain = bm.ledger.chain()
+    for name, sha256 in chain["objects"].items():
+        assert bm._file_sha256(str(vault.root / "far" / name)) == sha256
+    assert bm.ledger.current("far", chain["tree"])
+
+    os.rename(vault.cipher, vault.root / "old_cipher")
+    assert vault.manager().perform_restore_and_mount(PASSWORD)["source"] == "far"
+    assert vault.tree() == newest
+
+
+def test_daemon_skips_a_source_that_changed(vault):
+    _remote_only(vault)
+    _logout(vault)
+    queue = SyncQueue(str(vault.queue_dir))
+    job_id = SyncQueue.job_id(USER, "far")
+    source = queue.load(job_id)["items"][0]["source"]
+    with open(source, "ab") as f:
+        f.write(b"garbage")
+    assert run_job(job_id, queue)
+    assert not (vault.root / "far" / BaseHandler.BACKUP_NAME).exists()
+    assert not vault.manager().ledger.entry("far")["objects"]
+
+
+def test_unreachable_chain_rebases(vault):
+    _remote_only(vault)
+    _logout(vault)
+    queue = SyncQueue(str(vault.queue_dir))
+    job_id = SyncQueue.job_id(USER, "far")
+    # The base never went up and its staged copy is gone
+    for item in queue.load(job_id)["items"]:
+        os.remove(item["source"])
+    os.remove(queue._path(job_id))
+    res = _logout(vault, {"d/a": b"v1"})
+    assert res["kind"] == "full"
+    assert [i["name"] for i in queue.load(job_id)["items"]] == [BaseHandler.BACKUP_NAME]
+
+
+def test_load_rejects_jobs_naming_another_user(vault):
+    queue = SyncQueue(str(vault.queue_dir))
+    job = queue.enqueue(USER, "far", "/nonexistent", BaseHandler.BACKUP_NAME)
+    assert queue.load(job["id"]) == job
+    path = queue._path(job["id"])
+    with open(path) as f:
+        data = json.load(f)
+    data["user"] = "someone-else"
+    with open(path, "w") as f:
+        json.dump(data, f)
+    assert queue.load(job["id"]) is None
+    assert queue.jobs(USER) == []
+
+
+def test_job_lock_is_private(vault):
+    queue = SyncQueue(str(vault.queue_dir))
+    queue.enqueue(USER, "far", "/nonexistent", BaseHandler.BACKUP_NAME)
+    lock = vault.queue_dir / USER / ".lock"
+    assert stat.S_IMODE(os.lstat(lock).st_mode) == 0o600
+    assert os.listdir(vault.queue_dir) == [USER]
+
+
+def test_daemon_lock_is_private(vault):
+    daemon = SyncDaemon(SyncQueue(str(vault.queue_dir)))
+    assert daemon._acquire()
+    try:
+        path = SyncDaemon.pid_path(daemon.owner, str(vault.queue_dir))
+        assert stat.S_IMODE(os.lstat(path).st_mode) == 0o600
+        assert SyncDaemon.is_running(daemon.owner, str(vault.queue_dir))
+        assert not SyncDaemon(SyncQueue(str(vault.queue_dir)))._acquire()
+    finally:
+        os.close(daemon._pid_file)
+    assert not SyncDaemon.is_running(daemon.owner, str(vault.queue_dir))
@@ -0,0 +1,47 @@
+import os
+from conftest import PASSWORD
+from enc_server.handlers.base_handler import BaseHandler
+
+
+def _chain(vault):
+    """A full backup and two deltas on a local disk; returns the trees after each of them."""
+    vault.configure({"local": {"path": str(vault.root / "disk")}, "keep_cipher": True})
+    trees = []
+    for files in ({"gocryptfs.conf": b"conf" * 4096, "d/a": b"v0"}, {"d/a": b"v1"}, {"d/b": b"v2"}):
+        vault.write(files)
+        res = vault.manager().perform_backup_and_unmount(PASSWORD)
+        assert res["status"] == "success", res
+        trees.append(vault.tree())
+    names = sorted(os.listdir(vault.root / "disk" / "deltas"))
+    assert len(names) == 2
+    return trees, [f"deltas/{n}" for n in names]
+
+
+def _flip_byte(path):
+    with open(path, "r+b") as f:
+        f.seek(os.path.getsize(path) // 2)
+        byte = f.read(1)
+        f.seek(-1, os.SEEK_CUR)
+        f.write(bytes([byte[0] ^ 0xFF]))
+
+
+def test_verify_covers_every_delta(vault):
+    _, deltas = _chain(vault)
+    report = vault.manager().verify_backups(PASSWORD)["local"]
+    assert report["status"] == "ok"
+    assert sorted(report["objects"]) == sorted([BaseHandler.BACKUP_NAME] + deltas)
+
+    _flip_byte(vault.root / "disk" / deltas[1])
+    report = vault.manager().verify_backups(PASSWORD)["local"]
+    assert report["status"] == "corrupt"
+    assert report["objects"][deltas[1]]["status"] == "corrupt"
+    assert report["objects"][deltas[0]]["status"] == "ok"
+
+
+def test_restore_stops_before_a_corrupt_delta(vault):
+    trees, deltas = _chain(vault)
+    _flip_byte(vault.root / "disk" / deltas[1])
+    os.rename(vault.cipher, vault.root / "old_cipher")
+    res = vault.manager().perform_restore_and_mount(PASSWORD)
+    assert res["status"] == "success"
+    assert vault.tree() == trees[1]